@@ -0,0 +1,304 @@
+import itertools
+import operator
+from collections import Counter
+from datetime import date, timedelta
+from database_pool import get_pool
+from timestamps import DATE_FORMAT, day_end, day_start, now
+
+DAY = 86400
+DEFAULT_DAYS = 30  # Window when no dates are given: the last 30 days including today
+RETURN_CONDITIONS = ('good', 'damaged', 'broken')
+BUCKETS = 30000    # Peaks are narrowed down to one of about this many slices of the window first
+MIN_BUCKET = 60    # (but none shorter than a minute - see find_peak)
+
+# The adding up is done by SQLite: Python gets one row per tool, one per day
+# and the events of the few buckets a peak could be in - not a row per checkout.
+# A checkout counts as out from max(checkout, :start) to
+# min(return or :measured_end, :measured_end), and as returned if that was before :end
+# The two group_concat() columns list which :bucket (seconds from :start) each start and
+# end falls in, for the peaks. Ends at :measured_end or later are left out -
+# they come after every start, so they can't change a peak
+# Then one column per return condition (RETURN_CONDITIONS order)
+CONDITION_COUNTS = ',\n           '.join(f"SUM(x.return_date < :end AND x.condition_on_return = '{condition}')"
+                                         for condition in RETURN_CONDITIONS)
+
+# Per tool: checkouts that started in the window [:start, :end)
+# Driven from tools so each tool's checkouts are one range of
+# idx_transactions_tool (migration 15 - it holds every column used here), read
+# in tool order, and the GROUP BY doesn't have to sort anything
+# (so a checkout of a tool that's gone from tools isn't counted - nothing deletes tools)
+STARTED_TOTALS = f'''
+    SELECT tools.tool_id, COUNT(*), 0,
+           SUM(CASE WHEN x.return_date < :measured_end THEN x.return_date
+                    WHEN x.checkout_date < :measured_end THEN :measured_end
+                    ELSE x.checkout_date END - x.checkout_date),
+           SUM(x.return_date < :end),
+           SUM(CASE WHEN x.return_date < :end THEN x.return_date - x.checkout_date END),
+           group_concat(CASE WHEN x.checkout_date < :measured_end THEN (x.checkout_date - :start) / :bucket END),
+           group_concat(CASE WHEN x.return_date < :measured_end THEN (x.return_date - :start) / :bucket END),
+           {CONDITION_COUNTS}
+    FROM tools CROSS JOIN transactions x
+    ON x.tool_id = tools.tool_id AND x.checkout_date >= :start AND x.checkout_date < :end
+    GROUP BY tools.tool_id
+'''
+
+# Per tool: checkouts already out when the window starts (returned after
+# :start, or still out). Two date index ranges (migration 11); there are only
+# ever about as many of these as there are tools
+# They count as starting right at :start - see carried_in in get_utilization
+CARRIED_TOTALS = f'''
+    SELECT x.tool_id, 0, COUNT(*),
+           SUM(MIN(IFNULL(x.return_date, :measured_end), :measured_end) - :start),
+           SUM(x.return_date < :end),
+           SUM(CASE WHEN x.return_date < :end THEN x.return_date - x.checkout_date END),
+           NULL,
+           group_concat(CASE WHEN x.return_date < :measured_end THEN (x.return_date - :start) / :bucket END),
+           {CONDITION_COUNTS}
+    FROM (SELECT tool_id, checkout_date, return_date, condition_on_return FROM transactions
+          WHERE return_date > :start AND checkout_date < :start
+          UNION ALL
+          SELECT tool_id, checkout_date, return_date, condition_on_return FROM transactions
+          WHERE return_date IS NULL AND checkout_date < :start) x
+    JOIN tools ON tools.tool_id = x.tool_id
+    GROUP BY x.tool_id
+'''
+
+# Starts and ends inside [:from, :until) - one day for the daily hours, one
+# bucket for a peak. Each is a range of a date index (migration 11)
+# The returns must belong to the window: started in it, or returned after it started
+DAY_STARTS = '''
+    SELECT COUNT(*), SUM(checkout_date) FROM transactions
+    WHERE checkout_date >= :from AND checkout_date < :until
+'''
+DAY_ENDS = '''
+    SELECT COUNT(*), SUM(return_date) FROM transactions
+    WHERE return_date >= :from AND return_date < :until AND (checkout_date >= :start OR return_date > :start)
+'''
+BUCKET_EVENTS = '''
+    SELECT checkout_date, 1, tool_id FROM transactions
+    WHERE checkout_date >= :from AND checkout_date < :until
+    UNION ALL
+    SELECT return_date, 0, tool_id FROM transactions
+    WHERE return_date >= :from AND return_date < :until AND (checkout_date >= :start OR return_date > :start)
+'''
+
+class Usage:
+    # Totals for one tool or one category over the report window
+    __slots__ = ('key', 'name', 'category', 'checkouts', 'seconds_out', 'returns', 'return_seconds',
+                 'condition_counts', 'peak', 'peak_at')
+
+    def __init__(self, key, name="", category=""):
+        self.key = key                # tool_id or category
+        self.name = name
+        self.category = category
+        self.checkouts = 0            # Checkouts that started in the window
+        self.seconds_out = 0          # Time checked out inside the window
+        self.returns = 0              # Returns in the window...
+        self.return_seconds = 0       # ...and how long those checkouts lasted in total
+        self.condition_counts = [0] * len(RETURN_CONDITIONS)  # ...and what condition they came back in
+        self.peak = 0                 # Most out at the same time (categories only)
+        self.peak_at = 0
+
+    def add(self, other):
+        self.checkouts += other.checkouts
+        self.seconds_out += other.seconds_out
+        self.returns += other.returns
+        self.return_seconds += other.return_seconds
+        for index, count in enumerate(other.condition_counts):
+            self.condition_counts[index] += count
+
+    def to_dict(self, window_seconds):
+        days = window_seconds / DAY
+        return {'key': self.key, 'name': self.name, 'category': self.category,
+                'checkouts': self.checkouts, 'returns': self.returns,
+                'hours_out': self.seconds_out / 3600,
+                'hours_per_day': self.seconds_out / 3600 / days if days else 0.0,
+                'mean_hours': self.return_seconds / self.returns / 3600 if self.returns else None,
+                'condition_rates': {condition: count / self.returns if self.returns else 0.0
+                                    for condition, count in zip(RETURN_CONDITIONS, self.condition_counts)},
+                'peak': self.peak, 'peak_at': self.peak_at}
+
+def bucket_counts(texts, buckets):
+    # group_concat() lists of bucket numbers ("3,3,17") -> how many in each bucket
+    # All joined up and counted as text in one go (Counter and split run in C),
+    # then only the distinct buckets are turned into numbers
+    counts = [0] * buckets
+    if texts:
+        for bucket, count in Counter(','.join(texts).split(',')).items():
+            counts[int(bucket)] = count
+    return counts
+
+class UtilizationReport:
+    # Tool utilization for a date window: hours out per day, mean checkout
+    # length, peak concurrency and condition on return, per tool and per category
+    # SQLite adds up the checkouts per tool (STARTED_TOTALS, CARRIED_TOTALS) and
+    # per day (seconds_out_by); peaks come from counts per bucket (find_peak)
+    # bench_utilization.py times it on a 10 million checkout database
+    def __init__(self, db_name='equipment_checkout.db'):
+        self.pool = get_pool(db_name)
+
+    def window(self, start_date=None, end_date=None):
+        # 'YYYY-MM-DD' dates (end included) -> (start, end) Unix times
+        # Raises ValueError for a bad date, like Report.transaction_filters
+        today = date.today()
+        end_date = end_date or today.strftime(DATE_FORMAT)
+        start_date = start_date or (today - timedelta(days=DEFAULT_DAYS - 1)).strftime(DATE_FORMAT)
+        try:
+            start, end = day_start(start_date), day_end(end_date)
+        except ValueError:
+            raise ValueError("Dates must look like YYYY-MM-DD") from None
+        if end <= start:
+            raise ValueError("The end date is before the start date")
+        return start, end
+
+    def day_boundaries(self, start, end):
+        # Local midnights from start to end (a day isn't always 86400s with daylight saving)
+        boundaries = [start]
+        day = date.fromtimestamp(start)
+        while boundaries[-1] < end:
+            day += timedelta(days=1)
+            boundaries.append(min(day_start(day.strftime(DATE_FORMAT)), end))
+        return boundaries
+
+    def seconds_out_by(self, conn, start, measured_end, carried_in, boundaries):
+        # Total checked-out seconds before each time in boundaries (sorted)
+        # Before time T (or measured_end, if that's sooner - nothing is out after
+        # it): every start before T adds (T - start) and every end before T takes
+        # back (T - end). So all it needs is the count and sum of the starts and
+        # of the ends up to each boundary, which SQLite adds up a day at a time.
+        # The ones already out at start all start at start
+        started, started_sum = carried_in, carried_in * start
+        ended = ended_sum = 0
+        result = [0]
+        for since, until in zip(boundaries, boundaries[1:]):
+            until = min(until, measured_end)
+            if since < until:
+                params = {'start': start, 'from': since, 'until': until}
+                count, total = conn.execute(DAY_STARTS, params).fetchone()
+                started, started_sum = started + count, started_sum + (total or 0)
+                count, total = conn.execute(DAY_ENDS, params).fetchone()
+                ended, ended_sum = ended + count, ended_sum + (total or 0)
+            result.append(started * until - started_sum - (ended * until - ended_sum))
+        return result
+
+    def find_peak(self, conn, start, measured_end, bucket_size, starts, ends, carried_in, tool_ids):
+        # Most checkouts open at the same moment, and when: (peak, time)
+        # starts[n]/ends[n] count the checkouts starting/ending in the n-th
+        # bucket_size seconds of the window (carried_in of the starts are the ones
+        # already out, at start itself). When a bucket begins, every start before
+        # it minus every end before it are out, so no moment inside it can have
+        # more than that plus its own starts. The most promising bucket is gone
+        # through one event at a time first, then only the others that could still
+        # beat it - a few dozen buckets' events, not the whole window's
+        # (BUCKET_EVENTS has every category's; tool_ids picks out this one's)
+        out_before = [0, *itertools.accumulate(map(operator.sub, starts, ends))]
+        limits = list(map(operator.add, out_before, starts))
+        peak, peak_at = 0, 0
+
+        def sweep(bucket):
+            nonlocal peak, peak_at
+            since = start + bucket * bucket_size
+            events = [(time, started) for time, started, tool_id in conn.execute(
+                BUCKET_EVENTS, {'start': start, 'from': since, 'until': min(since + bucket_size, measured_end)})
+                if tool_id in tool_ids]
+            if bucket == 0:
+                events.extend([(start, 1)] * carried_in)
+            # Ends before starts at the same second - it's back before the next one goes out
+            events.sort()
+            out = out_before[bucket]
+            for time, started in events:
+                if not started:
+                    out -= 1
+                    continue
+                out += 1
+                if out > peak or (out == peak and time < peak_at):
+                    peak, peak_at = out, time
+
+        first = max(itertools.compress(range(len(starts)), starts), key=limits.__getitem__, default=None)
+        if first is None:
+            return peak, peak_at  # Nothing went out
+        sweep(first)
+        for limit, bucket in sorted((-limits[bucket], bucket) for bucket in range(len(starts))
+                                    if starts[bucket] and limits[bucket] >= peak and bucket != first):
+            if -limit < peak:
+                break
+            if -limit == peak and start + bucket * bucket_size >= peak_at:
+                continue  # Could only tie, and not any earlier
+            sweep(bucket)
+        return peak, peak_at
+
+    def get_utilization(self, start_date=None, end_date=None, current_time=None):
+        start, end = self.window(start_date, end_date)
+        current_time = current_time or now()
+        # Time after "now" hasn't happened yet - don't count it as idle
+        measured_end = min(end, max(current_time, start))
+        window_seconds = measured_end - start
+        bucket_size = max(MIN_BUCKET, window_seconds // BUCKETS)
+        params = {'start': start, 'end': end, 'measured_end': measured_end, 'bucket': bucket_size}
+
+        tools = {}       # tool_id -> Usage
+        starts = {}      # category -> group_concat()s of start buckets
+        ends = {}        # category -> group_concat()s of end buckets
+        carried_in = Counter()  # category -> checkouts already out at start
+        tool_ids = {}    # category -> its tool_ids
+        with self.pool.connection() as conn:
+            tool_info = {row[0]: row[1:] for row in conn.execute('SELECT tool_id, tool_name, category FROM tools')}
+            for query in (STARTED_TOTALS, CARRIED_TOTALS):
+                for row in conn.execute(query, params):
+                    tool_id, checkouts, carried, seconds_out, returns, return_seconds, started, ended, *conditions = row
+                    usage = tools.get(tool_id)
+                    if usage is None:
+                        tool_name, category = tool_info.get(tool_id, ("", ""))
+                        usage = tools[tool_id] = Usage(tool_id, tool_name or "", category or "")
+                        starts.setdefault(usage.category, [])
+                        ends.setdefault(usage.category, [])
+                        tool_ids.setdefault(usage.category, set()).add(tool_id)
+                    usage.checkouts += checkouts
+                    usage.seconds_out += seconds_out or 0
+                    usage.returns += returns or 0
+                    usage.return_seconds += return_seconds or 0
+                    for index, count in enumerate(conditions):
+                        usage.condition_counts[index] += count or 0
+                    if started:
+                        starts[usage.category].append(started)
+                    if ended:
+                        ends[usage.category].append(ended)
+                    if measured_end > start:
+                        carried_in[usage.category] += carried
+
+            # Category totals are the sum of their tools, and so are the bucket counts
+            categories = {}
+            for usage in tools.values():
+                total = categories.get(usage.category)
+                if total is None:
+                    total = categories[usage.category] = Usage(usage.category, usage.category or "(none)")
+                total.add(usage)
+            everything = Usage("", "All tools")
+            buckets = -(-window_seconds // bucket_size)
+            all_starts, all_ends = [0] * buckets, [0] * buckets
+            for category, total in categories.items():
+                category_starts = bucket_counts(starts[category], buckets)
+                category_ends = bucket_counts(ends[category], buckets)
+                if carried_in[category]:
+                    category_starts[0] += carried_in[category]
+                total.peak, total.peak_at = self.find_peak(conn, start, measured_end, bucket_size, category_starts,
+                                                           category_ends, carried_in[category], tool_ids[category])
+                everything.add(total)
+                all_starts = list(map(operator.add, all_starts, category_starts))
+                all_ends = list(map(operator.add, all_ends, category_ends))
+            everything.peak, everything.peak_at = self.find_peak(conn, start, measured_end, bucket_size, all_starts,
+                                                                 all_ends, sum(carried_in.values()), tools)
+
+            # Fleet hours out on each day of the window
+            boundaries = self.day_boundaries(start, end)
+            totals = self.seconds_out_by(conn, start, measured_end, sum(carried_in.values()), boundaries)
+        daily = [{'day': boundaries[index], 'hours_out': (totals[index + 1] - totals[index]) / 3600}
+                 for index in range(len(boundaries) - 1)]
+
+        return {'start': start, 'end': end, 'window_seconds': window_seconds,
+                'total': everything.to_dict(window_seconds),
+                'categories': sorted((usage.to_dict(window_seconds) for usage in categories.values()),
+                                     key=lambda usage: (-usage['hours_out'], usage['key'])),
+                'tools': sorted((usage.to_dict(window_seconds) for usage in tools.values()),
+                                key=lambda usage: (-usage['hours_out'], usage['key'])),
+                'daily': daily}
\ No newline at end of file
@@ -0,0 +1,84 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from checkout_system import CheckoutSystem
+from report import Report
+
+class AsyncCheckoutSystem:
+    # asyncio version of CheckoutSystem, for running under an ASGI server
+    # It doesn't have its own checkout rules - it calls the same
+    # prepare/save/finish steps as CheckoutSystem, so both always agree.
+    # sqlite3 only blocks, so database reads run on a small thread pool here.
+    # The slow part of a checkout (waiting for the commit) doesn't hold a
+    # thread at all: we await the DatabaseWriter's Future, so thousands of
+    # scanners can be waiting on the same group commit at once
+    def __init__(self, system=None, report=None, max_db_threads=8):
+        self.system = system or CheckoutSystem()
+        self.report = report or Report(self.system.db_name)
+        self.executor = ThreadPoolExecutor(max_workers=max_db_threads, thread_name_prefix="AsyncDB")
+
+    async def run_blocking(self, function, *args, **kwargs):
+        # Run a blocking call on our database threads and wait for it without blocking the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def run_write(self, operation):
+        # Like DatabaseWriter.run_now, but awaits the commit instead of blocking a thread
+        return await asyncio.wrap_future(self.system.writer.submit(operation))
+
+    async def authenticate_user(self, username, password):
+        # Raises LoginBusyError like the normal version
+        return await self.run_blocking(self.system.authenticate_user, username, password)
+
+    async def get_employee(self, employee_id):
+        return await self.run_blocking(self.system.get_employee, employee_id)
+
+    async def process_checkout(self, employee, barcode):
+        return (await self.process_checkout_many(employee, [barcode]))[0]
+
+    async def process_checkout_many(self, employee, barcodes):
+        # Same steps as CheckoutSystem.process_checkout_many
+        results, claims = await self.run_blocking(self.system.prepare_checkouts, employee, barcodes)
+        if not claims:
+            return results
+        claimed = await self.run_write(lambda conn: self.system.save_checkouts(conn, employee, claims))
+        if all(claimed):
+            # Only updates our copy in memory - quick enough to do right here
+            return self.system.finish_checkouts(employee, results, claims, claimed)
+        # Lost ones get re-read from the database
+        return await self.run_blocking(self.system.finish_checkouts, employee, results, claims, claimed)
+
+    async def process_return(self, employee, barcode, condition="good", notes=""):
+        return (await self.process_return_many(employee, [barcode], condition, notes))[0]
+
+    async def process_return_many(self, employee, barcodes, condition="good", notes="", conditions=None):
+        # Same steps as CheckoutSystem.process_return_many
+        results, returns = await self.run_blocking(self.system.prepare_returns, employee, barcodes,
+                                                   condition, conditions)
+        if not returns:
+            return results
+        returned = await self.run_write(lambda conn: self.system.save_returns(conn, employee, returns, notes))
+        if all(returned):
+            return self.system.finish_returns(employee, results, returns, returned)
+        return await self.run_blocking(self.system.finish_returns, employee, results, returns, returned)
+
+    async def refresh_if_stale(self):
+        await self.run_blocking(self.system.refresh_if_stale)
+
+    # Report queries - same arguments as the Report methods
+    async def get_tool_status_counts(self, category=None):
+        return await self.run_blocking(self.report.get_tool_status_counts, category)
+
+    async def get_tools_page(self, after="", page_size=100, status=None, category=None):
+        return await self.run_blocking(self.report.get_tools_page, after, page_size, status, category)
+
+    async def get_checkout_counts(self, start_date=None, end_date=None, employee_id=None):
+        return await self.run_blocking(self.report.get_checkout_counts, start_date, end_date, employee_id)
+
+    async def get_transactions_page(self, after="", page_size=100, start_date=None, end_date=None, employee_id=None):
+        return await self.run_blocking(self.report.get_transactions_page, after, page_size,
+                                       start_date, end_date, employee_id)
+
+    def close(self):
+        # Let running database calls finish, then stop the threads
+        self.executor.shutdown(wait=True)
\ No newline at end of file
@@ -0,0 +1,119 @@
+# Timing check for the utilization report (analytics.py) on a big database
+# Fills a scratch database with TRANSACTIONS checkouts of TOOLS tools over the
+# last year (each tool out to one person at a time, back after a few hours,
+# the last one of some still out), then times the report for the last 30 days
+# and for the whole year and checks its totals against plain SQL counts.
+# Runs in a scratch copy of the database, so the real one isn't touched.
+# Run with: python bench_utilization.py [transactions] [tools]
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from timestamps import DATE_FORMAT, now
+
+TRANSACTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+TOOLS = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+CATEGORIES = ['Hand Tools', 'Power Tools', 'Measuring', 'Lifting', 'Safety']
+CONDITIONS = ['good'] * 18 + ['damaged', 'broken']  # Mostly good
+YEAR = 365 * 86400
+CHUNK = 100000  # Rows per executemany
+INSERT_TRANSACTION = '''
+    INSERT INTO transactions (transaction_id, employee_id, tool_id, transaction_type,
+                              checkout_date, return_date, condition_on_return, notes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, '')
+'''
+
+def transaction_rows(current_time):
+    # TRANSACTIONS rows for the transactions table, tool by tool: back-to-back
+    # checkouts spread over the last year, and some tools' last one still out
+    number = 0
+    for tool in range(TOOLS):
+        count = TRANSACTIONS // TOOLS + (tool < TRANSACTIONS % TOOLS)
+        period = YEAR // max(count, 1)
+        period_start = current_time - YEAR
+        for checkout in range(count):
+            checked_out = period_start + random.randrange(period // 2)
+            returned = checked_out + random.randrange(period // 4, period // 2)
+            period_start += period
+            row = (f'TXNBENCH{number:010d}', f'EMP{number % 3 + 1:03d}', f'BENCH{tool:05d}')
+            number += 1
+            if checkout == count - 1 and random.random() < 0.3:
+                yield row + ('checkout', checked_out, None, None)
+            else:
+                yield row + ('return', checked_out, returned, random.choice(CONDITIONS))
+
+def fill(current_time):
+    # Sample database plus TOOLS tools and TRANSACTIONS checkouts
+    import database_setup
+    database_setup.create_database()
+    conn = sqlite3.connect('equipment_checkout.db')
+    conn.executemany('''
+        INSERT INTO tools (tool_id, barcode, tool_name, category) VALUES (?, ?, ?, ?)
+    ''', [(f'BENCH{number:05d}', f'BB{number:06d}', f'Bench Tool {number}', CATEGORIES[number % len(CATEGORIES)])
+          for number in range(TOOLS)])
+    # Build the transactions indexes once at the end instead of row by row
+    indexes = conn.execute('''
+        SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL
+    ''').fetchall()
+    for name, sql in indexes:
+        conn.execute(f'DROP INDEX {name}')
+    rows = transaction_rows(current_time)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK))
+        if not chunk:
+            break
+        conn.executemany(INSERT_TRANSACTION, chunk)
+    for name, sql in indexes:
+        conn.execute(sql)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+def expected(conn, start, end, current_time):
+    # What the report's totals should be, counted the slow and obvious way
+    # (reads every row - that's the point)
+    return conn.execute('''
+        SELECT SUM(checkout_date >= :start),
+               SUM(return_date < :end),
+               SUM(CASE WHEN checkout_date < :measured_end
+                   THEN MIN(IFNULL(return_date, :measured_end), :measured_end) - MAX(checkout_date, :start)
+                   ELSE 0 END)
+        FROM transactions NOT INDEXED
+        WHERE checkout_date < :end AND (checkout_date >= :start OR return_date > :start OR return_date IS NULL)
+    ''', {'start': start, 'end': end, 'measured_end': min(end, current_time)}).fetchone()
+
+def main():
+    os.chdir(tempfile.mkdtemp(prefix='bench_utilization_'))
+    current_time = now()
+    started = time.perf_counter()
+    fill(current_time)
+    print(f"{TRANSACTIONS} checkouts of {TOOLS} tools made in {time.perf_counter() - started:.0f}s")
+
+    from analytics import UtilizationReport
+    report = UtilizationReport()
+    conn = sqlite3.connect('equipment_checkout.db')
+    year_start = (date.today() - timedelta(days=364)).strftime(DATE_FORMAT)
+    failures = 0
+    for label, start_date in [("last 30 days", None), ("whole year", year_start)]:
+        started = time.perf_counter()
+        result = report.get_utilization(start_date, current_time=current_time)
+        elapsed = time.perf_counter() - started
+        total = result['total']
+        print(f"{label}: {elapsed:.2f}s - {total['checkouts']} checkouts, {total['hours_out']:.0f} hours out, "
+              f"peak {total['peak']}, {len(result['tools'])} tools")
+        checkouts_in, returns, seconds_out = expected(conn, result['start'], result['end'], current_time)
+        daily_hours = sum(day['hours_out'] for day in result['daily'])
+        if (total['checkouts'], total['returns']) != (checkouts_in, returns) \
+                or abs(total['hours_out'] - seconds_out / 3600) > 0.01 or abs(daily_hours - seconds_out / 3600) > 0.01:
+            failures += 1
+            print(f"  FAIL totals don't match a plain count ({checkouts_in} checkouts, {returns} returns, "
+                  f"{seconds_out / 3600:.0f} hours out)")
+    conn.close()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
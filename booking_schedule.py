@@ -0,0 +1,258 @@
+import bisect     # Binary search in the sorted booking lists
+import logging
+from array import array  # Packed 8-byte ints - a million bookings' times in 16MB
+import threading
+import time
+from id_generator import booking_ids
+
+logger = logging.getLogger(__name__)
+
+# Columns we read for a booking, in the order booking rows come back
+BOOKING_COLUMNS = 'booking_id, tool_id, employee_id, starts_at, ends_at, purpose, cancelled, change_seq'
+
+# Bookings up to this long go in WindowIndex's sorted list; longer ones are
+# few and are kept to the side (see WindowIndex)
+MAX_SHORT_BOOKING = 24 * 3600
+
+class ToolBookings:
+    # One tool's bookings, sorted by start time
+    # A tool's bookings never overlap, so sorted by start is also sorted by
+    # end - that means one binary search finds the only booking that could
+    # clash with a new time window
+    __slots__ = ('starts', 'ends', 'booking_ids')
+
+    def __init__(self):
+        self.starts = []       # starts_at of each booking
+        self.ends = []         # ends_at of each booking (same order)
+        self.booking_ids = []
+
+    def find_overlap(self, starts_at, ends_at):
+        # Position of a booking overlapping [starts_at, ends_at), or -1 - O(log n)
+        # The first booking that ends after we start is the only one to check
+        position = bisect.bisect_right(self.ends, starts_at)
+        if position < len(self.starts) and self.starts[position] < ends_at:
+            return position
+        return -1
+
+    def add(self, booking_id, starts_at, ends_at):
+        position = bisect.bisect_left(self.starts, starts_at)
+        self.starts.insert(position, starts_at)
+        self.ends.insert(position, ends_at)
+        self.booking_ids.insert(position, booking_id)
+
+    def remove(self, booking_id, starts_at):
+        position = bisect.bisect_left(self.starts, starts_at)
+        while position < len(self.booking_ids) and self.booking_ids[position] != booking_id:
+            position += 1
+        if position < len(self.booking_ids):
+            del self.starts[position]
+            del self.ends[position]
+            del self.booking_ids[position]
+
+    def between(self, starts_at, ends_at):
+        # IDs of every booking overlapping [starts_at, ends_at), in time order
+        position = bisect.bisect_right(self.ends, starts_at)
+        found = []
+        while position < len(self.starts) and self.starts[position] < ends_at:
+            found.append(self.booking_ids[position])
+            position += 1
+        return found
+
+class WindowIndex:
+    # Every booking in the catalog sorted by start time, for "what is booked
+    # between t1 and t2?" across all tools at once
+    # A booking overlapping the window must start before the window ends, and
+    # (if it's at most MAX_SHORT_BOOKING long) no earlier than MAX_SHORT_BOOKING
+    # before the window starts - so two binary searches narrow it down to
+    # about a day's worth of bookings instead of the whole year
+    def __init__(self):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.tool_ids = []
+        self.booking_ids = []
+        self.long_bookings = {}  # booking_id -> (tool_id, starts_at, ends_at) for the few long ones
+
+    def add(self, booking_id, tool_id, starts_at, ends_at):
+        if ends_at - starts_at > MAX_SHORT_BOOKING:
+            self.long_bookings[booking_id] = (tool_id, starts_at, ends_at)
+            return
+        position = bisect.bisect_right(self.starts, starts_at)  # Loading in start order appends
+        self.starts.insert(position, starts_at)
+        self.ends.insert(position, ends_at)
+        self.tool_ids.insert(position, tool_id)
+        self.booking_ids.insert(position, booking_id)
+
+    def remove(self, booking_id, starts_at):
+        if self.long_bookings.pop(booking_id, None):
+            return
+        position = bisect.bisect_left(self.starts, starts_at)
+        while position < len(self.booking_ids) and self.booking_ids[position] != booking_id:
+            position += 1
+        if position < len(self.booking_ids):
+            del self.starts[position]
+            del self.ends[position]
+            del self.tool_ids[position]
+            del self.booking_ids[position]
+
+    def busy_tools(self, starts_at, ends_at):
+        # Set of tool_ids with any booking overlapping [starts_at, ends_at)
+        first = bisect.bisect_left(self.starts, starts_at - MAX_SHORT_BOOKING)
+        last = bisect.bisect_left(self.starts, ends_at)
+        ends = self.ends
+        tool_ids = self.tool_ids
+        busy = {tool_ids[position] for position in range(first, last) if ends[position] > starts_at}
+        for tool_id, long_start, long_end in self.long_bookings.values():
+            if long_start < ends_at and long_end > starts_at:
+                busy.add(tool_id)
+        return busy
+
+class BookingSchedule:
+    # Tools booked ahead of time for a window, like a scheduled maintenance job
+    # (checkout_system handles taking a tool NOW; this is for later)
+    # The database has the final say on clashes - the check runs inside the
+    # same write as the insert, so two workers can't double book a tool.
+    # Our in-memory index answers "is it free?" and "which drills are free
+    # Tuesday 8-12?" without asking the database at all.
+    # Times are Unix seconds; a booking covers starts_at up to (not including) ends_at
+    def __init__(self, system):
+        self.system = system          # CheckoutSystem - for the tools and the shared pool/writer
+        self.pool = system.pool
+        self.writer = system.writer
+        self.lock = threading.Lock()  # Protects the two dictionaries below
+        self.tool_bookings = {}       # tool_id -> ToolBookings
+        self.window_index = WindowIndex()  # All bookings by start time, for free_tools()
+        self.bookings = {}            # booking_id -> (tool_id, starts_at, ends_at, employee_id, purpose)
+        self.last_change_seq = 0      # booking_state.change_seq we're up to date with
+
+    def load(self):
+        # Bookings that haven't finished yet - old ones can't clash with anything
+        with self.pool.connection() as conn:
+            change_seq = conn.execute('SELECT change_seq FROM booking_state WHERE id = 1').fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT {BOOKING_COLUMNS} FROM tool_bookings
+                WHERE cancelled = 0 AND ends_at > ? ORDER BY starts_at
+            ''', (int(time.time()),))
+            with self.lock:
+                self.tool_bookings = {}
+                self.window_index = WindowIndex()
+                self.bookings = {}
+                for row in rows:  # One row at a time - a year of bookings is a lot of rows
+                    self.apply_row(row)
+                self.last_change_seq = change_seq
+        logger.info("Loaded %d upcoming bookings", len(self.bookings))
+
+    def refresh(self):
+        # Pick up bookings made or cancelled by other worker processes
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {BOOKING_COLUMNS} FROM tool_bookings
+                WHERE change_seq > ? ORDER BY change_seq
+            ''', (self.last_change_seq,)).fetchall()
+        with self.lock:
+            for row in rows:
+                self.apply_row(row)
+                self.last_change_seq = max(self.last_change_seq, row[7])
+        return len(rows)
+
+    def apply_row(self, row):
+        # Make our index match one database row (caller holds self.lock)
+        booking_id, tool_id, employee_id, starts_at, ends_at, purpose, cancelled = row[:7]
+        old = self.bookings.pop(booking_id, None)
+        if old is not None:
+            self.tool_bookings[old[0]].remove(booking_id, old[1])
+            self.window_index.remove(booking_id, old[1])
+        if not cancelled:
+            self.tool_bookings.setdefault(tool_id, ToolBookings()).add(booking_id, starts_at, ends_at)
+            self.window_index.add(booking_id, tool_id, starts_at, ends_at)
+            self.bookings[booking_id] = (tool_id, starts_at, ends_at, employee_id or "", purpose or "")
+
+    def book_tool(self, tool_id, employee_id, starts_at, ends_at, purpose=""):
+        # Book a tool for [starts_at, ends_at)
+        # Returns the booking ID, or None if it's already booked for part of that time
+        if ends_at <= starts_at:
+            raise ValueError("Booking must end after it starts")
+        if tool_id not in self.system.tools_by_id:
+            raise ValueError(f"Unknown tool: {tool_id}")
+        # Most clashes can be turned down without a database write
+        if self.find_conflict(tool_id, starts_at, ends_at):
+            return None
+
+        booking_id = booking_ids.next_id()
+
+        def book(conn):
+            # Runs on the writer thread - check and insert in the same transaction
+            clash = conn.execute('''
+                SELECT booking_id FROM tool_bookings
+                WHERE tool_id = ? AND cancelled = 0 AND ends_at > ? AND starts_at < ? LIMIT 1
+            ''', (tool_id, starts_at, ends_at)).fetchone()
+            if clash:
+                return None
+            conn.execute('''
+                INSERT INTO tool_bookings (booking_id, tool_id, employee_id, starts_at, ends_at, purpose)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (booking_id, tool_id, employee_id, starts_at, ends_at, purpose))
+            return conn.execute(f'SELECT {BOOKING_COLUMNS} FROM tool_bookings WHERE booking_id = ?',
+                                (booking_id,)).fetchone()
+
+        row = self.writer.run_now(book)
+        if row is None:
+            logger.info("Booking refused - %s already booked by another worker", tool_id)
+            self.refresh()  # Learn about the booking we didn't know about
+            return None
+        with self.lock:
+            self.apply_row(row)
+        logger.info("Booked %s for %s (%s)", tool_id, employee_id, booking_id)
+        return booking_id
+
+    def cancel_booking(self, booking_id):
+        # False if there's no such booking (or it was cancelled already)
+        def cancel(conn):
+            cursor = conn.execute('UPDATE tool_bookings SET cancelled = 1 WHERE booking_id = ? AND cancelled = 0',
+                                  (booking_id,))
+            if cursor.rowcount != 1:
+                return None
+            return conn.execute(f'SELECT {BOOKING_COLUMNS} FROM tool_bookings WHERE booking_id = ?',
+                                (booking_id,)).fetchone()
+
+        row = self.writer.run_now(cancel)
+        if row is None:
+            return False
+        with self.lock:
+            self.apply_row(row)
+        logger.info("Cancelled booking %s", booking_id)
+        return True
+
+    def find_conflict(self, tool_id, starts_at, ends_at):
+        # ID of a booking for this tool overlapping [starts_at, ends_at), or None
+        with self.lock:
+            bookings = self.tool_bookings.get(tool_id)
+            if bookings is None:
+                return None
+            position = bookings.find_overlap(starts_at, ends_at)
+            return bookings.booking_ids[position] if position >= 0 else None
+
+    def is_free(self, tool_id, starts_at, ends_at):
+        return self.find_conflict(tool_id, starts_at, ends_at) is None
+
+    def free_tools(self, category, starts_at, ends_at):
+        # Tools in a category with no booking during [starts_at, ends_at)
+        # Finds the few tools that ARE booked then (WindowIndex) and leaves those
+        # out. (Says nothing about what status a tool is in right now - a tool
+        # out today can still be free next week)
+        tools = list(self.system.tools_by_category.get(category, {}).values())
+        with self.lock:
+            busy = self.window_index.busy_tools(starts_at, ends_at)
+        return [tool for tool in tools if tool.tool_id not in busy]
+
+    def bookings_for_tool(self, tool_id, starts_at=0, ends_at=2 ** 62):
+        # This tool's bookings overlapping a window (all of them by default), in time order
+        with self.lock:
+            bookings = self.tool_bookings.get(tool_id)
+            if bookings is None:
+                return []
+            return [self.booking_dict(booking_id) for booking_id in bookings.between(starts_at, ends_at)]
+
+    def booking_dict(self, booking_id):
+        tool_id, starts_at, ends_at, employee_id, purpose = self.bookings[booking_id]
+        return {'booking_id': booking_id, 'tool_id': tool_id, 'employee_id': employee_id,
+                'starts_at': starts_at, 'ends_at': ends_at, 'purpose': purpose}
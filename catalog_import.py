@@ -0,0 +1,427 @@
+import argparse
+import collections
+import csv
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database_pool import get_pool
+from logging_setup import setup_logging
+from migrations import HOT_QUERIES, run_migrations
+from passwords import hash_password, is_hashed
+from timestamps import now
+
+logger = logging.getLogger(__name__)
+
+# Loads a new site's tools or employees from a CSV file
+#   python catalog_import.py tools tools.csv
+#   python catalog_import.py employees employees.csv
+# Rows are read and saved CHUNK_SIZE at a time, so a million-row file never
+# sits in memory all at once. Each chunk is one transaction, and how far we
+# got is saved in that same transaction (import_progress table) - running the
+# same command again after a crash carries on where it stopped.
+# Bad rows don't stop the import: they go to <file>.rejects.csv with the reason.
+CHUNK_SIZE = 50000
+
+# Letters, digits and dashes - what our label printers and scanners handle
+BARCODE_PATTERN = re.compile(r'[0-9A-Za-z-]{4,64}')
+# All-digit barcodes this long are retail GTIN/EAN/UPC codes - the last digit is a check digit
+GTIN_LENGTHS = (8, 12, 13, 14)
+# A new tool can start out on the shelf or in the workshop, not checked out
+# (checkouts only ever come from a real checkout transaction)
+IMPORT_STATUSES = ('available', 'maintenance')
+CONDITIONS = ('good', 'damaged', 'broken')
+# Indexes the running app's queries use (the ones migrations.py checks the plans
+# of) - these stay up during an import, or every worker's refresh() and the
+# tool pages would read the whole table until it finished
+LIVE_INDEXES = {index_name for name, sql, params, index_name in HOT_QUERIES}
+
+# What each kind of file looks like
+# columns: CSV header -> default (None = must be filled in)
+# unique: columns no two rows (in the file or already in the database) can share -
+#         always the first two columns, check_row relies on that
+# tracked: insert stamps catalog_state.change_seq (see migrations.add_change_tracking)
+KINDS = {
+    'tools': {
+        'table': 'tools',
+        'columns': {'tool_id': None, 'barcode': None, 'tool_name': None, 'category': '',
+                    'status': 'available', 'condition_status': 'good'},
+        'unique': ('tool_id', 'barcode'),
+        'insert': '''
+            INSERT INTO tools (tool_id, barcode, tool_name, category, status, condition_status,
+                               created_date, change_seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT change_seq FROM catalog_state WHERE id = 1))
+        ''',
+        'tracked': True,
+    },
+    'employees': {
+        'table': 'employees',
+        'columns': {'employee_id': None, 'username': None, 'password': None, 'name': None,
+                    'skill_level': '', 'department': ''},
+        'unique': ('employee_id', 'username'),
+        'insert': '''
+            INSERT INTO employees (employee_id, username, password, name, skill_level, department,
+                                   is_active, created_date)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ''',
+        'tracked': False,
+    },
+}
+
+class CatalogImportError(Exception):
+    # The file can't be imported at all (missing columns, changed since a failed run)
+    pass
+
+def gtin_check_digit_ok(barcode):
+    # Standard GS1 check: weights 3,1,3,1... from the right, not counting the check digit
+    digits = [int(d) for d in barcode]
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == digits[-1]
+
+def check_barcode(barcode):
+    # Returns why the barcode is no good, or None if it's fine
+    if not BARCODE_PATTERN.fullmatch(barcode):
+        return "barcode must be 4-64 letters, digits or dashes"
+    if len(barcode) in GTIN_LENGTHS and barcode.isdigit() and not gtin_check_digit_ok(barcode):
+        return "barcode check digit is wrong"
+    return None
+
+class CatalogImport:
+    # One run of importing one CSV file
+    def __init__(self, db_name, kind, path, chunk_size=CHUNK_SIZE, restart=False):
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+        self.db_name = db_name
+        self.kind = kind
+        self.spec = KINDS[kind]
+        self.path = os.path.abspath(path)
+        self.chunk_size = chunk_size
+        self.restart = restart
+        self.rejects_path = self.path + '.rejects.csv'
+        self.rejects = None  # Opened the first time a row is rejected
+        self.rejects_writer = None
+        self.created = None  # created_date for the chunk being loaded
+        self.header = []     # The file's own column names (for the rejects file)
+        self.resumed_from = 0  # Rows an earlier run already did (not counted in rows/sec)
+        # Values already taken, per unique column (database + rows accepted so far)
+        self.seen = {column: set() for column in self.spec['unique']}
+        self.stats = {'rows_done': 0, 'rows_loaded': 0, 'rows_rejected': 0,
+                      'seconds': 0.0, 'rows_per_sec': 0.0}
+
+    def fingerprint(self):
+        info = os.stat(self.path)
+        return f"{info.st_size}:{info.st_mtime_ns}"
+
+    def run(self):
+        # Import the whole file (or what's left of it). Returns self.stats
+        started = time.perf_counter()
+        conn = get_pool(self.db_name).open_connection()
+        # Big page cache for building the indexes again at the end
+        conn.execute('PRAGMA cache_size=-262144')
+        try:
+            run_migrations(conn)
+            progress = self.start(conn)
+            if progress is None:
+                return self.stats  # This exact file was imported already
+            self.trim_rejects(progress['rows_done'])
+            self.load_existing(conn)
+            with open(self.path, newline='', encoding='utf-8-sig') as source:
+                reader = csv.reader(source)
+                layout = self.read_header(next(reader, None))
+                # Skip what an earlier run already saved
+                self.resumed_from = progress['rows_done']
+                rows = itertools.islice(reader, self.resumed_from, None)
+                while True:
+                    chunk = list(itertools.islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    self.load_chunk(conn, chunk, layout)
+                    elapsed = time.perf_counter() - started
+                    logger.info("%s: %d rows done, %d loaded, %d rejected - %.0f rows/sec",
+                                os.path.basename(self.path), self.stats['rows_done'],
+                                self.stats['rows_loaded'], self.stats['rows_rejected'],
+                                self.rows_per_sec(elapsed))
+            self.finish(conn, progress['deferred_indexes'])
+        finally:
+            if self.rejects is not None:
+                self.rejects.close()
+            conn.close()
+        self.stats['seconds'] = time.perf_counter() - started
+        self.stats['rows_per_sec'] = self.rows_per_sec(self.stats['seconds'])
+        return self.stats
+
+    def rows_per_sec(self, elapsed):
+        return (self.stats['rows_done'] - self.resumed_from) / elapsed if elapsed else 0.0
+
+    def start(self, conn):
+        # Find or create this file's import_progress row
+        # A new import drops the table's other secondary indexes here (not
+        # LIVE_INDEXES) - filling the table and building each index once at the
+        # end is much faster than keeping every index up to date row by row
+        fingerprint = self.fingerprint()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                SELECT fingerprint, status, rows_done, rows_loaded, rows_rejected, deferred_indexes
+                FROM import_progress WHERE source = ? AND kind = ?
+            ''', (self.path, self.kind)).fetchone()
+            deferred = []
+            if row is not None:
+                old_fingerprint, status, rows_done, rows_loaded, rows_rejected, old_deferred = row
+                if status == 'loading':
+                    deferred = json.loads(old_deferred or '[]')
+                if old_fingerprint == fingerprint and not self.restart:
+                    if status == 'done':
+                        conn.rollback()
+                        logger.info("%s was already imported (%d rows loaded)", self.path, rows_loaded)
+                        self.stats.update(rows_done=rows_done, rows_loaded=rows_loaded,
+                                          rows_rejected=rows_rejected)
+                        return None
+                    # A run from before LIVE_INDEXES may have dropped some the app needs
+                    deferred = self.restore_live_indexes(conn, deferred)
+                    conn.commit()
+                    logger.info("Resuming %s after row %d", self.path, rows_done)
+                    self.stats.update(rows_done=rows_done, rows_loaded=rows_loaded,
+                                      rows_rejected=rows_rejected)
+                    return {'rows_done': rows_done, 'deferred_indexes': deferred}
+                if status == 'loading' and not self.restart:
+                    raise CatalogImportError(f"{self.path} changed since the last import stopped - "
+                                      "run again with --restart to import it from the top")
+
+            # Indexes a failed earlier run already dropped are still owed a rebuild
+            owed = {name for name, sql in deferred}
+            for name, sql in conn.execute('''
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+            ''', (self.spec['table'],)).fetchall():
+                if name not in owed and name not in LIVE_INDEXES:
+                    deferred.append([name, sql])
+            deferred = self.restore_live_indexes(conn, deferred)
+            for name, sql in deferred:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            now = int(time.time())
+            conn.execute('''
+                INSERT OR REPLACE INTO import_progress
+                (source, kind, fingerprint, status, rows_done, rows_loaded, rows_rejected,
+                 deferred_indexes, started_at, updated_at)
+                VALUES (?, ?, ?, 'loading', 0, 0, 0, ?, ?, ?)
+            ''', (self.path, self.kind, fingerprint, json.dumps(deferred), now, now))
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        if deferred:
+            logger.info("Dropped %d index(es) on %s until the load finishes",
+                        len(deferred), self.spec['table'])
+        return {'rows_done': 0, 'deferred_indexes': deferred}
+
+    def restore_live_indexes(self, conn, deferred):
+        # Build any of LIVE_INDEXES an earlier run dropped straight away, in the
+        # caller's transaction. Returns the ones that can wait for finish()
+        live = [[name, sql] for name, sql in deferred if name in LIVE_INDEXES]
+        if live:
+            self.build_indexes(conn, live)
+            deferred = [[name, sql] for name, sql in deferred if name not in LIVE_INDEXES]
+            conn.execute('UPDATE import_progress SET deferred_indexes = ? WHERE source = ? AND kind = ?',
+                         (json.dumps(deferred), self.path, self.kind))
+            logger.info("Rebuilt %d index(es) the app needs on %s", len(live), self.spec['table'])
+        return deferred
+
+    def build_indexes(self, conn, indexes):
+        for name, sql in indexes:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                  (name,)).fetchone()
+            if not exists:
+                conn.execute(sql)
+
+    def trim_rejects(self, rows_done):
+        # Rows after rows_done are about to be checked (again) - a run that
+        # crashed part way through a chunk already wrote that chunk's rejects,
+        # so drop them, or they'd be in the file twice
+        if not os.path.exists(self.rejects_path):
+            return
+        with open(self.rejects_path, newline='', encoding='utf-8') as old:
+            kept = [row for number, row in enumerate(csv.reader(old))
+                    if number == 0 or (row and row[0].isdigit() and int(row[0]) <= rows_done)]
+        with open(self.rejects_path + '.tmp', 'w', newline='', encoding='utf-8') as new:
+            csv.writer(new).writerows(kept)
+        os.replace(self.rejects_path + '.tmp', self.rejects_path)
+
+    def load_existing(self, conn):
+        # Values already in the database count as taken
+        columns = ', '.join(self.spec['unique'])
+        for row in conn.execute(f"SELECT {columns} FROM {self.spec['table']}"):
+            for column, value in zip(self.spec['unique'], row):
+                self.seen[column].add(value)
+
+    def read_header(self, header):
+        # CSV header -> (position of each column in the row or None, defaults), in insert order
+        if header is None:
+            raise CatalogImportError(f"{self.path} is empty")
+        header = [name.strip().lower() for name in header]
+        missing = [name for name, default in self.spec['columns'].items()
+                   if default is None and name not in header]
+        if missing:
+            raise CatalogImportError(f"{self.path} is missing column(s): {', '.join(missing)}")
+        self.header = header
+        positions = [header.index(name) if name in header else None for name in self.spec['columns']]
+        return positions, list(self.spec['columns'].values())
+
+    def check_row(self, fields, layout):
+        # Returns (values in column order, None) or (None, why the row was rejected)
+        # Runs once per row, so the usual case (every column there and filled
+        # in) is one list comprehension
+        positions, defaults = layout
+        try:
+            values = [fields[position].strip() if position is not None else '' for position in positions]
+        except IndexError:  # Short row - missing trailing columns count as empty
+            values = [fields[position].strip() if position is not None and position < len(fields) else ''
+                      for position in positions]
+        if '' in values:
+            for index, value in enumerate(values):
+                if not value:
+                    if defaults[index] is None:
+                        return None, f"{list(self.spec['columns'])[index]} is empty"
+                    values[index] = defaults[index]
+        if self.kind == 'tools':
+            problem = check_barcode(values[1])
+            if problem:
+                return None, problem
+            if values[4] not in IMPORT_STATUSES:
+                return None, f"status must be one of {', '.join(IMPORT_STATUSES)}"
+            if values[5] not in CONDITIONS:
+                return None, f"condition_status must be one of {', '.join(CONDITIONS)}"
+        # The unique columns are always the first two
+        first, second = values[0], values[1]
+        taken_first, taken_second = self.seen.values()
+        if first in taken_first:
+            return None, f"{self.spec['unique'][0]} {first} already exists"
+        if second in taken_second:
+            return None, f"{self.spec['unique'][1]} {second} already exists"
+        taken_first.add(first)
+        taken_second.add(second)
+        values.append(self.created)
+        return values, None
+
+    def load_chunk(self, conn, chunk, layout):
+        self.created = now()  # created_date for every row in this chunk
+        good = []
+        rejected = 0
+        for offset, fields in enumerate(chunk):
+            values, problem = self.check_row(fields, layout)
+            if problem:
+                self.reject(self.stats['rows_done'] + offset + 1, problem, fields)
+                rejected += 1
+            else:
+                good.append(values)
+        if self.kind == 'employees':
+            self.hash_passwords(good)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self.spec['tracked']:
+                self.insert_tracked(conn, good)
+            else:
+                conn.executemany(self.spec['insert'], good)
+            conn.execute('''
+                UPDATE import_progress SET rows_done = rows_done + ?, rows_loaded = rows_loaded + ?,
+                    rows_rejected = rows_rejected + ?, updated_at = ?
+                WHERE source = ? AND kind = ?
+            ''', (len(chunk), len(good), rejected, int(time.time()), self.path, self.kind))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.stats['rows_done'] += len(chunk)
+        self.stats['rows_loaded'] += len(good)
+        self.stats['rows_rejected'] += rejected
+
+    def insert_tracked(self, conn, rows):
+        # The tools triggers bump catalog_state once for EVERY inserted row
+        # (two extra UPDATEs each) and add one to tool_counts for it. For a
+        # chunk we take them off, bump the counter once and stamp all the new
+        # rows with it (the subquery in KINDS['tools']['insert']), add the
+        # chunk to tool_counts in one go, then put them back -
+        # all inside this transaction, so no other writer ever sees them missing
+        table = self.spec['table']
+        triggers = conn.execute('''
+            SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?
+        ''', (table,)).fetchall()
+        for name, sql in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.execute('''
+            UPDATE catalog_state SET change_seq = change_seq + 1,
+                changed_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1
+        ''')
+        conn.executemany(self.spec['insert'], rows)
+        columns = list(self.spec['columns'])
+        category_at, status_at = columns.index('category'), columns.index('status')
+        counts = collections.Counter((values[category_at], values[status_at]) for values in rows)
+        conn.executemany('''
+            INSERT INTO tool_counts (category, status, tools) VALUES (?, ?, ?)
+            ON CONFLICT (category, status) DO UPDATE SET tools = tools + excluded.tools
+        ''', [(category, status, count) for (category, status), count in counts.items()])
+        for name, sql in triggers:
+            conn.execute(sql)
+
+    def hash_passwords(self, rows):
+        # Plain passwords get hashed before they're saved. This is slow on
+        # purpose (see passwords.py) - about 0.08s each per core - so it's
+        # spread over every core; files with hashes already in them skip it
+        position = list(self.spec['columns']).index('password')
+        plain = [values for values in rows if not is_hashed(values[position])]
+        if not plain:
+            return
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            hashes = executor.map(hash_password, [values[position] for values in plain])
+            for values, hashed in zip(plain, hashes):
+                values[position] = hashed
+
+    def reject(self, row_number, reason, fields):
+        # row_number counts data rows from 1 (the header isn't counted)
+        if self.rejects is None:
+            new_file = not os.path.exists(self.rejects_path)
+            self.rejects = open(self.rejects_path, 'a', newline='', encoding='utf-8')
+            self.rejects_writer = csv.writer(self.rejects)
+            if new_file:
+                self.rejects_writer.writerow(['row', 'reason'] + self.header)
+        self.rejects_writer.writerow([row_number, reason] + fields)
+
+    def finish(self, conn, deferred):
+        # Build the dropped indexes again (one sorted pass each) and mark the file done
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.build_indexes(conn, deferred)
+            conn.execute('''
+                UPDATE import_progress SET status = 'done', deferred_indexes = NULL, updated_at = ?
+                WHERE source = ? AND kind = ?
+            ''', (int(time.time()), self.path, self.kind))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if deferred:
+            logger.info("Rebuilt %d index(es) in %.1fs", len(deferred), time.perf_counter() - started)
+
+# Run with: python catalog_import.py tools|employees file.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load tools or employees from a CSV file")
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('path')
+    parser.add_argument('--db', default='equipment_checkout.db')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true',
+                        help="import the file from the top even if an earlier run stopped part way")
+    args = parser.parse_args()
+    setup_logging()
+    try:
+        stats = CatalogImport(args.db, args.kind, args.path, args.chunk_size, args.restart).run()
+    except CatalogImportError as error:
+        logger.error("%s", error)
+        raise SystemExit(1)
+    print(f"{stats['rows_loaded']} loaded, {stats['rows_rejected']} rejected "
+          f"({stats['rows_done']} rows in {stats['seconds']:.1f}s, {stats['rows_per_sec']:.0f} rows/sec)")
\ No newline at end of file
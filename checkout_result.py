@@ -0,0 +1,28 @@
+class CheckoutResult:
+    # What happened when someone tried to checkout or return a tool
+    # Works like True/False in an if statement, but also says WHY it failed
+    OK = "ok"
+    NOT_LOGGED_IN = "not_logged_in"
+    NOT_FOUND = "not_found"                # No tool with that barcode
+    UNAVAILABLE = "unavailable"            # Tool is checked out or in maintenance
+    CONFLICT = "conflict"                  # Someone else got it first (another scanner/worker)
+    NOT_CHECKED_OUT_TO_USER = "not_yours"  # Trying to return a tool you don't have
+    DUPLICATE = "duplicate"                # Same barcode scanned twice in one batch
+
+    def __init__(self, status, message, barcode="", transaction_id=""):
+        self.status = status
+        self.message = message              # Something we can show the user
+        self.barcode = barcode
+        self.transaction_id = transaction_id
+
+    def __bool__(self):
+        # So "if system.process_checkout(...):" still works
+        return self.status == CheckoutResult.OK
+
+    def to_dict(self):
+        # Plain dict for the JSON API
+        return {'barcode': self.barcode, 'status': self.status, 'message': self.message,
+                'transaction_id': self.transaction_id}
+
+    def __repr__(self):
+        return f"CheckoutResult({self.status!r}, {self.message!r})"
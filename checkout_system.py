@@ -1,162 +1,660 @@
 import sqlite3  # Need this for database connections
+import logging  # Instead of print() - see logging_setup.py
+import sys        # sys.intern for strings that repeat on every row
+import threading  # Web server handles requests on several threads
+import time       # To know when our copy of the tools is getting old
+from booking_schedule import BookingSchedule
+from checkout_result import CheckoutResult
+from database_pool import get_pool
+from database_writer import DatabaseWriter
 from employee import Employee
+from event_broker import EventBroker
+from id_generator import worker_lease
+from inventory import Inventory
+from migrations import DEFAULT_LOAN_HOURS, run_migrations
+from overdue_scheduler import OverdueScheduler
+from passwords import DUMMY_HASH, PasswordVerifier, needs_rehash
+from summary_counts import SummaryReconciler
 from tool import Tool
 from transaction import Transaction
 
+# Columns we read for a tool, in the order tool rows come back
+TOOL_COLUMNS = 'tool_id, tool_name, barcode, category, status, condition_status, checked_out_to, version, change_seq'
+# Same for a transaction (see transaction_from_row)
+TRANSACTION_COLUMNS = '''transaction_id, employee_id, tool_id, transaction_type,
+    checkout_date, return_date, condition_on_return, notes, due_date'''
+
+def shared_string(value):
+    # Lots of rows repeat the same few values ("available", "Hand Tools", "EMP001")
+    # sys.intern keeps one copy of each instead of a new string per row
+    return sys.intern(value) if value else ""
+
+logger = logging.getLogger(__name__)
+
 class CheckoutSystem:
-    def __init__(self):
+    def __init__(self, refresh_interval=2.0, db_name='equipment_checkout.db'):
         self.system_id = "ECS_001"  # Unique system identifier
-        self.current_user = None    # Track who is logged in
+        # Who is logged in is NOT stored here - the web server keeps it in each
+        # user's session and passes the Employee into checkout/return
+        self.lock = threading.Lock()  # One checkout/return changes the tools at a time
         self.tools = []             # List to hold all tools
         self.transactions = []      # Keep track of all checkouts/returns
-        self.db_name = 'equipment_checkout.db'  # Database file name
+        # Lookup indexes so a scan doesn't have to loop over every tool
+        self.tools_by_barcode = {}  # barcode -> Tool
+        self.tools_by_id = {}       # tool_id -> Tool
+        self.tools_by_employee = {} # employee_id -> {tool_id: Tool} for tools they have out
+        self.tools_by_category = {} # category -> {tool_id: Tool} (booking searches go by category)
+        self.open_checkouts = {}    # tool_id -> checkout Transaction that isn't returned yet
+        # Other worker processes change tools too - how old (seconds) our copy is
+        # allowed to get before refresh_if_stale() asks the database what changed
+        self.refresh_interval = refresh_interval
+        self.last_change_seq = 0    # Catalog change number we're up to date with
+        self.last_refresh = 0.0     # time.monotonic() of the last load/refresh
+        # Make the bound method once so every Tool shares the same object
+        self.status_listener = self.on_tool_status_change
+        # Live stream of tool changes for pages that want to stay up to date
+        self.events = EventBroker()
+        self.db_name = db_name                   # Database file name
+        self.pool = get_pool(self.db_name)       # Shared connections instead of connect/close every call
+        # Writes checkouts/returns to the database, sharing commits between requests
+        self.writer = DatabaseWriter(self.db_name)
+        # Checks login passwords on a few worker threads so logins can't use up every core
+        self.password_verifier = PasswordVerifier()
+        # Counts for pooled tools/consumables - shares our writer so its changes share our commits
+        self.inventory = Inventory(self.db_name, self.writer, cache_seconds=refresh_interval)
+        # Watches open checkouts and sends an alert when one goes past its due date
+        self.overdue = OverdueScheduler(self.writer)
+        # Every few minutes, checks the dashboard counters (summary tables) against the tools/transactions
+        self.summary_reconciler = SummaryReconciler(self.db_name, self.writer)
+        self.loan_hours = {}        # category -> hours a tool can be out (loan_periods table)
         
-        # Load tools from database when system starts
+        # Apply any schema migrations an older database file is missing
+        try:
+            with self.pool.connection() as conn:
+                run_migrations(conn)
+        except sqlite3.Error as error:
+            logger.error("Could not upgrade database: %s", error)
+        # Worker number for the IDs we make (transactions, bookings...) comes from
+        # this database, claimed now rather than on the first checkout
+        worker_lease.start(self.db_name)
+
+        # Load tools and transaction history from database when system starts
         self.load_tools_from_database()
+        self.load_transactions_from_database()
+        self.load_loan_periods()
+        # Tools booked for future time windows (scheduled maintenance jobs)
+        self.bookings = BookingSchedule(self)
+        try:
+            self.bookings.load()
+        except sqlite3.Error as error:
+            logger.error("Could not load bookings: %s", error)
     
     def load_tools_from_database(self):
         try:
-            # Connect to the SQLite database
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            # Get all tool data from database
-            cursor.execute('SELECT tool_id, tool_name, barcode, category, status, condition_status, checked_out_to FROM tools')
-            tools_data = cursor.fetchall()
-            conn.close()
+            # Borrow a connection from the pool
+            with self.pool.connection() as conn:
+                # Read the change number first - anything changed after this
+                # gets picked up again by the next refresh()
+                change_seq = conn.execute('SELECT change_seq FROM catalog_state WHERE id = 1').fetchone()[0]
+                # Get all tool data from database
+                cursor = conn.execute(f'SELECT {TOOL_COLUMNS} FROM tools')
+                tools_data = cursor.fetchall()
             
             # Convert database rows into Tool objects
-            self.tools = []
+            self.clear_indexes()
             for tool_data in tools_data:
-                # Create new tool with first 3 pieces of data
-                tool = Tool(tool_data[0], tool_data[1], tool_data[2])
-                # Set the rest of the properties
-                tool.category = tool_data[3]
-                tool.status = tool_data[4]
-                tool.condition = tool_data[5]
-                tool.checked_out_to = tool_data[6]
-                self.tools.append(tool)
+                self.add_tool(self.tool_from_row(tool_data))
+            self.last_change_seq = change_seq
+            self.last_refresh = time.monotonic()
             
-            print(f"Loaded {len(self.tools)} tools from database")
+            logger.info("Loaded %d tools from database", len(self.tools))
         except:
             # If database doesn't exist, let user know
-            print("Database not found - run database_setup.py first")
-            self.tools = []
+            logger.error("Database not found - run database_setup.py first")
+            self.clear_indexes()
+
+    def refresh(self):
+        # Pull in only the tools that changed since we last looked and
+        # update our existing Tool objects in place (no full reload)
+        with self.pool.connection() as conn:
+            changed = conn.execute(f'''
+                SELECT {TOOL_COLUMNS} FROM tools
+                WHERE change_seq > ? ORDER BY change_seq
+            ''', (self.last_change_seq,)).fetchall()
+
+        checked_out_elsewhere = []  # Tools another process checked out - we need their transactions
+        with self.lock:
+            for row in changed:
+                tool = self.tools_by_id.get(row[0])
+                known_version = tool.version if tool else None
+                if tool:
+                    self.apply_tool_row(tool, row)
+                else:
+                    tool = self.tool_from_row(row)
+                    self.add_tool(tool)  # Tool added by someone else
+                    self.events.publish(self.tool_event(tool))
+                self.last_change_seq = max(self.last_change_seq, row[8])
+                # Keep open_checkouts (and so the overdue scheduler) in step with
+                # checkouts and returns done by other worker processes
+                # Any new version means our checkout may be stale - even with the same
+                # employee (returned and checked out again elsewhere), so read it again
+                transaction = self.open_checkouts.get(tool.tool_id)
+                if transaction and (tool.version != known_version or transaction.employee_id != tool.checked_out_to):
+                    del self.open_checkouts[tool.tool_id]
+                    self.overdue.cancel(transaction.transaction_id)
+                    transaction = None
+                if tool.checked_out_to and not transaction:
+                    checked_out_elsewhere.append(tool)
+            self.last_refresh = time.monotonic()
+        for tool in checked_out_elsewhere:
+            self.find_open_checkout(tool.tool_id, tool.checked_out_to)
+        return len(changed)
+
+    def refresh_if_stale(self):
+        # Cheap to call on every request - only hits the database once per refresh_interval
+        if time.monotonic() - self.last_refresh >= self.refresh_interval:
+            try:
+                self.refresh()
+                self.bookings.refresh()
+            except sqlite3.Error as error:
+                logger.error("Could not refresh tools: %s", error)
+
+    def get_catalog_state(self):
+        # (change_seq, changed_at) for the whole catalog, straight from the database
+        # change_seq goes up on every tool change made by ANY process, so it
+        # works as a version number for the tool list (API ETags use it)
+        # Also catches our copy up if it is behind that version
+        with self.pool.connection() as conn:
+            change_seq, changed_at = conn.execute(
+                'SELECT change_seq, changed_at FROM catalog_state WHERE id = 1').fetchone()
+        if change_seq > self.last_change_seq:
+            self.refresh()
+        return change_seq, changed_at
+
+    def tool_from_row(self, row):
+        # Row has the columns in TOOL_COLUMNS
+        # Create new tool with first 3 pieces of data
+        tool = Tool(row[0], row[1], row[2])
+        # Set the rest of the properties
+        tool.category = shared_string(row[3])
+        tool.status = shared_string(row[4])
+        tool.condition = shared_string(row[5])
+        tool.checked_out_to = shared_string(row[6])
+        tool.version = row[7]
+        return tool
+
+    def apply_tool_row(self, tool, row):
+        # Copy a fresh database row onto a Tool we already have
+        # Caller must hold self.lock
+        if row[7] < tool.version:
+            return  # Row is older than what we already know
+        if tool.barcode != row[2]:
+            self.tools_by_barcode.pop(tool.barcode, None)
+            tool.barcode = row[2]
+            self.tools_by_barcode[tool.barcode] = tool
+        tool.tool_name = row[1]
+        if tool.category != row[3]:
+            category_tools = self.tools_by_category.get(tool.category)
+            if category_tools:
+                category_tools.pop(tool.tool_id, None)
+            tool.category = shared_string(row[3])
+            self.tools_by_category.setdefault(tool.category, {})[tool.tool_id] = tool
+        tool.version = row[7]
+        # Usually this is our own checkout/return coming back - nothing to do then
+        if (tool.status, tool.checked_out_to, tool.condition) != (row[4], row[6] or "", row[5]):
+            # Take all three from the row - update_status() only changes checked_out_to
+            # for checked_out/available, so a tool another worker sent to
+            # maintenance would stay out to its last holder here
+            old_checked_out_to = tool.checked_out_to
+            tool.condition = shared_string(row[5])
+            tool.status = shared_string(row[4])
+            tool.checked_out_to = shared_string(row[6])
+            self.on_tool_status_change(tool, old_checked_out_to)  # Per-employee index and live stream
+
+    def load_transactions_from_database(self):
+        # Bring back transaction history so a restart doesn't lose open checkouts
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.execute(f'''
+                    SELECT {TRANSACTION_COLUMNS}
+                    FROM transactions ORDER BY transaction_id  -- IDs are time ordered
+                ''')
+                transactions_data = cursor.fetchall()
+        except sqlite3.Error:
+            logger.error("Could not load transactions from database")
+            return
+
+        self.transactions = []
+        self.open_checkouts = {}
+        for row in transactions_data:
+            transaction = self.transaction_from_row(row)
+            self.transactions.append(transaction)
+            # Anything not returned yet is still an open checkout
+            if transaction.type == "checkout" and not transaction.return_date:
+                self.open_checkouts[transaction.tool_id] = transaction
+                self.overdue.add(transaction)
+        logger.info("Loaded %d transactions from database", len(self.transactions))
+
+    def load_loan_periods(self):
+        # How long each category can be out - read once at startup
+        # (restart the server after changing the loan_periods table)
+        try:
+            with self.pool.connection() as conn:
+                self.loan_hours = dict(conn.execute('SELECT category, loan_hours FROM loan_periods'))
+        except sqlite3.Error as error:
+            logger.error("Could not load loan periods: %s", error)
+
+    def loan_seconds(self, tool):
+        # How long a checkout of this tool lasts before it's overdue
+        return self.loan_hours.get(tool.category, DEFAULT_LOAN_HOURS) * 3600
+
+    def transaction_from_row(self, row):
+        # Row has the columns in TRANSACTION_COLUMNS
+        transaction = Transaction()
+        transaction.transaction_id = row[0]
+        transaction.employee_id = shared_string(row[1])
+        transaction.tool_id = shared_string(row[2])
+        transaction.type = shared_string(row[3])
+        transaction.checkout_date = row[4] or 0
+        transaction.return_date = row[5] or 0
+        transaction.condition = shared_string(row[6])
+        transaction.notes = row[7] or ""
+        transaction.due_date = row[8] or 0
+        return transaction
+
+    def clear_indexes(self):
+        # Reset the tool list and all the lookup dictionaries together
+        self.tools = []
+        self.tools_by_barcode = {}
+        self.tools_by_id = {}
+        self.tools_by_employee = {}
+        self.tools_by_category = {}
+
+    def add_tool(self, tool):
+        # Add a tool to the list and to every index
+        self.tools.append(tool)
+        self.tools_by_barcode[tool.barcode] = tool
+        self.tools_by_id[tool.tool_id] = tool
+        self.tools_by_category.setdefault(tool.category, {})[tool.tool_id] = tool
+        if tool.checked_out_to:
+            self.tools_by_employee.setdefault(tool.checked_out_to, {})[tool.tool_id] = tool
+        # Tool tells us whenever its status changes
+        tool.status_listener = self.status_listener
+
+    def on_tool_status_change(self, tool, old_checked_out_to):
+        # Move the tool between employees in the per-employee index
+        if old_checked_out_to and old_checked_out_to != tool.checked_out_to:
+            employee_tools = self.tools_by_employee.get(old_checked_out_to)
+            if employee_tools:
+                employee_tools.pop(tool.tool_id, None)
+                if not employee_tools:
+                    del self.tools_by_employee[old_checked_out_to]
+        if tool.checked_out_to:
+            self.tools_by_employee.setdefault(tool.checked_out_to, {})[tool.tool_id] = tool
+        # Tell anyone watching the live stream (never blocks)
+        self.events.publish(self.tool_event(tool))
+
+    def tool_event(self, tool):
+        # What the live stream sends for a changed tool
+        return {'tool_id': tool.tool_id, 'barcode': tool.barcode, 'tool_name': tool.tool_name,
+                'status': tool.status, 'checked_out_to': tool.checked_out_to, 'condition': tool.condition}
+
+    def get_tools_for_employee(self, employee_id):
+        # Tools currently checked out to this employee
+        return list(self.tools_by_employee.get(employee_id, {}).values())
         
     def authenticate_user(self, username, password):
+        # Raises LoginBusyError if too many logins are being checked right now
         try:
-            # Connect to database to check login
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            # Query to find matching username and password
-            cursor.execute('''
-                SELECT employee_id, username, name, skill_level, department 
-                FROM employees 
-                WHERE username = ? AND password = ? AND is_active = 1
-            ''', (username, password))
-            
-            result = cursor.fetchone()  # Get the first matching row
-            conn.close()
-            
-            if result:
-                # Login successful - create employee object
-                employee = Employee()
-                employee.employee_id = result[0]
-                employee.username = result[1]
-                employee.name = result[2]
-                employee.skill_level = result[3]
-                employee.department = result[4]
-                employee.is_logged_in = True
-                self.current_user = employee  # Set as current user
-                print(f"Login successful for {employee.name}")
-                return True
-            else:
-                print("Login failed - invalid credentials")
-                return False
+            # Borrow a pooled connection to look up the user
+            # Passwords are hashed, so we fetch the hash and check it in Python
+            with self.pool.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT employee_id, username, name, skill_level, department, password
+                    FROM employees 
+                    WHERE username = ? AND is_active = 1
+                ''', (username,))
+                
+                result = cursor.fetchone()  # Get the first matching row
         except:
             # If database fails, try old method
             employee = Employee()
             if employee.login(username, password):
-                self.current_user = employee
-                return True
-            return False
+                employee.is_logged_in = True
+                return employee
+            return None
+
+        # Slow hash check runs on the password worker threads (see passwords.py)
+        # Unknown usernames still get checked against a dummy hash so they take as long
+        stored_hash = result[5] if result else DUMMY_HASH
+        if not self.password_verifier.verify(password, stored_hash) or not result:
+            logger.info("Login failed for %s - invalid credentials", username)
+            return None
+
+        # Login successful - hand back the employee, caller keeps track of it
+        employee = self.employee_from_row(result)
+        if needs_rehash(stored_hash):
+            # Old or cheaper hash - the password threads make a new one and queue
+            # the save, so this login doesn't wait for a second slow hash
+            employee_id = employee.employee_id
+            self.password_verifier.rehash(password, lambda new_hash: self.writer.queue_write(
+                'UPDATE employees SET password = ? WHERE employee_id = ?', (new_hash, employee_id)))
+        logger.info("Login successful for %s", employee.name)
+        return employee
+
+    def get_employee(self, employee_id):
+        # Look up a logged in employee again (web server does this every request)
+        with self.pool.connection() as conn:
+            result = conn.execute('''
+                SELECT employee_id, username, name, skill_level, department
+                FROM employees
+                WHERE employee_id = ? AND is_active = 1
+            ''', (employee_id,)).fetchone()
+        if result:
+            return self.employee_from_row(result)
+        return None  # Employee removed or deactivated since they logged in
+
+    def employee_from_row(self, row):
+        # Row is (employee_id, username, name, skill_level, department)
+        employee = Employee()
+        employee.employee_id = row[0]
+        employee.username = row[1]
+        employee.name = row[2]
+        employee.skill_level = row[3]
+        employee.department = row[4]
+        employee.is_logged_in = True
+        return employee
         
     def find_tool_by_barcode(self, barcode):
-        # Loop through all tools to find matching barcode
-        for tool in self.tools:
-            if tool.barcode == barcode:
-                return tool
-        return None  # Tool not found
+        # Dictionary lookup instead of looping through every tool
+        return self.tools_by_barcode.get(barcode)  # None if not found
+
+    def find_tool_by_id(self, tool_id):
+        return self.tools_by_id.get(tool_id)
         
-    def process_checkout(self, barcode):
+    def process_checkout(self, employee, barcode):
+        # One tool is just a batch of one
+        return self.process_checkout_many(employee, [barcode])[0]
+
+    def process_checkout_many(self, employee, barcodes):
+        # Checkout a whole batch of scanned tools (like kitting a job) with ONE
+        # database commit instead of one per tool
+        # Returns a CheckoutResult for every barcode, in the order they were scanned
+        # (AsyncCheckoutSystem runs the same three steps, but awaits the commit)
+        results, claims = self.prepare_checkouts(employee, barcodes)
+        if not claims:
+            return results
+        claimed = self.writer.run_now(lambda conn: self.save_checkouts(conn, employee, claims))
+        return self.finish_checkouts(employee, results, claims, claimed)
+
+    def prepare_checkouts(self, employee, barcodes):
+        # Check every barcode before touching the database
+        # Returns (results, claims): results has a CheckoutResult for each barcode
+        # that failed already (None for the rest), claims is (position in batch,
+        # tool, transaction) for each tool we should try to take
         # Make sure user is logged in first
-        if not self.current_user or not self.current_user.is_logged_in:
-            print("Error: User must be logged in to checkout tools")
-            return False
-            
-        # Find the tool they want
-        tool = self.find_tool_by_barcode(barcode)
-        if not tool:
-            print("Error: Tool not found")
-            return False
-            
-        # Check if tool is available
-        if not tool.check_availability():
-            return False
-            
-        # Create a new transaction record
-        transaction = Transaction()
-        transaction_id = transaction.create_checkout(self.current_user.employee_id, tool.tool_id)
-        
-        # Update tool status to checked out
-        tool.update_status("checked_out", self.current_user.employee_id)
-        
-        # Save transaction to our list
-        self.transactions.append(transaction)
-        
-        print(f"Checkout successful! Transaction ID: {transaction_id}")
-        return True
+        if not employee or not employee.is_logged_in:
+            logger.info("Checkout refused - user not logged in")
+            return [CheckoutResult(CheckoutResult.NOT_LOGGED_IN, "You must be logged in to checkout tools", barcode)
+                    for barcode in barcodes], []
+
+        results = [None] * len(barcodes)
+        claims = []  # (position in batch, tool, transaction) that passed the checks
+        seen = set()
+        for index, barcode in enumerate(barcodes):
+            # The same label scanned twice - only the first scan counts
+            if barcode in seen:
+                results[index] = CheckoutResult(CheckoutResult.DUPLICATE, "Scanned more than once in this batch", barcode)
+                continue
+            seen.add(barcode)
+
+            # Find the tool they want
+            tool = self.find_tool_by_barcode(barcode)
+            if not tool:
+                logger.info("Tool not found: %s", barcode)
+                results[index] = CheckoutResult(CheckoutResult.NOT_FOUND, "Tool not found", barcode)
+                continue
+
+            # Check our copy first - if it looks taken, make sure it isn't out of date
+            # (another worker process might have had it returned)
+            if not tool.check_availability():
+                self.reload_tool(tool)
+                if not tool.check_availability():
+                    results[index] = CheckoutResult(CheckoutResult.UNAVAILABLE, f"Tool is not available - status: {tool.status}", barcode)
+                    continue
+
+            # Create a new transaction record
+            transaction = Transaction()
+            transaction.create_checkout(employee.employee_id, tool.tool_id, self.loan_seconds(tool))
+            claims.append((index, tool, transaction))
+        return results, claims
+
+    def save_checkouts(self, conn, employee, claims):
+        # Claim every tool in one database transaction - only one scanner can win
+        # each tool, even across threads and worker processes, because the UPDATE
+        # only matches while the row still says 'available'
+        # Runs on the database writer thread; returns the tool's new version for
+        # each claim it won, None for each it lost
+        return [self.save_checkout(conn, tool.tool_id, employee.employee_id, transaction)
+                for index, tool, transaction in claims]
+
+    def finish_checkouts(self, employee, results, claims, claimed):
+        # Update our copy of the tools once the database has the checkouts
+        lost = []
+        with self.lock:
+            for (index, tool, transaction), version in zip(claims, claimed):
+                if version is None:
+                    lost.append(tool)
+                    results[index] = CheckoutResult(CheckoutResult.CONFLICT, "Someone else just checked out this tool", tool.barcode)
+                    continue
+                # Update our copy of the tool to match the database - unless a
+                # refresh() between the commit and here has applied it already
+                if version > tool.version:
+                    tool.version = version
+                    tool.update_status("checked_out", employee.employee_id)
+                current = self.open_checkouts.get(tool.tool_id)
+                if current and current.transaction_id == transaction.transaction_id:
+                    transaction = current  # refresh() picked this checkout up already
+                else:
+                    # Save transaction to our list (still open unless it's been returned since)
+                    self.transactions.append(transaction)
+                    if tool.version == version:
+                        self.open_checkouts[tool.tool_id] = transaction
+                        self.overdue.add(transaction)
+                results[index] = CheckoutResult(CheckoutResult.OK, "Checkout successful", tool.barcode, transaction.transaction_id)
+                logger.info("Checkout %s: %s to %s", transaction.transaction_id, tool.tool_id, employee.employee_id)
+
+        for tool in lost:
+            logger.warning("Checkout conflict - %s was taken by someone else", tool.tool_name)
+            self.reload_tool(tool)
+        return results
+
+    def save_checkout(self, conn, tool_id, employee_id, transaction):
+        # Runs on the database writer thread inside the batch's transaction
+        # Returns the tool's new version, or None if it wasn't available any more
+        updated = conn.execute('''
+            UPDATE tools SET status = 'checked_out', checked_out_to = ?, version = version + 1
+            WHERE tool_id = ? AND status = 'available'
+            RETURNING version
+        ''', (employee_id, tool_id)).fetchall()
+        if not updated:
+            return None
+        # Plain INSERT - transaction IDs are unique, so a clash is a real error
+        conn.execute('''
+            INSERT INTO transactions
+            (transaction_id, employee_id, tool_id, transaction_type, checkout_date, return_date, condition_on_return, notes, due_date)
+            VALUES (?, ?, ?, ?, ?, NULL, NULL, ?, ?)
+        ''', (transaction.transaction_id, transaction.employee_id, transaction.tool_id, transaction.type,
+              transaction.checkout_date, transaction.notes, transaction.due_date or None))
+        return updated[0][0]
         
-    def process_return(self, barcode, condition="good", notes=""):
+    def process_return(self, employee, barcode, condition="good", notes=""):
+        return self.process_return_many(employee, [barcode], condition, notes)[0]
+
+    def process_return_many(self, employee, barcodes, condition="good", notes="", conditions=None):
+        # Return a batch of tools with one database commit
+        # conditions can give a different condition for some barcodes
+        # ({"TOOL003": "damaged"}); everything else gets condition
+        # Returns a CheckoutResult for every barcode, in the order they were scanned
+        results, returns = self.prepare_returns(employee, barcodes, condition, conditions)
+        if not returns:
+            return results
+        returned = self.writer.run_now(lambda conn: self.save_returns(conn, employee, returns, notes))
+        return self.finish_returns(employee, results, returns, returned)
+
+    def prepare_returns(self, employee, barcodes, condition="good", conditions=None):
+        # Check every barcode before touching the database (like prepare_checkouts)
+        # returns is (position in batch, tool, checkout transaction, condition)
         # Make sure user is logged in
-        if not self.current_user or not self.current_user.is_logged_in:
-            print("Error: User must be logged in to return tools")
-            return False
-            
-        # Find the tool
-        tool = self.find_tool_by_barcode(barcode)
-        if not tool:
-            print("Error: Tool not found")
-            return False
-            
-        # Make sure this user has the tool checked out
-        if tool.checked_out_to != self.current_user.employee_id:
-            print("Error: Tool is not checked out to this user")
-            return False
-            
-        # Find the original checkout transaction
-        checkout_transaction = None
-        for transaction in self.transactions:
-            # Look for matching checkout that hasn't been returned yet
-            if (transaction.tool_id == tool.tool_id and 
-                transaction.employee_id == self.current_user.employee_id and 
-                transaction.type == "checkout" and 
-                not transaction.return_date):
-                checkout_transaction = transaction
-                break
-                
-        if not checkout_transaction:
-            print("Error: No checkout transaction found")
-            return False
-            
-        # Process the return
-        checkout_transaction.process_return(condition, notes)
-        tool.condition = condition  # Update tool condition
-        tool.update_status("available")  # Make tool available again
-        
-        print("Return successful!")
-        return True
+        if not employee or not employee.is_logged_in:
+            logger.info("Return refused - user not logged in")
+            return [CheckoutResult(CheckoutResult.NOT_LOGGED_IN, "You must be logged in to return tools", barcode)
+                    for barcode in barcodes], []
+        conditions = conditions or {}
+
+        results = [None] * len(barcodes)
+        returns = []  # (position in batch, tool, checkout transaction, condition)
+        seen = set()
+        for index, barcode in enumerate(barcodes):
+            if barcode in seen:
+                results[index] = CheckoutResult(CheckoutResult.DUPLICATE, "Scanned more than once in this batch", barcode)
+                continue
+            seen.add(barcode)
+
+            # Find the tool
+            tool = self.find_tool_by_barcode(barcode)
+            if not tool:
+                logger.info("Tool not found: %s", barcode)
+                results[index] = CheckoutResult(CheckoutResult.NOT_FOUND, "Tool not found", barcode)
+                continue
+
+            # Make sure this user has the tool checked out (double check the
+            # database before saying no, our copy could be out of date)
+            if tool.checked_out_to != employee.employee_id:
+                self.reload_tool(tool)
+                if tool.checked_out_to != employee.employee_id:
+                    logger.info("Return refused - %s is not checked out to %s", tool.tool_id, employee.employee_id)
+                    results[index] = CheckoutResult(CheckoutResult.NOT_CHECKED_OUT_TO_USER, "Tool is not checked out to you", barcode)
+                    continue
+
+            # Find the original checkout transaction that hasn't been returned yet
+            checkout_transaction = self.find_open_checkout(tool.tool_id, employee.employee_id)
+            if not checkout_transaction:
+                logger.warning("No open checkout transaction found for %s", tool.tool_id)
+                results[index] = CheckoutResult(CheckoutResult.NOT_CHECKED_OUT_TO_USER, "No checkout found for this tool", barcode)
+                continue
+            returns.append((index, tool, checkout_transaction, conditions.get(barcode, condition)))
+        return results, returns
+
+    def save_returns(self, conn, employee, returns, notes):
+        # Give the tools back in one database transaction - each one only works
+        # if it's still out to this employee
+        # Runs on the database writer thread
+        # ((the Transaction each return closed, the tool's new version), or None)
+        return [self.save_return(conn, tool.tool_id, employee.employee_id, transaction, tool_condition, notes)
+                for index, tool, transaction, tool_condition in returns]
+
+    def finish_returns(self, employee, results, returns, returned):
+        # Update our copy of the tools once the database has the returns
+        lost = []
+        with self.lock:
+            for (index, tool, transaction, tool_condition), done in zip(returns, returned):
+                if not done:
+                    lost.append(tool)
+                    results[index] = CheckoutResult(CheckoutResult.CONFLICT, "Tool was already returned", tool.barcode)
+                    continue
+                closed, version = done
+                current = self.open_checkouts.get(tool.tool_id)
+                if current and current.transaction_id in (transaction.transaction_id, closed.transaction_id):
+                    del self.open_checkouts[tool.tool_id]  # (a newer checkout from refresh() stays)
+                self.overdue.cancel(transaction.transaction_id)
+                if closed is not transaction:
+                    # Our copy was stale - save_return closed the checkout that was really open
+                    self.overdue.cancel(closed.transaction_id)
+                    self.transactions.append(closed)
+                    transaction = closed
+                # Same as finish_checkouts - refresh() may have got here first
+                if version > tool.version:
+                    tool.version = version
+                    tool.condition = tool_condition  # Update tool condition
+                    tool.update_status("available")  # Make tool available again
+                results[index] = CheckoutResult(CheckoutResult.OK, "Return successful", tool.barcode, transaction.transaction_id)
+                logger.info("Return %s: %s from %s (%s)", transaction.transaction_id, tool.tool_id, employee.employee_id, tool_condition)
+
+        for tool in lost:
+            logger.warning("Return conflict - %s changed while returning", tool.tool_name)
+            self.reload_tool(tool)
+        return results
+
+    def save_return(self, conn, tool_id, employee_id, transaction, condition, notes):
+        # Runs on the database writer thread inside the batch's transaction
+        # Returns (the checkout Transaction it closed, the tool's new version),
+        # or None (nothing changed)
+        conn.execute('SAVEPOINT return_item')
+        updated = conn.execute('''
+            UPDATE tools SET status = 'available', checked_out_to = NULL, condition_status = ?, version = version + 1
+            WHERE tool_id = ? AND status = 'checked_out' AND checked_out_to = ?
+            RETURNING version
+        ''', (condition, tool_id, employee_id)).fetchall()
+        closed = bool(updated) and self.close_checkout(conn, transaction, condition, notes)
+        if updated and not closed:
+            # Our checkout is stale - another worker returned it and the tool went
+            # out again (maybe to the same employee). Close the one that's open now
+            row = conn.execute(f'''
+                SELECT {TRANSACTION_COLUMNS}
+                FROM transactions
+                WHERE tool_id = ? AND employee_id = ? AND return_date IS NULL
+            ''', (tool_id, employee_id)).fetchone()
+            if row:
+                transaction = self.transaction_from_row(row)
+                closed = self.close_checkout(conn, transaction, condition, notes)
+        if not closed:
+            conn.execute('ROLLBACK TO return_item')  # Don't leave the tool returned with its checkout open
+        conn.execute('RELEASE return_item')
+        return (transaction, updated[0][0]) if closed else None
+
+    def close_checkout(self, conn, transaction, condition, notes):
+        # Mark the checkout returned - only if it's still open. False if it wasn't
+        transaction.process_return(condition, notes)
+        cursor = conn.execute('''
+            UPDATE transactions SET transaction_type = ?, return_date = ?, condition_on_return = ?, notes = ?
+            WHERE transaction_id = ? AND return_date IS NULL
+        ''', (transaction.type, transaction.return_date, transaction.condition, transaction.notes,
+              transaction.transaction_id))
+        return cursor.rowcount == 1
+
+    def find_open_checkout(self, tool_id, employee_id):
+        # Usually it's in memory, but another worker process may have done the checkout
+        transaction = self.open_checkouts.get(tool_id)
+        if transaction and transaction.employee_id == employee_id:
+            return transaction
+        with self.pool.connection() as conn:
+            row = conn.execute(f'''
+                SELECT {TRANSACTION_COLUMNS}
+                FROM transactions
+                WHERE tool_id = ? AND employee_id = ? AND return_date IS NULL
+            ''', (tool_id, employee_id)).fetchone()
+        if not row:
+            return None
+        transaction = self.transaction_from_row(row)
+        with self.lock:
+            current = self.open_checkouts.get(tool_id)
+            if current and current.transaction_id == transaction.transaction_id:
+                return current  # Our own checkout finished while we were reading
+            self.transactions.append(transaction)
+            self.open_checkouts[tool_id] = transaction
+        self.overdue.add(transaction)
+        return transaction
+
+    def reload_tool(self, tool):
+        # Refresh one cached tool from the database (someone else may have changed it)
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {TOOL_COLUMNS} FROM tools WHERE tool_id = ?',
+                               (tool.tool_id,)).fetchone()
+        if not row:
+            return
+        with self.lock:
+            self.apply_tool_row(tool, row)
         
     def list_available_tools(self):
         print("\n=== Available Tools ===")
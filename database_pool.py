@@ -0,0 +1,121 @@
+import sqlite3
+import threading  # Lock/Condition so several request threads can share the pool
+import time
+from contextlib import contextmanager
+
+# Settings applied once when a connection is opened (not on every query)
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',       # Readers don't block the writer and vice versa
+    'PRAGMA synchronous=NORMAL',     # Safe with WAL and a lot fewer fsyncs
+    'PRAGMA mmap_size=268435456',    # Read the file through 256 MB of memory map
+    'PRAGMA cache_size=-16000',      # About 16 MB page cache per connection
+    'PRAGMA busy_timeout=5000',      # Wait up to 5s for a lock instead of failing right away
+]
+
+# sqlite3 keeps this many prepared statements per connection, so reusing
+# connections means the same SQL doesn't get parsed again every call
+STATEMENT_CACHE_SIZE = 256
+
+class ConnectionPool:
+    # Keeps SQLite connections open and hands them out one thread at a time
+    def __init__(self, db_name, max_connections=8, timeout=10.0):
+        self.db_name = db_name
+        self.max_connections = max_connections  # Most connections open at once
+        self.timeout = timeout                  # Seconds to wait for a free connection
+        self.idle = []                          # Open connections nobody is using right now
+        self.open_count = 0                     # Connections opened (idle + in use)
+        self.condition = threading.Condition()
+        self.local = threading.local()          # Which connection this thread is holding
+        # Counters for checking how well the pool is doing
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0}
+
+    def open_connection(self):
+        # check_same_thread=False because a connection can be used by different
+        # threads over its life - but only ever by one thread at a time
+        conn = sqlite3.connect(self.db_name, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        # Same thread asking again (nested call) gets the connection it already has
+        held = getattr(self.local, 'conn', None)
+        if held is not None:
+            self.local.depth += 1
+            return held
+
+        with self.condition:
+            if not self.idle and self.open_count >= self.max_connections:
+                # Everything is in use - wait for someone to give one back
+                self.stats['waits'] += 1
+                start = time.monotonic()
+                if not self.condition.wait_for(lambda: self.idle, self.timeout):
+                    raise sqlite3.OperationalError("Timed out waiting for a database connection")
+                self.stats['wait_time'] += time.monotonic() - start
+
+            if self.idle:
+                self.stats['hits'] += 1
+                conn = self.idle.pop()  # Most recently used - its cache is warmest
+            else:
+                self.stats['misses'] += 1
+                self.open_count += 1
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self.open_connection()
+            except sqlite3.Error:
+                with self.condition:
+                    self.open_count -= 1
+                    self.condition.notify()
+                raise
+
+        self.local.conn = conn
+        self.local.depth = 1
+        return conn
+
+    def release(self, conn):
+        self.local.depth -= 1
+        if self.local.depth > 0:
+            return  # Still inside an outer call on this thread
+        self.local.conn = None
+        if conn.in_transaction:
+            conn.rollback()  # Don't hand out a connection with half-finished work
+        with self.condition:
+            self.idle.append(conn)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        # Usage: with pool.connection() as conn: ...
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['open'] = self.open_count
+            stats['idle'] = len(self.idle)
+        return stats
+
+    def close_all(self):
+        # Close idle connections (ones in use get closed when the pool is gone)
+        with self.condition:
+            for conn in self.idle:
+                conn.close()
+            self.open_count -= len(self.idle)
+            self.idle = []
+
+# One pool per database file, shared by every class in the process
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(db_name='equipment_checkout.db'):
+    with pools_lock:
+        if db_name not in pools:
+            pools[db_name] = ConnectionPool(db_name)
+        return pools[db_name]
@@ -1,5 +1,8 @@
 import sqlite3           # SQLite database library (comes with Python)
-from datetime import datetime  # For creating timestamps
+from migrations import run_migrations  # Versioned schema changes
+from passwords import hash_password    # Salted password hashing
+from timestamps import now             # Times are stored as Unix seconds
+from summary_counts import rebuild_summary_counts  # Dashboard counters
 
 def create_database():
     # Create the SQLite database file and tables
@@ -14,12 +17,12 @@ def create_database():
         CREATE TABLE IF NOT EXISTS employees (
             employee_id TEXT PRIMARY KEY,     -- Unique employee ID
             username TEXT UNIQUE NOT NULL,    -- Login username (must be unique)
-            password TEXT NOT NULL,           -- Login password (should encrypt in real system)
+            password TEXT NOT NULL,           -- Salted password hash (see passwords.py)
             name TEXT NOT NULL,               -- Full employee name
             skill_level TEXT,                 -- Employee skill level
             department TEXT,                  -- Which department they work in
             is_active BOOLEAN DEFAULT 1,      -- Can they login? (1=yes, 0=no)
-            created_date TEXT                 -- When was this record created
+            created_date INTEGER              -- When was this record created (Unix time)
         )
     ''')
     
@@ -33,31 +36,37 @@ def create_database():
             status TEXT DEFAULT 'available', -- Current status (available, checked_out, maintenance)
             condition_status TEXT DEFAULT 'good', -- Condition (good, damaged, broken)
             checked_out_to TEXT,              -- Employee ID who has it (if checked out)
-            created_date TEXT                 -- When was this tool added
+            created_date INTEGER,             -- When was this tool added (Unix time)
+            version INTEGER NOT NULL DEFAULT 0, -- Goes up on every change (stops double checkouts)
+            change_seq INTEGER NOT NULL DEFAULT 0 -- Catalog change number of the last change (for refresh)
         )
     ''')
     
     # Create transactions table to track checkouts and returns
-    # Should probably save our in-memory transactions here too
+    # CheckoutSystem saves checkouts and returns here through DatabaseWriter
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS transactions (
             transaction_id TEXT PRIMARY KEY,  -- Unique transaction ID
             employee_id TEXT NOT NULL,        -- Who did the transaction
             tool_id TEXT NOT NULL,            -- What tool was involved
             transaction_type TEXT NOT NULL,   -- "checkout" or "return"
-            checkout_date TEXT,               -- When was it checked out
-            return_date TEXT,                 -- When was it returned (NULL if still out)
+            checkout_date INTEGER,            -- When was it checked out (Unix time)
+            return_date INTEGER,              -- When was it returned (NULL if still out)
             condition_on_return TEXT,         -- Condition when returned
             notes TEXT                        -- Any notes about the transaction
         )
     ''')
     
+    # Bring older database files up to date (indexes, newer columns)
+    conn.commit()
+    run_migrations(conn)
+
     # Insert test employees for login testing
-    # Remember: In real system passwords would be encrypted!
+    # Passwords are stored hashed, never as plain text
     employees_data = [
-        ('EMP001', 'employee1', 'password123', 'John Smith', 'Level 2', 'Maintenance', 1, datetime.now().isoformat()),
-        ('EMP002', 'employee2', 'password456', 'Jane Doe', 'Level 3', 'Maintenance', 1, datetime.now().isoformat()),
-        ('MGR001', 'manager1', 'manager123', 'Bob Johnson', 'Manager', 'Management', 1, datetime.now().isoformat())
+        ('EMP001', 'employee1', hash_password('password123'), 'John Smith', 'Level 2', 'Maintenance', 1, now()),
+        ('EMP002', 'employee2', hash_password('password456'), 'Jane Doe', 'Level 3', 'Maintenance', 1, now()),
+        ('MGR001', 'manager1', hash_password('manager123'), 'Bob Johnson', 'Manager', 'Management', 1, now())
     ]
     
     # Insert or replace (so we can run this script multiple times safely)
@@ -69,10 +78,10 @@ def create_database():
     
     # Insert sample tools for testing
     tools_data = [
-        ('TOOL001', '123456789', 'Hammer', 'Hand Tools', 'available', 'good', None, datetime.now().isoformat()),
-        ('TOOL002', '987654321', 'Power Drill', 'Power Tools', 'available', 'good', None, datetime.now().isoformat()),
-        ('TOOL003', '456789123', 'Screwdriver Set', 'Hand Tools', 'available', 'good', None, datetime.now().isoformat()),
-        ('TOOL004', '789123456', 'Socket Wrench', 'Hand Tools', 'available', 'good', None, datetime.now().isoformat())
+        ('TOOL001', '123456789', 'Hammer', 'Hand Tools', 'available', 'good', None, now()),
+        ('TOOL002', '987654321', 'Power Drill', 'Power Tools', 'available', 'good', None, now()),
+        ('TOOL003', '456789123', 'Screwdriver Set', 'Hand Tools', 'available', 'good', None, now()),
+        ('TOOL004', '789123456', 'Socket Wrench', 'Hand Tools', 'available', 'good', None, now())
     ]
     
     cursor.executemany('''
@@ -80,6 +89,9 @@ def create_database():
         (tool_id, barcode, tool_name, category, status, condition_status, checked_out_to, created_date)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', tools_data)
+    # REPLACE takes out the old row without firing the delete triggers, so
+    # running this again would count the sample tools twice - count them afresh
+    rebuild_summary_counts(conn)
     
     # Save changes and close database
     conn.commit()  # Important: save the changes!
@@ -0,0 +1,136 @@
+import atexit     # So we can flush anything left over when the program exits
+import logging
+import threading  # Writes happen on a background thread
+import time
+from concurrent.futures import Future  # Lets a request thread wait for its write's result
+from database_pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+class DatabaseWriter:
+    # Writes to the database in batches on one background thread
+    # Committing once per scan is too slow at shift change, so every change that
+    # arrives while a batch is being written shares the next commit (group commit)
+    def __init__(self, db_name, batch_size=100, flush_interval=0.5):
+        self.db_name = db_name
+        self.pool = get_pool(db_name)         # Shared connections (WAL is set up by the pool)
+        self.batch_size = batch_size          # Write as soon as this many changes are waiting
+        self.flush_interval = flush_interval  # ...or when the oldest change is this many seconds old
+        self.pending = []                     # List of (operation, future) waiting to be written
+        self.oldest_pending = None            # time.monotonic() of the first waiting change
+        self.urgent = False                   # Someone is waiting on a result - don't sit on the batch
+        self.writing = False                  # True while the thread is in the middle of a batch
+        self.running = True
+        self.condition = threading.Condition()  # Protects everything above
+
+        self.thread = threading.Thread(target=self.run, name="DatabaseWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def queue_write(self, sql, parameters):
+        # Fire and forget - called from the request thread, just adds to the list
+        # It gets committed with the next batch (size or time threshold)
+        self.add(lambda conn: conn.execute(sql, parameters), None)
+
+    def run_now(self, operation):
+        # Run operation(conn) in the next batch and wait until it's committed
+        # Used for checkout/return where the caller needs to know if it worked
+        # Other requests waiting at the same time share the same commit
+        return self.submit(operation).result()  # Raises the operation's error if it failed
+
+    def submit(self, operation):
+        # Same as run_now, but hands back the Future instead of waiting on it
+        # (async code awaits it with asyncio.wrap_future)
+        future = Future()
+        self.add(operation, future)
+        return future
+
+    def add(self, operation, future):
+        with self.condition:
+            if not self.pending:
+                self.oldest_pending = time.monotonic()
+            self.pending.append((operation, future))
+            if future is not None:
+                self.urgent = True
+            if self.urgent or len(self.pending) >= self.batch_size:
+                self.condition.notify_all()  # Wake the writer early
+
+    def flush(self):
+        # Block until everything queued so far is committed
+        # Reports call this so they see the latest checkouts
+        with self.condition:
+            self.urgent = True
+            self.condition.notify_all()
+            while (self.pending or self.writing) and self.thread.is_alive():
+                self.condition.wait()
+
+    def close(self):
+        # Stop the thread after it writes whatever is left
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                # Sleep until the batch is full, old enough, needed now, or we're shutting down
+                while self.running:
+                    if self.urgent or len(self.pending) >= self.batch_size:
+                        break
+                    if self.pending:
+                        wait_time = self.oldest_pending + self.flush_interval - time.monotonic()
+                        if wait_time <= 0:
+                            break
+                    else:
+                        wait_time = None  # Nothing to do - wait for add()
+                    self.condition.wait(wait_time)
+
+                if not self.pending and not self.running:
+                    break
+                batch = self.pending
+                self.pending = []
+                self.urgent = False
+                self.writing = True
+
+            try:
+                self.write_batch(batch)
+            except Exception as error:
+                logger.error("Error saving %d changes to database: %s", len(batch), error)
+                for operation, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(error)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()  # Wake anyone waiting in flush()
+
+    def write_batch(self, batch):
+        # All changes in the batch share one commit (one fsync instead of one per scan)
+        # Each change gets its own savepoint so one failing doesn't undo the others
+        results = []
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')  # Take the write lock now, not halfway through
+            for operation, future in batch:
+                conn.execute('SAVEPOINT batch_item')
+                try:
+                    result = operation(conn)
+                    conn.execute('RELEASE batch_item')
+                    results.append((future, result, None))
+                except Exception as error:
+                    conn.execute('ROLLBACK TO batch_item')
+                    conn.execute('RELEASE batch_item')
+                    results.append((future, None, error))
+            conn.commit()
+
+        # Only tell callers it worked once the commit is done
+        for future, result, error in results:
+            if future is None:
+                if error is not None:
+                    logger.error("Error saving change to database: %s", error)
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -1,9 +1,13 @@
 class Employee:
+    # Fixed set of attributes (no per-object __dict__) like Tool and Transaction
+    __slots__ = ('employee_id', 'username', 'password', 'name', 'skill_level', 'department',
+                 'is_logged_in')
+
     def __init__(self):
         # Basic employee info - remember these match the database fields
         self.employee_id = ""
         self.username = ""
-        self.password = ""  # Note: in real system this would be encrypted
+        self.password = ""  # Not filled in - the database only keeps a salted hash
         self.name = ""
         self.skill_level = ""
         self.department = ""
@@ -0,0 +1,95 @@
+import collections
+import queue
+import secrets
+import threading
+
+class Subscription:
+    # One live connection's view of the events
+    # Its queue only ever holds events that haven't been sent yet
+    RESET = "reset"  # Returned by get() when events were missed - the client should reload
+
+    def __init__(self, broker, queue_size):
+        self.broker = broker
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.missed = False  # Fell too far behind (or reconnected too late) to catch up
+
+    def get(self, timeout):
+        # Next (event_id, event), RESET, or None if nothing happened within timeout
+        if self.missed:
+            return Subscription.RESET
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return Subscription.RESET if self.missed else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class EventBroker:
+    # Hands tool status changes to everyone watching the live stream
+    # publish() never waits on a subscriber: each one has its own small queue,
+    # and one that fills up (stuck browser) is dropped and told to reload.
+    # So a checkout costs the same with 0 or 100 people watching
+    def __init__(self, max_subscribers=100, queue_size=256, history_size=1000):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        # Event IDs look like "<token>-<number>"; the token changes every time the
+        # server starts (and is different in each worker process), so an ID from
+        # somewhere else is never mistaken for one of ours
+        self.token = secrets.token_hex(4)
+        self.next_number = 1
+        # Recent events, so a client that reconnects quickly gets what it missed
+        self.history = collections.deque(maxlen=history_size)  # (number, event_id, event)
+
+    def publish(self, event):
+        with self.lock:
+            number = self.next_number
+            self.next_number += 1
+            event_id = f"{self.token}-{number}"
+            self.history.append((number, event_id, event))
+            for subscription in list(self.subscribers):
+                try:
+                    subscription.queue.put_nowait((event_id, event))
+                except queue.Full:
+                    subscription.missed = True
+                    self.subscribers.discard(subscription)
+
+    def subscribe(self, last_event_id=None):
+        # New Subscription, or None if too many are connected already
+        # last_event_id is the Last-Event-ID header the browser sends when it reconnects
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, self.queue_size)
+            if last_event_id:
+                self.catch_up(subscription, last_event_id)
+            if not subscription.missed:
+                self.subscribers.add(subscription)
+            return subscription
+
+    def catch_up(self, subscription, last_event_id):
+        # Queue up the events a reconnecting client missed (caller holds self.lock)
+        token, _, number = last_event_id.partition("-")
+        if token != self.token or not number.isdigit():
+            subscription.missed = True  # ID from before a restart or from another worker
+            return
+        number = int(number)
+        if self.history and number < self.history[0][0] - 1:
+            subscription.missed = True  # Gone from history already
+            return
+        missed_events = [(event_id, event) for event_number, event_id, event in self.history if event_number > number]
+        if len(missed_events) > self.queue_size:
+            subscription.missed = True
+            return
+        for item in missed_events:
+            subscription.queue.put_nowait(item)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
\ No newline at end of file
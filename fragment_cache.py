@@ -0,0 +1,37 @@
+import threading
+from collections import OrderedDict
+
+class FragmentCache:
+    # Rendered pieces of HTML that are slow to build (like the dropdown with
+    # every available tool in it), so a page can reuse them instead of
+    # rendering thousands of rows on every hit
+    # Each piece is saved with the catalog version (catalog_state.change_seq) it
+    # was built from - once any tool changes, the next request builds it again
+    def __init__(self, max_entries=256):
+        self.entries = OrderedDict()  # key -> (version, html), least recently used first
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, key, version, build):
+        # Cached HTML for key if it was built from this version, otherwise build() it
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+        # Build outside the lock so other pages aren't held up
+        html = build()
+        with self.lock:
+            self.entries[key] = (version, html)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)  # Forget the least recently used
+        return html
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
\ No newline at end of file
@@ -0,0 +1,211 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Crockford base32 - no I, L, O, U so IDs are easy to read off a label
+# The characters are in ASCII order, so sorting IDs as text sorts them by time
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 13  # 13 base32 characters hold the whole 64-bit number
+
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC - timestamps count from here
+WORKER_BITS = 10          # Up to 1024 processes making IDs at the same time
+SEQUENCE_BITS = 12        # Up to 4096 IDs per millisecond per process
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Without ECS_WORKER_ID, each process claims a free worker number in the
+# worker_leases table (migration 13) and a background thread keeps renewing it
+LEASE_SECONDS = 600
+LEASE_MARGIN = 60         # Stop using a number this long before its lease runs out
+RETRY_SECONDS = 10        # Wait after a failed renewal before trying again
+
+class WorkerLease:
+    # One worker number per process, shared by all the generators below
+    # The system that owns the database calls start() with it; the number is
+    # claimed there and renewed half way through each lease on our own thread,
+    # so making an ID never has to wait for the database. A process that dies
+    # without letting go just holds it until it expires
+    def __init__(self, db_name='equipment_checkout.db'):
+        self.db_name = db_name      # Until start() says which database
+        self.started = False        # start() has picked the database
+        self.worker_id = None
+        self.owner = None           # What our row in worker_leases says ("<pid>:<random>")
+        self.pid = None             # Process the lease was claimed by (a forked child needs its own)
+        self.expires_at = 0.0       # time.time() our lease in the database runs out
+        self.renew_at = 0.0         # Renew when time.time() gets here (half way through)
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.renewer_pid = None     # Process the renewal thread is running in
+        self.running = True
+        atexit.register(self.close)
+
+    def start(self, db_name):
+        # Claim a number in db_name now and keep it renewed from then on
+        # Errors are only logged - the first ID will try again
+        with self.lock:
+            if not self.started:
+                self.db_name = db_name
+                self.started = True
+            elif db_name != self.db_name:
+                logger.warning("Worker number already comes from %s, not %s", self.db_name, db_name)
+                return
+        try:
+            self.current()
+        except (sqlite3.Error, RuntimeError) as error:
+            logger.error("Could not claim a worker number: %s", error)
+
+    def current(self):
+        # The worker number this process can use right now
+        # Almost always just what the renewal thread last got - the database is
+        # only asked here if nothing has claimed one in this process yet (or
+        # renewing has been failing for a long time)
+        if self.pid == os.getpid() and time.time() < self.expires_at - LEASE_MARGIN:
+            return self.worker_id
+        return self.acquire()
+
+    def needs_renewal(self):
+        return self.pid != os.getpid() or time.time() >= self.renew_at
+
+    def acquire(self):
+        # Claim or renew the lease - returns the worker number
+        with self.lock:
+            if not self.needs_renewal():
+                return self.worker_id
+            # Own connection - callers might be holding a pool connection, and a
+            # claim is rare (once per process, then every LEASE_SECONDS / 2)
+            conn = sqlite3.connect(self.db_name, timeout=10)
+            try:
+                conn.execute('BEGIN IMMEDIATE')  # Nobody else claims between the look and the write
+                now = time.time()
+                expires_at = int(now + LEASE_SECONDS)
+                renewed = self.pid == os.getpid() and conn.execute(
+                    'UPDATE worker_leases SET expires_at = ? WHERE worker_id = ? AND owner = ? AND expires_at > ?',
+                    (expires_at, self.worker_id, self.owner, now)).rowcount == 1
+                if not renewed:
+                    # First claim in this process, or ours ran out - take the lowest free number
+                    taken = {row[0] for row in conn.execute(
+                        'SELECT worker_id FROM worker_leases WHERE expires_at > ?', (now,))}
+                    free = [worker for worker in range(MAX_WORKER + 1) if worker not in taken]
+                    if not free:
+                        raise RuntimeError(f"All {MAX_WORKER + 1} worker numbers are in use - set ECS_WORKER_ID")
+                    owner = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"  # A reused PID isn't us
+                    conn.execute('INSERT OR REPLACE INTO worker_leases (worker_id, owner, expires_at) VALUES (?, ?, ?)',
+                                 (free[0], owner, expires_at))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise  # What we had is still good until expires_at
+            finally:
+                conn.close()
+            if not renewed:
+                self.worker_id, self.owner = free[0], owner
+            self.pid = os.getpid()
+            self.expires_at = expires_at
+            self.renew_at = now + LEASE_SECONDS / 2
+            worker_id = self.worker_id
+        self.start_renewing()
+        return worker_id
+
+    def start_renewing(self):
+        # One renewal thread per process (threads don't survive a fork)
+        with self.condition:
+            if self.renewer_pid == os.getpid() or not self.running:
+                return
+            self.renewer_pid = os.getpid()
+        threading.Thread(target=self.run, name="WorkerLease", daemon=True).start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(max(self.renew_at - time.time(), 0))
+                if not self.running or self.renewer_pid != os.getpid():
+                    break
+            if time.time() < self.renew_at:
+                continue  # Woken early
+            try:
+                self.acquire()
+            except Exception as error:
+                logger.error("Could not renew worker number %s: %s", self.worker_id, error)
+                self.renew_at = time.time() + RETRY_SECONDS
+
+    def close(self):
+        # Stop renewing and give the number back on a clean exit so the next
+        # process can have it
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        with self.lock:
+            if self.pid != os.getpid():
+                return  # Never claimed one, or it belongs to the process we were forked from
+            self.pid = None
+            try:
+                conn = sqlite3.connect(self.db_name, timeout=1)
+                with conn:
+                    conn.execute('DELETE FROM worker_leases WHERE worker_id = ? AND owner = ?',
+                                 (self.worker_id, self.owner))
+                conn.close()
+            except sqlite3.Error:
+                pass  # It runs out by itself
+
+class IdGenerator:
+    # Makes unique, time-ordered IDs without asking the database (Snowflake style)
+    # Each ID packs: milliseconds since EPOCH_MS | worker number | counter
+    # Two processes never clash because their worker numbers are different
+    def __init__(self, prefix, worker_id=None):
+        self.prefix = prefix            # Like "TXN" or "RPT"
+        self.fixed_worker_id = worker_id
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def current_worker_id(self):
+        # ECS_WORKER_ID can be set to a different number (0-1023) for each worker
+        # process; otherwise the one this process holds in worker_leases
+        # (not the process ID - two of those can share the same low 10 bits)
+        if self.fixed_worker_id is not None:
+            return self.fixed_worker_id & MAX_WORKER
+        worker = os.environ.get('ECS_WORKER_ID')
+        if worker is not None:
+            return int(worker) & MAX_WORKER
+        return worker_lease.current()
+
+    def next_number(self):
+        # Worker number first, outside self.lock - if it does have to go to the
+        # database, other threads' IDs don't wait behind it
+        worker_id = self.current_worker_id()
+        with self.lock:
+            # (ms, counter) keeps going up across a change of worker number too,
+            # so IDs from this process never repeat
+            now_ms = time.time_ns() // 1000000 - EPOCH_MS
+            if now_ms < self.last_ms:
+                now_ms = self.last_ms  # Clock went backwards - keep going from where we were
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # Used all 4096 numbers this millisecond - move on to the next one
+                    now_ms = self.last_ms + 1
+            else:
+                self.sequence = 0
+            self.last_ms = now_ms
+            return (now_ms << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | self.sequence
+
+    def next_id(self):
+        number = self.next_number()
+        chars = []
+        for _ in range(ID_LENGTH):
+            chars.append(ALPHABET[number & 31])
+            number >>= 5
+        return self.prefix + "".join(reversed(chars))
+
+# Shared generators - use these instead of making new ones
+worker_lease = WorkerLease()
+transaction_ids = IdGenerator("TXN")
+report_ids = IdGenerator("RPT")
+reservation_ids = IdGenerator("RSV")
+booking_ids = IdGenerator("BKG")
@@ -1,87 +1,259 @@
+import logging
+import threading
+import time
+from database_pool import get_pool
+from database_writer import DatabaseWriter
+from id_generator import reservation_ids
+
+# Messages go through logging (see logging_setup.py) like the rest of the backend
+logger = logging.getLogger(__name__)
+
+# Reservations nobody picks up go back on the shelf after this many seconds
+DEFAULT_RESERVATION_TTL = 15 * 60
+
+# Columns read for one stock row, plus when its first reservation runs out
+STOCK_QUERY = '''
+    SELECT quantity, available, checked_out, held, version,
+           (SELECT MIN(expires_at) FROM stock_reservations WHERE item_id = ?)
+    FROM stock WHERE item_id = ?
+'''
+
+class StockLevel:
+    # Counts for one item as last read from the database
+    # quantity = available + checked_out + held
+    __slots__ = ('item_id', 'quantity', 'available', 'checked_out', 'held', 'version',
+                 'next_expiry', 'loaded_at')
+
+    def __init__(self, item_id, row):
+        self.item_id = item_id
+        self.quantity, self.available, self.checked_out, self.held, self.version, self.next_expiry = row
+        self.loaded_at = time.monotonic()  # For deciding when our copy is too old
+
 class Inventory:
-    def __init__(self):
-        # Basic inventory tracking fields
-        self.inventory_id = ""    # Unique ID for inventory record
-        self.tool_id = ""         # Which tool this tracks
-        self.quantity = 0         # Total number we have
-        self.available = 0        # How many are available now
-        self.reserved = 0         # How many are checked out
-        # Dictionary to track all our tools - key is tool_id, value is quantities
-        self.inventory_items = {}  # This is like a mini database in memory
-    
+    # Stock for pooled tools and consumables - "50 identical torque wrenches"
+    # (the tools table has one row per tool; this counts how many of an item there are)
+    # Counts live in the stock table and only ever change with conditional
+    # UPDATEs like "available = available - 2 WHERE available >= 2", so two
+    # worker processes can never both hand out the last wrench.
+    # check_stock() answers from memory - the database is only asked again when
+    # our copy is older than cache_seconds or a reservation has run out
+    def __init__(self, db_name='equipment_checkout.db', writer=None, cache_seconds=1.0):
+        self.db_name = db_name
+        self.pool = get_pool(db_name)
+        self.writer = writer or DatabaseWriter(db_name)  # Share CheckoutSystem's writer if there is one
+        self.cache_seconds = cache_seconds  # How out of date another worker's changes can be here
+        # item_id -> StockLevel (read-through cache)
+        # Whole StockLevel objects get swapped in, so readers never need a lock
+        self.inventory_items = {}
+        self.lock = threading.Lock()  # Only for swapping in new counts
+
     def add_tool_to_inventory(self, tool_id, quantity):
-        # Add tools to our inventory tracking
-        # If tool already exists, add to the count
-        if tool_id in self.inventory_items:
-            self.inventory_items[tool_id]['quantity'] += quantity
-            self.inventory_items[tool_id]['available'] += quantity
-        else:
-            # New tool - create new entry
-            # Remember: available starts same as quantity
-            self.inventory_items[tool_id] = {
-                'quantity': quantity,    # Total we own
-                'available': quantity,   # Available to checkout
-                'reserved': 0           # Currently checked out
-            }
-        print(f"Added {quantity} of tool {tool_id} to inventory")
-    
+        # Add more of an item (creates it the first time)
+        if quantity <= 0:
+            raise ValueError("quantity must be positive")
+
+        def add(conn):
+            conn.execute('''
+                INSERT INTO stock (item_id, quantity, available) VALUES (?, ?, ?)
+                ON CONFLICT(item_id) DO UPDATE SET quantity = quantity + excluded.quantity,
+                    available = available + excluded.quantity, version = version + 1
+            ''', (tool_id, quantity, quantity))
+            return self.read_level(conn, tool_id)
+        self.remember(self.writer.run_now(add))
+        logger.info("Added %d of %s to inventory", quantity, tool_id)
+
     def update_quantity(self, tool_id, change):
-        # Update inventory when tools are checked out or returned
-        # change is negative for checkout, positive for return
-        if tool_id in self.inventory_items:
-            if change < 0:  # Tool being checked out
-                if self.inventory_items[tool_id]['available'] >= abs(change):
-                    # We have enough available
-                    self.inventory_items[tool_id]['available'] += change  # Subtract from available
-                    self.inventory_items[tool_id]['reserved'] -= change   # Add to reserved
-                    print(f"Inventory updated: {tool_id} available count changed by {change}")
-                    return True
-                else:
-                    print(f"Error: Not enough {tool_id} available")
-                    return False
-            else:  # Tool being returned
-                self.inventory_items[tool_id]['available'] += change      # Add back to available
-                self.inventory_items[tool_id]['reserved'] -= change       # Remove from reserved
-                print(f"Inventory updated: {tool_id} returned to available")
-                return True
+        # Checkout (change < 0) or return (change > 0) some of an item
+        # Returns False if there aren't enough available (or that many out)
+        if change < 0:
+            sql = '''UPDATE stock SET available = available - ?, checked_out = checked_out + ?,
+                     version = version + 1 WHERE item_id = ? AND available >= ?'''
         else:
-            print(f"Error: Tool {tool_id} not found in inventory")
+            sql = '''UPDATE stock SET available = available + ?, checked_out = checked_out - ?,
+                     version = version + 1 WHERE item_id = ? AND checked_out >= ?'''
+        amount = abs(change)
+        level = self.writer.run_now(lambda conn: self.change_counts(conn, tool_id, sql, (amount, amount, tool_id, amount)))
+        if level is None:
+            logger.info("Inventory change refused: %s by %d", tool_id, change)
             return False
-        
+        self.remember(level)
+        logger.debug("Inventory updated: %s changed by %d", tool_id, change)
+        return True
+
     def check_stock(self, tool_id):
-        # See how many of a tool we have available
-        # Useful before allowing checkouts
-        if tool_id in self.inventory_items:
-            item = self.inventory_items[tool_id]
-            print(f"Tool {tool_id}: Total={item['quantity']}, Available={item['available']}, Reserved={item['reserved']}")
-            return item['available']
-        else:
-            print(f"Tool {tool_id} not found in inventory")
-            return 0
-        
-    def reserve_tool(self, tool_id):
-        # Reserve a tool for checkout (move from available to reserved)
-        # TODO: This might be useful for advanced features later
-        if tool_id in self.inventory_items:
-            if self.inventory_items[tool_id]['available'] > 0:
-                self.inventory_items[tool_id]['available'] -= 1
-                self.inventory_items[tool_id]['reserved'] += 1
-                print(f"Tool {tool_id} reserved successfully")
-                return True
-            else:
-                print(f"Tool {tool_id} not available for reservation")
-                return False
-        else:
-            print(f"Tool {tool_id} not found in inventory")
-            return False
-    
+        # How many of an item can be checked out right now (0 if we don't stock it)
+        level = self.get_stock(tool_id)
+        return level.available if level else 0
+
+    def get_stock(self, tool_id):
+        # StockLevel for an item, from memory if our copy is fresh enough
+        level = self.inventory_items.get(tool_id)
+        if (level is not None and time.monotonic() - level.loaded_at < self.cache_seconds
+                and (level.next_expiry is None or time.time() < level.next_expiry)):
+            return level
+        return self.load_level(tool_id)
+
+    def load_level(self, tool_id):
+        # Read an item from the database (and give back any reservations that ran out)
+        with self.pool.connection() as conn:
+            row = conn.execute(STOCK_QUERY, (tool_id, tool_id)).fetchone()
+        if row is None:
+            return None
+        level = StockLevel(tool_id, row)
+        if level.next_expiry is not None and time.time() >= level.next_expiry:
+            self.expire_reservations(tool_id)
+            return self.inventory_items.get(tool_id)
+        return self.remember(level)
+
+    def reserve_tool(self, tool_id, quantity=1, employee_id="", ttl=DEFAULT_RESERVATION_TTL):
+        # Hold some of an item for someone (moves it from available to held)
+        # Returns the reservation ID, or None if there aren't enough available
+        # Held stock goes back to available by itself after ttl seconds unless
+        # it's picked up (pick_up_reservation) or cancelled first
+        if quantity <= 0:
+            raise ValueError("quantity must be positive")
+        reservation_id = reservation_ids.next_id()
+        expires_at = int(time.time() + ttl)
+
+        def reserve(conn):
+            level = self.change_counts(conn, tool_id, '''
+                UPDATE stock SET available = available - ?, held = held + ?, version = version + 1
+                WHERE item_id = ? AND available >= ?
+            ''', (quantity, quantity, tool_id, quantity))
+            if level is None:
+                return None
+            conn.execute('''
+                INSERT INTO stock_reservations (reservation_id, item_id, employee_id, quantity, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (reservation_id, tool_id, employee_id, quantity, expires_at))
+            return self.read_level(conn, tool_id)
+
+        level = self.writer.run_now(reserve)
+        if level is None:
+            logger.info("Tool %s not available for reservation", tool_id)
+            return None
+        self.remember(level)
+        logger.info("Reserved %d of %s for %s (%s)", quantity, tool_id, employee_id, reservation_id)
+        return reservation_id
+
+    def pick_up_reservation(self, reservation_id):
+        # Reserved stock is being taken - held becomes checked out
+        return self.end_reservation(reservation_id, '''
+            UPDATE stock SET held = held - ?, checked_out = checked_out + ?, version = version + 1
+            WHERE item_id = ? AND held >= ?
+        ''')
+
+    def cancel_reservation(self, reservation_id):
+        # Put reserved stock back on the shelf
+        return self.end_reservation(reservation_id, '''
+            UPDATE stock SET held = held - ?, available = available + ?, version = version + 1
+            WHERE item_id = ? AND held >= ?
+        ''')
+
+    def end_reservation(self, reservation_id, sql):
+        # False if the reservation doesn't exist any more (already used, cancelled or expired)
+        # or the stock counts can't cover it (then it's left as it was)
+        def end(conn):
+            row = conn.execute('''
+                SELECT item_id, quantity FROM stock_reservations WHERE reservation_id = ? AND expires_at > ?
+            ''', (reservation_id, int(time.time()))).fetchone()
+            if row is None:
+                return None
+            item_id, quantity = row
+            # The reservation only goes if the counts move with it - otherwise the
+            # held stock would never be given back
+            conn.execute('SAVEPOINT end_reservation')
+            deleted = conn.execute('DELETE FROM stock_reservations WHERE reservation_id = ?',
+                                   (reservation_id,)).rowcount == 1
+            level = deleted and self.change_counts(conn, item_id, sql, (quantity, quantity, item_id, quantity))
+            if not level:
+                conn.execute('ROLLBACK TO end_reservation')
+                logger.error("Stock counts for %s don't cover reservation %s - left it in place",
+                             item_id, reservation_id)
+            conn.execute('RELEASE end_reservation')
+            return level or None
+        level = self.writer.run_now(end)
+        return self.remember(level) is not None
+
+    def expire_reservations(self, tool_id=None):
+        # Give back stock held by reservations past their time (one item, or all)
+        # Returns how many reservations expired
+        def expire(conn):
+            sql = 'SELECT reservation_id, item_id, quantity FROM stock_reservations WHERE expires_at <= ?'
+            params = [int(time.time())]
+            if tool_id is not None:
+                sql += ' AND item_id = ?'
+                params.append(tool_id)
+            expired = conn.execute(sql, params).fetchall()
+            count = 0
+            stuck = set()  # Items with a reservation that couldn't be given back
+            for reservation_id, item_id, quantity in expired:
+                # Same as end_reservation: one that the counts can't cover is left
+                # in place (and logged) instead of failing the whole sweep
+                conn.execute('SAVEPOINT expire_reservation')
+                conn.execute('DELETE FROM stock_reservations WHERE reservation_id = ?', (reservation_id,))
+                level = self.change_counts(conn, item_id, '''
+                    UPDATE stock SET held = held - ?, available = available + ?, version = version + 1
+                    WHERE item_id = ? AND held >= ?
+                ''', (quantity, quantity, item_id, quantity))
+                if level is None:
+                    conn.execute('ROLLBACK TO expire_reservation')
+                    logger.error("Stock counts for %s don't cover expired reservation %s - left it in place",
+                                 item_id, reservation_id)
+                    stuck.add(item_id)
+                else:
+                    count += 1
+                conn.execute('RELEASE expire_reservation')
+            changed = {item_id for reservation_id, item_id, quantity in expired}
+            if tool_id is not None:
+                changed.add(tool_id)
+            levels = [self.read_level(conn, item_id) for item_id in changed]
+            for level in levels:
+                if level is not None and level.item_id in stuck:
+                    # Its next_expiry is already past - without this every check_stock()
+                    # would sweep again; now it's only retried every cache_seconds
+                    level.next_expiry = None
+            return count, levels
+
+        count, levels = self.writer.run_now(expire)
+        for level in levels:
+            self.remember(level)
+        if count:
+            logger.info("%d reservations expired", count)
+        return count
+
+    def change_counts(self, conn, item_id, sql, params):
+        # Runs on the writer thread - conditional UPDATE, then the new counts
+        # None if the UPDATE's condition didn't match (not enough stock)
+        if conn.execute(sql, params).rowcount != 1:
+            return None
+        return self.read_level(conn, item_id)
+
+    def read_level(self, conn, item_id):
+        row = conn.execute(STOCK_QUERY, (item_id, item_id)).fetchone()
+        return StockLevel(item_id, row) if row else None
+
+    def remember(self, level):
+        # Keep the newest counts we've seen (only once they're committed)
+        # Two threads can finish in either order, so never go back to an older version
+        if level is not None:
+            with self.lock:
+                cached = self.inventory_items.get(level.item_id)
+                if cached is None or level.version >= cached.version:
+                    self.inventory_items[level.item_id] = level
+        return level
+
     def get_inventory_summary(self):
         # Print out current status of all inventory
         # Good for debugging and reports
         print("\n=== Inventory Summary ===")
-        if not self.inventory_items:
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT item_id, quantity, available, checked_out, held FROM stock ORDER BY item_id
+            ''').fetchall()
+        if not rows:
             print("No items in inventory")
             return
-            
-        for tool_id, item in self.inventory_items.items():
-            print(f"{tool_id}: Total={item['quantity']}, Available={item['available']}, Out={item['reserved']}")
\ No newline at end of file
+
+        for item_id, quantity, available, checked_out, held in rows:
+            print(f"{item_id}: Total={quantity}, Available={available}, Out={checked_out}, Reserved={held}")
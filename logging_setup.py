@@ -0,0 +1,31 @@
+import atexit
+import logging
+import logging.handlers  # QueueHandler / QueueListener
+import os
+import queue
+
+# Started once by setup_logging() - writes log lines on its own thread
+listener = None
+
+def setup_logging(level=None):
+    # Send all log messages through a queue so checkout/return never wait on
+    # stdout (slow when it's piped to a log collector)
+    # Level comes from ECS_LOG_LEVEL if not given: DEBUG, INFO, WARNING, ERROR
+    # WARNING or higher turns off the per-checkout messages completely
+    global listener
+    if level is None:
+        level = os.environ.get('ECS_LOG_LEVEL', 'INFO').upper()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if listener is not None:
+        return  # Already set up - just change the level
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    atexit.register(listener.stop)  # Write out anything still in the queue
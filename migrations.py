@@ -0,0 +1,557 @@
+import logging
+import sqlite3
+from passwords import hash_password, is_hashed
+from summary_counts import rebuild_summary_counts
+
+logger = logging.getLogger(__name__)
+
+# Tools in a category without a loan_periods row are due back after this many hours
+DEFAULT_LOAN_HOURS = 72
+
+# Database schema changes, in order
+# PRAGMA user_version in the database file remembers the last one applied, so
+# each migration runs exactly once per database. Add new ones at the END -
+# never change or reorder one that has already shipped.
+
+def add_tool_version(conn):
+    # Row version for the conditional checkout/return UPDATEs
+    if 'version' not in table_columns(conn, 'tools'):
+        conn.execute('ALTER TABLE tools ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+def add_change_tracking(conn):
+    # One row counting every change to the tools table
+    # Each changed tool gets stamped with the new count, so a process can ask
+    # "what changed since number N?" instead of reloading every tool
+    if 'change_seq' not in table_columns(conn, 'tools'):
+        conn.execute('ALTER TABLE tools ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),  -- Only ever one row
+            change_seq INTEGER NOT NULL              -- Goes up by one for every tool change
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO catalog_state (id, change_seq) VALUES (1, 0)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tools_change_seq ON tools(change_seq)')
+    # Triggers do the stamping so every writer (any process) is tracked
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tools_track_insert AFTER INSERT ON tools
+        BEGIN
+            UPDATE catalog_state SET change_seq = change_seq + 1 WHERE id = 1;
+            UPDATE tools SET change_seq = (SELECT change_seq FROM catalog_state WHERE id = 1)
+            WHERE tool_id = NEW.tool_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tools_track_update
+        AFTER UPDATE OF tool_name, barcode, category, status, condition_status, checked_out_to, version ON tools
+        BEGIN
+            UPDATE catalog_state SET change_seq = change_seq + 1 WHERE id = 1;
+            UPDATE tools SET change_seq = (SELECT change_seq FROM catalog_state WHERE id = 1)
+            WHERE tool_id = NEW.tool_id;
+        END
+    ''')
+
+def add_lookup_indexes(conn):
+    # Indexes for the columns the return lookup, "my tools" and reports filter on
+    # Return lookup - only open checkouts are ever searched, so the index
+    # leaves out returned rows and stays small as history grows
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_open
+        ON transactions(tool_id, employee_id) WHERE return_date IS NULL
+    ''')
+    # Employee's history, newest first (checkout report filtered by employee)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_employee ON transactions(employee_id, transaction_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_tool ON transactions(tool_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_checkout_date ON transactions(checkout_date)')
+    # Status counts and the status-filtered tool report (already in tool_id order)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tools_status ON tools(status, tool_id)')
+    # "My tools" - what is checked out to one employee
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tools_checked_out_to ON tools(checked_out_to)')
+
+def hash_existing_passwords(conn):
+    # Replace plain text passwords with salted PBKDF2 hashes
+    rows = conn.execute('SELECT employee_id, password FROM employees').fetchall()
+    plain = [(employee_id, password) for employee_id, password in rows if not is_hashed(password)]
+    for employee_id, password in plain:
+        conn.execute('UPDATE employees SET password = ? WHERE employee_id = ?',
+                     (hash_password(password), employee_id))
+    logger.info("Hashed %d plain text passwords", len(plain))
+
+def add_catalog_changed_at(conn):
+    # Remember WHEN the catalog last changed too (for Last-Modified on the API)
+    # Unix time in seconds, set by the same triggers that bump change_seq
+    if 'changed_at' not in table_columns(conn, 'catalog_state'):
+        conn.execute('ALTER TABLE catalog_state ADD COLUMN changed_at INTEGER NOT NULL DEFAULT 0')
+    conn.execute("UPDATE catalog_state SET changed_at = CAST(strftime('%s', 'now') AS INTEGER)")
+    conn.execute('DROP TRIGGER IF EXISTS tools_track_insert')
+    conn.execute('DROP TRIGGER IF EXISTS tools_track_update')
+    conn.execute('''
+        CREATE TRIGGER tools_track_insert AFTER INSERT ON tools
+        BEGIN
+            UPDATE catalog_state SET change_seq = change_seq + 1,
+                changed_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1;
+            UPDATE tools SET change_seq = (SELECT change_seq FROM catalog_state WHERE id = 1)
+            WHERE tool_id = NEW.tool_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tools_track_update
+        AFTER UPDATE OF tool_name, barcode, category, status, condition_status, checked_out_to, version ON tools
+        BEGIN
+            UPDATE catalog_state SET change_seq = change_seq + 1,
+                changed_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1;
+            UPDATE tools SET change_seq = (SELECT change_seq FROM catalog_state WHERE id = 1)
+            WHERE tool_id = NEW.tool_id;
+        END
+    ''')
+
+def add_stock_tables(conn):
+    # Counts for pooled tools and consumables (see inventory.py)
+    # The CHECKs are a last line of defence - inventory.py's UPDATEs already
+    # refuse to take more than there is
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock (
+            item_id TEXT PRIMARY KEY,                 -- Tool ID of the pooled item
+            quantity INTEGER NOT NULL DEFAULT 0,      -- How many we own
+            available INTEGER NOT NULL DEFAULT 0 CHECK (available >= 0),      -- On the shelf
+            checked_out INTEGER NOT NULL DEFAULT 0 CHECK (checked_out >= 0),  -- Out with employees
+            held INTEGER NOT NULL DEFAULT 0 CHECK (held >= 0),                -- Reserved, not picked up yet
+            version INTEGER NOT NULL DEFAULT 0        -- Goes up on every change
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            reservation_id TEXT PRIMARY KEY,
+            item_id TEXT NOT NULL,
+            employee_id TEXT,
+            quantity INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL               -- Unix time - goes back to available after this
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_reservations_expiry ON stock_reservations(expires_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_reservations_item ON stock_reservations(item_id, expires_at)')
+
+def add_tool_bookings(conn):
+    # Tools booked for a future time window (scheduled maintenance jobs - see booking_schedule.py)
+    # Times are Unix seconds; a booking covers starts_at up to (not including) ends_at
+    # Cancelled bookings are kept and marked, so other processes see the cancel
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_bookings (
+            booking_id TEXT PRIMARY KEY,
+            tool_id TEXT NOT NULL,
+            employee_id TEXT,
+            starts_at INTEGER NOT NULL,
+            ends_at INTEGER NOT NULL CHECK (ends_at > starts_at),
+            purpose TEXT,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            change_seq INTEGER NOT NULL DEFAULT 0    -- Like tools.change_seq, for refresh
+        )
+    ''')
+    # Same change counting as the tools table (add_change_tracking), kept separately
+    # so booking changes don't make every tool page think the catalog changed
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS booking_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            change_seq INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO booking_state (id, change_seq) VALUES (1, 0)')
+    # Clash check: this tool's bookings that end after the new one starts
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tool_bookings_tool ON tool_bookings(tool_id, ends_at) WHERE cancelled = 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tool_bookings_change_seq ON tool_bookings(change_seq)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tool_bookings_ends ON tool_bookings(ends_at) WHERE cancelled = 0')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tool_bookings_track_insert AFTER INSERT ON tool_bookings
+        BEGIN
+            UPDATE booking_state SET change_seq = change_seq + 1 WHERE id = 1;
+            UPDATE tool_bookings SET change_seq = (SELECT change_seq FROM booking_state WHERE id = 1)
+            WHERE booking_id = NEW.booking_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tool_bookings_track_update
+        AFTER UPDATE OF tool_id, starts_at, ends_at, cancelled ON tool_bookings
+        BEGIN
+            UPDATE booking_state SET change_seq = change_seq + 1 WHERE id = 1;
+            UPDATE tool_bookings SET change_seq = (SELECT change_seq FROM booking_state WHERE id = 1)
+            WHERE booking_id = NEW.booking_id;
+        END
+    ''')
+
+def add_import_progress(conn):
+    # One row per CSV file loaded with catalog_import.py
+    # rows_done is saved in the same transaction as each chunk of rows, so an
+    # import that fails part way carries on from the first row that didn't make it in
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_progress (
+            source TEXT NOT NULL,                 -- Full path of the CSV file
+            kind TEXT NOT NULL,                   -- "tools" or "employees"
+            fingerprint TEXT NOT NULL,            -- File size and modified time (changed file = new import)
+            status TEXT NOT NULL,                 -- "loading" or "done"
+            rows_done INTEGER NOT NULL DEFAULT 0, -- Data rows handled so far (loaded or rejected)
+            rows_loaded INTEGER NOT NULL DEFAULT 0,
+            rows_rejected INTEGER NOT NULL DEFAULT 0,
+            deferred_indexes TEXT,                -- JSON [[name, sql]] of indexes to build again at the end
+            started_at INTEGER,
+            updated_at INTEGER,
+            PRIMARY KEY (source, kind)
+        )
+    ''')
+
+def add_due_dates(conn):
+    # How long each category of tool can be out, and when each checkout is due back
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS loan_periods (
+            category TEXT PRIMARY KEY,
+            loan_hours INTEGER NOT NULL CHECK (loan_hours > 0)
+        )
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO loan_periods (category, loan_hours) VALUES (?, ?)',
+                     [('Hand Tools', 72), ('Power Tools', 24)])
+    columns = table_columns(conn, 'transactions')
+    if 'due_date' not in columns:
+        # Unix time - the overdue scheduler compares it with time.time()
+        conn.execute('ALTER TABLE transactions ADD COLUMN due_date INTEGER')
+    if 'overdue_notified_at' not in columns:
+        # Set once an overdue alert went out, so a checkout only alerts once
+        conn.execute('ALTER TABLE transactions ADD COLUMN overdue_notified_at INTEGER')
+    # Tools already out get a due date counted from when they were checked out
+    # (checkout_date is local time text, 'utc' turns it into real Unix time)
+    conn.execute('''
+        UPDATE transactions SET due_date = CAST(strftime('%s', checkout_date, 'utc') AS INTEGER) + 3600 *
+            COALESCE((SELECT loan_hours FROM loan_periods JOIN tools ON tools.category = loan_periods.category
+                      WHERE tools.tool_id = transactions.tool_id), ?)
+        WHERE return_date IS NULL AND due_date IS NULL AND checkout_date IS NOT NULL
+    ''', (DEFAULT_LOAN_HOURS,))
+
+# Old date text -> Unix seconds. The text was written in local time, which the
+# 'utc' modifier turns into real Unix time; rows that are already numbers are kept
+TEXT_TO_UNIX = """CASE WHEN typeof({column}) = 'integer' THEN {column}
+    WHEN {column} IS NULL OR {column} = '' THEN NULL
+    ELSE CAST(strftime('%s', {column}, 'utc') AS INTEGER) END"""
+
+def rebuild_table(conn, table, create_sql, columns, converted):
+    # SQLite can't change the type of a column, so: make the new table, copy the
+    # rows across (converting the columns in `converted`), drop the old one and
+    # rename. Indexes and triggers on the old table get made again from their saved SQL
+    if all(column_type(conn, table, column) == 'INTEGER' for column in converted):
+        return  # Already done (new database from database_setup.py)
+    extras = conn.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''', (table,)).fetchall()
+    existing = table_columns(conn, table)
+    copied = [column for column in columns if column in existing]
+    expressions = [TEXT_TO_UNIX.format(column=column) if column in converted else column
+                   for column in copied]
+    conn.execute(create_sql.format(table=f'{table}_new'))
+    conn.execute(f'''
+        INSERT INTO {table}_new ({', '.join(copied)})
+        SELECT {', '.join(expressions)} FROM {table}
+    ''')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    for (sql,) in extras:
+        conn.execute(sql)
+
+def store_dates_as_unix_time(conn):
+    # checkout_date, return_date and created_date were text like
+    # '2025-01-31 14:05:00' - store them as Unix seconds (see timestamps.py)
+    rebuild_table(conn, 'transactions', '''
+        CREATE TABLE {table} (
+            transaction_id TEXT PRIMARY KEY,
+            employee_id TEXT NOT NULL,
+            tool_id TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            checkout_date INTEGER,            -- Unix time
+            return_date INTEGER,              -- Unix time (NULL if still out)
+            condition_on_return TEXT,
+            notes TEXT,
+            due_date INTEGER,
+            overdue_notified_at INTEGER
+        )
+    ''', ['transaction_id', 'employee_id', 'tool_id', 'transaction_type', 'checkout_date',
+          'return_date', 'condition_on_return', 'notes', 'due_date', 'overdue_notified_at'],
+        ['checkout_date', 'return_date'])
+    rebuild_table(conn, 'tools', '''
+        CREATE TABLE {table} (
+            tool_id TEXT PRIMARY KEY,
+            barcode TEXT UNIQUE NOT NULL,
+            tool_name TEXT NOT NULL,
+            category TEXT,
+            status TEXT DEFAULT 'available',
+            condition_status TEXT DEFAULT 'good',
+            checked_out_to TEXT,
+            created_date INTEGER,             -- Unix time
+            version INTEGER NOT NULL DEFAULT 0,
+            change_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''', ['tool_id', 'barcode', 'tool_name', 'category', 'status', 'condition_status',
+          'checked_out_to', 'created_date', 'version', 'change_seq'], ['created_date'])
+    rebuild_table(conn, 'employees', '''
+        CREATE TABLE {table} (
+            employee_id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            name TEXT NOT NULL,
+            skill_level TEXT,
+            department TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_date INTEGER              -- Unix time
+        )
+    ''', ['employee_id', 'username', 'password', 'name', 'skill_level', 'department',
+          'is_active', 'created_date'], ['created_date'])
+
+def add_utilization_indexes(conn):
+    # Utilization reports (analytics.py) find the checkouts in a date window by
+    # checkout date and by return date. Both indexes carry every column the
+    # report reads, so it never has to look up the rows in transactions
+    # (the checkout report's counts and average time out get the same benefit)
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_checkout_date')
+    conn.execute('''
+        CREATE INDEX idx_transactions_checkout_date
+        ON transactions(checkout_date, return_date, tool_id, condition_on_return)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_return_date
+        ON transactions(return_date, checkout_date, tool_id, condition_on_return)
+    ''')
+
+def add_summary_counts(conn):
+    # Running totals for the dashboard: tools per (category, status) and open
+    # checkouts per employee. Triggers keep them right for every writer (any
+    # process) in the same transaction as the change itself.
+    # summary_counts.py checks them against a full count now and then
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_counts (
+            category TEXT NOT NULL,                -- '' for tools without one
+            status TEXT NOT NULL,
+            tools INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, status)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employee_checkouts (
+            employee_id TEXT PRIMARY KEY,
+            open_checkouts INTEGER NOT NULL DEFAULT 0  -- Tools they have out right now
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tool_counts_insert AFTER INSERT ON tools
+        BEGIN
+            INSERT INTO tool_counts (category, status, tools)
+            VALUES (IFNULL(NEW.category, ''), IFNULL(NEW.status, ''), 1)
+            ON CONFLICT (category, status) DO UPDATE SET tools = tools + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tool_counts_update AFTER UPDATE OF category, status ON tools
+        WHEN OLD.category IS NOT NEW.category OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE tool_counts SET tools = tools - 1
+            WHERE category = IFNULL(OLD.category, '') AND status = IFNULL(OLD.status, '');
+            INSERT INTO tool_counts (category, status, tools)
+            VALUES (IFNULL(NEW.category, ''), IFNULL(NEW.status, ''), 1)
+            ON CONFLICT (category, status) DO UPDATE SET tools = tools + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tool_counts_delete AFTER DELETE ON tools
+        BEGIN
+            UPDATE tool_counts SET tools = tools - 1
+            WHERE category = IFNULL(OLD.category, '') AND status = IFNULL(OLD.status, '');
+        END
+    ''')
+    # A checkout is open while return_date is NULL
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS employee_checkouts_insert AFTER INSERT ON transactions
+        WHEN NEW.return_date IS NULL
+        BEGIN
+            INSERT INTO employee_checkouts (employee_id, open_checkouts) VALUES (NEW.employee_id, 1)
+            ON CONFLICT (employee_id) DO UPDATE SET open_checkouts = open_checkouts + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS employee_checkouts_update AFTER UPDATE OF return_date, employee_id ON transactions
+        WHEN (OLD.return_date IS NULL) != (NEW.return_date IS NULL) OR OLD.employee_id IS NOT NEW.employee_id
+        BEGIN
+            UPDATE employee_checkouts SET open_checkouts = open_checkouts - 1
+            WHERE employee_id = OLD.employee_id AND OLD.return_date IS NULL;
+            INSERT INTO employee_checkouts (employee_id, open_checkouts)
+            SELECT NEW.employee_id, 1 WHERE NEW.return_date IS NULL
+            ON CONFLICT (employee_id) DO UPDATE SET open_checkouts = open_checkouts + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS employee_checkouts_delete AFTER DELETE ON transactions
+        WHEN OLD.return_date IS NULL
+        BEGIN
+            UPDATE employee_checkouts SET open_checkouts = open_checkouts - 1
+            WHERE employee_id = OLD.employee_id;
+        END
+    ''')
+    # Start from a full count of what's there now
+    rebuild_summary_counts(conn)
+
+def add_worker_leases(conn):
+    # Which ID generator worker numbers (id_generator.py) are taken, so two
+    # processes without ECS_WORKER_ID never make IDs with the same number
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS worker_leases (
+            worker_id INTEGER PRIMARY KEY,  -- 0-1023
+            owner TEXT NOT NULL,            -- "<pid>:<random>" of the process holding it
+            expires_at INTEGER NOT NULL     -- Unix time - free to take again after this
+        )
+    ''')
+
+def add_tool_category_index(conn):
+    # Category-filtered /api/tools pages, already in tool_id order
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tools_category ON tools(category, tool_id)')
+
+def add_tool_date_index(conn):
+    # Utilization reports (analytics.STARTED_TOTALS) add up each tool's checkouts
+    # in a date window. With the dates and condition in the tool index that's one
+    # range of it per tool, and nothing is looked up in transactions
+    # (tool history lookups still use it the same way)
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_tool')
+    conn.execute('''
+        CREATE INDEX idx_transactions_tool
+        ON transactions(tool_id, checkout_date, return_date, condition_on_return)
+    ''')
+
+MIGRATIONS = [
+    (1, "Add tools.version", add_tool_version),
+    (2, "Track tool changes with catalog_state/change_seq", add_change_tracking),
+    (3, "Add lookup indexes for transactions and tools", add_lookup_indexes),
+    (4, "Hash plain text passwords", hash_existing_passwords),
+    (5, "Record when the catalog last changed", add_catalog_changed_at),
+    (6, "Add stock and stock_reservations tables", add_stock_tables),
+    (7, "Add tool_bookings for future time windows", add_tool_bookings),
+    (8, "Add import_progress for resumable catalog imports", add_import_progress),
+    (9, "Add loan_periods and transaction due dates", add_due_dates),
+    (10, "Store dates as Unix time instead of text", store_dates_as_unix_time),
+    (11, "Add covering date indexes for utilization reports", add_utilization_indexes),
+    (12, "Add tool_counts and employee_checkouts summary tables", add_summary_counts),
+    (13, "Add worker_leases for ID generator worker numbers", add_worker_leases),
+    (14, "Add a category index for tool pages", add_tool_category_index),
+    (15, "Add dates to the tool index for utilization reports", add_tool_date_index),
+]
+
+# Queries the app runs all the time, and the index each one should use
+# check_query_plans() runs EXPLAIN QUERY PLAN on these so we notice if one
+# falls back to scanning the whole table
+HOT_QUERIES = [
+    ("return lookup",
+     "SELECT transaction_id FROM transactions WHERE tool_id = ? AND employee_id = ? AND return_date IS NULL",
+     ('TOOL001', 'EMP001'), 'idx_transactions_open'),
+    ("employee history",
+     "SELECT transaction_id FROM transactions WHERE employee_id = ? ORDER BY transaction_id DESC LIMIT 100",
+     ('EMP001',), 'idx_transactions_employee'),
+    ("tool history",
+     "SELECT transaction_id FROM transactions WHERE tool_id = ?",
+     ('TOOL001',), 'idx_transactions_tool'),
+    ("checkout date range",
+     "SELECT COUNT(*) FROM transactions WHERE checkout_date >= ? AND checkout_date < ?",
+     (1735689600, 1738368000), 'idx_transactions_checkout_date'),
+    ("utilization - returned during window",
+     "SELECT tool_id FROM transactions WHERE return_date > ? AND checkout_date < ?",
+     (1735689600, 1735689600), 'idx_transactions_return_date'),
+    ("utilization - still out",
+     "SELECT tool_id FROM transactions WHERE return_date IS NULL AND checkout_date < ?",
+     (1735689600,), 'idx_transactions_return_date'),
+    ("utilization - one tool's checkouts",
+     "SELECT COUNT(*) FROM transactions WHERE tool_id = ? AND checkout_date >= ? AND checkout_date < ?",
+     ('TOOL001', 1735689600, 1738368000), 'idx_transactions_tool'),
+    ("tools by status",
+     "SELECT tool_id FROM tools WHERE tool_id > ? AND status = ? ORDER BY tool_id LIMIT 100",
+     ('', 'available'), 'idx_tools_status'),
+    ("tools by category",
+     "SELECT tool_id FROM tools WHERE tool_id > ? AND category = ? ORDER BY tool_id LIMIT 100",
+     ('', 'Hand Tools'), 'idx_tools_category'),
+    ("status counts for a category",
+     "SELECT status, tools FROM tool_counts WHERE category = ?",
+     ('Hand Tools',), 'sqlite_autoindex_tool_counts_1'),
+    ("open checkouts for an employee",
+     "SELECT open_checkouts FROM employee_checkouts WHERE employee_id = ?",
+     ('EMP001',), 'sqlite_autoindex_employee_checkouts_1'),
+    ("open checkouts recount",
+     "SELECT employee_id, COUNT(*) FROM transactions WHERE return_date IS NULL GROUP BY employee_id",
+     (), 'idx_transactions_return_date'),
+    ("my tools",
+     "SELECT tool_id FROM tools WHERE checked_out_to = ?",
+     ('EMP001',), 'idx_tools_checked_out_to'),
+    ("changed tools",
+     "SELECT tool_id FROM tools WHERE change_seq > ? ORDER BY change_seq",
+     (0,), 'idx_tools_change_seq'),
+    ("next reservation expiry",
+     "SELECT MIN(expires_at) FROM stock_reservations WHERE item_id = ?",
+     ('TOOL001',), 'idx_stock_reservations_item'),
+    ("expired reservations",
+     "SELECT reservation_id FROM stock_reservations WHERE expires_at <= ?",
+     (0,), 'idx_stock_reservations_expiry'),
+    ("booking clash check",
+     "SELECT booking_id FROM tool_bookings WHERE tool_id = ? AND cancelled = 0 AND ends_at > ? AND starts_at < ? LIMIT 1",
+     ('TOOL001', 0, 1), 'idx_tool_bookings_tool'),
+    ("changed bookings",
+     "SELECT booking_id FROM tool_bookings WHERE change_seq > ? ORDER BY change_seq",
+     (0,), 'idx_tool_bookings_change_seq'),
+    ("upcoming bookings",
+     "SELECT booking_id FROM tool_bookings WHERE cancelled = 0 AND ends_at > ?",
+     (0,), 'idx_tool_bookings_ends'),
+]
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def column_type(conn, table, column):
+    for row in conn.execute(f'PRAGMA table_info({table})'):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn):
+    # Apply any migrations this database hasn't had yet
+    # Each one runs in its own transaction together with the version bump, so a
+    # failure leaves the database at the previous version
+    if not table_columns(conn, 'tools'):
+        logger.warning("No tools table - run database_setup.py first")
+        return get_schema_version(conn)
+
+    for version, description, migrate in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')  # Lock out other processes migrating at the same time
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()  # Another process got here first
+                continue
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        logger.info("Applied migration %d: %s", version, description)
+    return get_schema_version(conn)
+
+def check_query_plans(conn):
+    # Returns [(name, plan text, uses expected index?)] for every hot query
+    results = []
+    for name, sql, params, index_name in HOT_QUERIES:
+        plan = " / ".join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+        results.append((name, plan, index_name in plan))
+    return results
+
+# Run with: python migrations.py  (migrates equipment_checkout.db and checks the query plans)
+if __name__ == "__main__":
+    conn = sqlite3.connect('equipment_checkout.db')
+    print(f"Schema version: {run_migrations(conn)}")
+    all_ok = True
+    for name, plan, ok in check_query_plans(conn):
+        print(f"{'OK  ' if ok else 'SCAN'} {name}: {plan}")
+        all_ok = all_ok and ok
+    conn.close()
+    raise SystemExit(0 if all_ok else 1)
@@ -0,0 +1,184 @@
+import atexit
+import heapq      # Min-heap of open checkouts by due date
+import json
+import logging
+import os
+import sys
+import threading  # Alerts are sent from their own thread
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from timestamps import format_time
+
+logger = logging.getLogger(__name__)
+
+# POST every overdue alert here as JSON (leave unset for log messages only)
+# For trying it out locally: python overdue_scheduler.py 8099  and set
+# ECS_OVERDUE_WEBHOOK=http://127.0.0.1:8099/
+WEBHOOK_URL = os.environ.get('ECS_OVERDUE_WEBHOOK', '')
+WEBHOOK_TIMEOUT = 5       # Seconds before giving up on the webhook
+RETRY_SECONDS = 60        # Try again this much later if the database was busy
+# Rebuild the heap when returned checkouts make up most of it (see cancel())
+COMPACT_MIN_SIZE = 1024
+
+class OverdueScheduler:
+    # Sends an alert when a checked out tool passes its due date
+    # Open checkouts wait in a min-heap ordered by due date, so the thread only
+    # ever looks at the top: O(log n) for each checkout added and each alert
+    # sent, and it sleeps until the next due date instead of sweeping every
+    # transaction every few minutes.
+    # A return doesn't dig its checkout out of the heap - it's dropped from
+    # `pending`, and the leftover heap entry is skipped when it gets to the top
+    def __init__(self, writer, webhook_url=WEBHOOK_URL):
+        self.writer = writer            # Marks alerts as sent (CheckoutSystem's DatabaseWriter)
+        self.webhook_url = webhook_url
+        self.heap = []                  # (due_date, transaction_id), earliest first
+        self.pending = {}               # transaction_id -> Transaction still waiting for its due date
+        self.listeners = []             # Called with each overdue event, on the scheduler thread
+        self.stats = {'alerts': 0, 'skipped': 0}
+        self.running = True
+        self.condition = threading.Condition()  # Protects everything above
+
+        self.thread = threading.Thread(target=self.run, name="OverdueScheduler", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def add(self, transaction):
+        # Start watching an open checkout (no due date = never overdue)
+        if not transaction.due_date:
+            return
+        with self.condition:
+            self.pending[transaction.transaction_id] = transaction
+            heapq.heappush(self.heap, (transaction.due_date, transaction.transaction_id))
+            if self.heap[0][1] == transaction.transaction_id:
+                self.condition.notify()  # New earliest due date - wake up sooner
+
+    def cancel(self, transaction_id):
+        # The tool came back - no alert for this one
+        with self.condition:
+            if self.pending.pop(transaction_id, None) is None:
+                return
+            # Lots of returned checkouts still in the heap - rebuild it from what's left
+            if len(self.heap) > COMPACT_MIN_SIZE and len(self.heap) > 2 * len(self.pending):
+                self.heap = [(transaction.due_date, transaction_id)
+                             for transaction_id, transaction in self.pending.items()]
+                heapq.heapify(self.heap)
+
+    def add_listener(self, callback):
+        # callback(event) gets every overdue event (event is a dict - see overdue_event)
+        self.listeners.append(callback)
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, waiting=len(self.pending), heap_size=len(self.heap))
+
+    def close(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                due = self.wait_for_due()
+                if due is None:
+                    break  # Shutting down
+            self.send_alerts(due)
+
+    def wait_for_due(self):
+        # Sleep until the earliest checkout is due, then take every one that is
+        # Caller holds self.condition. Returns None when shutting down
+        while self.running:
+            # Returned checkouts at the top are just thrown away
+            while self.heap and self.heap[0][1] not in self.pending:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                self.condition.wait()
+                continue
+            wait_time = self.heap[0][0] - time.time()
+            if wait_time > 0:
+                self.condition.wait(wait_time)
+                continue
+            due = []
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                due_date, transaction_id = heapq.heappop(self.heap)
+                transaction = self.pending.pop(transaction_id, None)
+                if transaction is not None:
+                    due.append(transaction)
+            if due:
+                return due
+        return None
+
+    def send_alerts(self, transactions):
+        # Mark them in the database first - with several worker processes each
+        # one has the checkout in its heap, and only the one whose UPDATE
+        # matches sends the alert (the others see overdue_notified_at already set)
+        now = int(time.time())
+
+        def mark_notified(conn):
+            return [conn.execute('''
+                UPDATE transactions SET overdue_notified_at = ?
+                WHERE transaction_id = ? AND return_date IS NULL AND overdue_notified_at IS NULL
+            ''', (now, transaction.transaction_id)).rowcount == 1 for transaction in transactions]
+
+        try:
+            claimed = self.writer.run_now(mark_notified)
+        except Exception as error:
+            logger.error("Could not record overdue alerts, trying again in %ds: %s", RETRY_SECONDS, error)
+            with self.condition:
+                for transaction in transactions:
+                    self.pending[transaction.transaction_id] = transaction
+                    heapq.heappush(self.heap, (now + RETRY_SECONDS, transaction.transaction_id))
+            return
+
+        for transaction, mine in zip(transactions, claimed):
+            if not mine:
+                self.stats['skipped'] += 1  # Returned already, or another worker sent it
+                continue
+            self.stats['alerts'] += 1
+            event = overdue_event(transaction, now)
+            logger.warning("Overdue: %s checked out to %s was due back %s",
+                           event['tool_id'], event['employee_id'], format_time(event['due_date']))
+            for callback in self.listeners:
+                try:
+                    callback(event)
+                except Exception as error:
+                    logger.error("Overdue listener failed: %s", error)
+            if self.webhook_url:
+                post_webhook(self.webhook_url, event)
+
+def overdue_event(transaction, now):
+    return {'type': 'overdue', 'transaction_id': transaction.transaction_id,
+            'tool_id': transaction.tool_id, 'employee_id': transaction.employee_id,
+            'due_date': transaction.due_date, 'overdue_seconds': now - transaction.due_date}
+
+def post_webhook(url, event):
+    request = urllib.request.Request(url, data=json.dumps(event).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+            pass
+    except (urllib.error.URLError, OSError) as error:
+        logger.warning("Overdue webhook %s failed: %s", url, error)
+
+class StandInReceiver(BaseHTTPRequestHandler):
+    # Stand-in for the real alerting service - prints whatever gets posted
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        print(body.decode('utf-8', 'replace'), flush=True)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # Just the alerts, not a line per request
+
+# Run with: python overdue_scheduler.py [port]  (prints the overdue alerts it receives)
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+    print(f"Waiting for overdue alerts on http://127.0.0.1:{port}/")
+    HTTPServer(('127.0.0.1', port), StandInReceiver).serve_forever()
\ No newline at end of file
@@ -0,0 +1,119 @@
+import base64
+import hashlib     # pbkdf2_hmac - slow on purpose so stolen hashes are hard to crack
+import hmac        # compare_digest - comparison that doesn't leak timing
+import logging
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Stored format: pbkdf2_sha256$<iterations>$<salt>$<hash>
+# The iterations are saved with each hash, so raising the cost later still
+# lets old passwords work (they get re-hashed on the next login)
+ALGORITHM = "pbkdf2_sha256"
+# Cost setting - about 0.08s per login per core at 200,000
+# Raise it with ECS_PASSWORD_ITERATIONS as hardware gets faster
+ITERATIONS = int(os.environ.get('ECS_PASSWORD_ITERATIONS', '200000'))
+SALT_BYTES = 16
+
+class LoginBusyError(Exception):
+    # Too many logins waiting to be checked - the caller should ask the user to retry
+    pass
+
+def hash_password(password, iterations=None):
+    iterations = iterations or ITERATIONS
+    salt = secrets.token_bytes(SALT_BYTES)  # New random salt for every password
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{ALGORITHM}${iterations}${b64(salt)}${b64(digest)}"
+
+def is_hashed(stored):
+    return stored.startswith(ALGORITHM + "$")
+
+def needs_rehash(stored):
+    # Plain text, or hashed with a lower cost than we use now
+    if not is_hashed(stored):
+        return True
+    return int(stored.split("$")[1]) < ITERATIONS
+
+def verify_password(password, stored):
+    # True if password matches the stored hash
+    if not is_hashed(stored):
+        # Left over from before hashing (migrations hash these) - still compare safely
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        algorithm, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                     base64.b64decode(salt), int(iterations))
+    except ValueError:
+        logger.error("Stored password hash is not in a format we understand")
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+def b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+class PasswordVerifier:
+    # Runs password hashing on a small fixed set of threads
+    # A burst of logins queues up here instead of using every CPU core,
+    # so checkout requests keep getting served
+    def __init__(self, max_workers=None, max_pending=None, cache_size=1024):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        # More than this many logins waiting -> LoginBusyError instead of an ever longer queue
+        self.max_pending = max_pending or self.max_workers * 8
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="PasswordVerifier")
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        # Recently verified logins, so a scanner logging in again and again only
+        # pays for the slow hash once. Keys are an HMAC of the password with a
+        # random key that only lives in this process - never the password itself
+        self.cache_key = secrets.token_bytes(32)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+
+    def cache_entry(self, password, stored):
+        return hmac.new(self.cache_key, (stored + "\0" + password).encode('utf-8'), 'sha256').digest()
+
+    def verify(self, password, stored):
+        key = self.cache_entry(password, stored)
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return True
+        if not self.slots.acquire(blocking=False):
+            raise LoginBusyError("Too many logins in progress")
+        try:
+            matches = self.executor.submit(verify_password, password, stored).result()
+        finally:
+            self.slots.release()
+        if matches:
+            with self.cache_lock:
+                self.cache[key] = True
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)  # Forget the oldest
+        return matches
+
+    def rehash(self, password, save):
+        # Upgrade an old hash without holding up the login: the new hash is made
+        # on the worker threads and save(new_hash) is called from there
+        # Counts against max_pending like a login; when that's full it's skipped
+        # (returns False) and tried again next time they log in
+        if not self.slots.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                save(hash_password(password))
+            except Exception as error:
+                logger.error("Could not upgrade a password hash: %s", error)
+            finally:
+                self.slots.release()
+
+        self.executor.submit(run)
+        return True
+
+# A made-up hash to check against when the username doesn't exist, so a wrong
+# username takes as long as a wrong password (doesn't reveal which usernames exist)
+DUMMY_HASH = hash_password(secrets.token_hex(16))
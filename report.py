@@ -1,17 +1,31 @@
+import csv
+import io
+import json
 from datetime import datetime  # Need this for timestamps on reports
+from database_pool import get_pool      # Reports read straight from the database
+from id_generator import report_ids  # Unique report IDs
+from timestamps import day_end, day_start, format_time  # Dates are stored as Unix seconds
+
+# Columns written by export_data, in file order
+EXPORT_COLUMNS = ['transaction_id', 'employee_id', 'tool_id', 'transaction_type',
+                  'checkout_date', 'return_date', 'condition_on_return', 'notes']
+EXPORT_TIME_COLUMNS = (4, 5)  # Written as text (people open exports in a spreadsheet)
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}  # format -> content type
+EXPORT_CHUNK_SIZE = 1000  # Rows read from the database at a time
 
 class Report:
-    def __init__(self):
+    def __init__(self, db_name='equipment_checkout.db'):
+        self.pool = get_pool(db_name)  # Shared database connections
         # Basic report properties
         self.report_id = ""         # Unique ID for each report
         self.report_type = ""       # What kind of report (checkout, tools, etc.)
         self.date_generated = ""    # When was this report created
         self.report_data = []       # Could store report data here if needed later
     
-    def generate_checkout_report(self, transactions):
-        # Generate report showing all checkout transactions
-        # Takes list of transactions as input
-        self.report_id = f"RPT{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    def generate_checkout_report(self, start_date=None, end_date=None, employee_id=None):
+        # Generate report showing checkout transactions
+        # Counting and filtering happen in the database, rows are read a page at a time
+        self.report_id = report_ids.next_id()
         self.report_type = "Checkout Report"
         self.date_generated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
@@ -20,33 +34,29 @@ class Report:
         print(f"Report ID: {self.report_id}")
         print("-" * 50)  # Nice separator line shout out Prof. Rick Bird! 
         
-        if not transactions:
+        counts = self.get_checkout_counts(start_date, end_date, employee_id)
+        if counts['total'] == 0:
             print("No transactions found")
             return
             
-        # Count different types of transactions
-        checkout_count = 0
-        return_count = 0
-        
-        for transaction in transactions:
-            if transaction.type == "checkout":
-                checkout_count += 1
-                # Show status - has it been returned yet?
-                status = "RETURNED" if transaction.return_date else "CHECKED OUT"
-                print(f"Employee: {transaction.employee_id} | Tool: {transaction.tool_id} | Date: {transaction.checkout_date} | Status: {status}")
-            elif transaction.type == "return":
-                return_count += 1
+        for transaction in self.iter_pages(self.get_transactions_page, 'transaction_id', start_date=start_date,
+                                           end_date=end_date, employee_id=employee_id):
+            # Show status - has it been returned yet?
+            status = "RETURNED" if transaction['return_date'] else "CHECKED OUT"
+            print(f"Employee: {transaction['employee_id']} | Tool: {transaction['tool_id']} | Date: {format_time(transaction['checkout_date'])} | Status: {status}")
                 
         # Summary totals at bottom
         print("-" * 50)
-        print(f"Total Checkouts: {checkout_count}")
-        print(f"Total Returns: {return_count}")
-        print(f"Currently Out: {checkout_count - return_count}")  # Still outstanding
+        print(f"Total Checkouts: {counts['total']}")
+        print(f"Total Returns: {counts['returned']}")
+        print(f"Currently Out: {counts['out']}")  # Still outstanding
+        if counts['average_hours_out'] is not None:
+            print(f"Average Time Out: {counts['average_hours_out']:.1f} hours")
         
-    def generate_tool_status_report(self, tools):
+    def generate_tool_status_report(self, status=None):
         # Report showing current status of all tools
         # Useful for management to see what's available
-        self.report_id = f"RPT{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        self.report_id = report_ids.next_id()
         self.report_type = "Tool Status Report"
         self.date_generated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
@@ -55,36 +65,25 @@ class Report:
         print(f"Report ID: {self.report_id}")
         print("-" * 60)
         
-        if not tools:
+        # Count tools by status (GROUP BY in the database)
+        counts = self.get_tool_status_counts()
+        if not counts:
             print("No tools found")
             return
             
-        # Count tools by status
-        available_count = 0
-        checked_out_count = 0
-        maintenance_count = 0
-        
-        for tool in tools:
+        for tool in self.iter_pages(self.get_tools_page, 'tool_id', status=status):
             # Show who has it if it's checked out
-            checked_out_to = f" (to {tool.checked_out_to})" if tool.checked_out_to else ""
-            print(f"ID: {tool.tool_id} | Name: {tool.tool_name} | Status: {tool.status.upper()} | Condition: {tool.condition}{checked_out_to}")
-            
-            # Count by status for summary
-            if tool.status == "available":
-                available_count += 1
-            elif tool.status == "checked_out":
-                checked_out_count += 1
-            elif tool.status == "maintenance":
-                maintenance_count += 1
+            checked_out_to = f" (to {tool['checked_out_to']})" if tool['checked_out_to'] else ""
+            print(f"ID: {tool['tool_id']} | Name: {tool['tool_name']} | Status: {tool['status'].upper()} | Condition: {tool['condition']}{checked_out_to}")
                 
         # Summary totals
         print("-" * 60)
-        print(f"Available: {available_count} | Checked Out: {checked_out_count} | Maintenance: {maintenance_count}")
+        print(f"Available: {counts.get('available', 0)} | Checked Out: {counts.get('checked_out', 0)} | Maintenance: {counts.get('maintenance', 0)}")
         
-    def generate_employee_usage_report(self, transactions, employee_id):
+    def generate_employee_usage_report(self, employee_id):
         # Report for specific employee showing their tool usage
         # Good for tracking who uses what tools
-        self.report_id = f"RPT{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        self.report_id = report_ids.next_id()
         self.report_type = f"Employee Usage Report - {employee_id}"
         self.date_generated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
@@ -93,28 +92,193 @@ class Report:
         print(f"Report ID: {self.report_id}")
         print("-" * 50)
         
-        # Filter transactions for just this employee
-        employee_transactions = [t for t in transactions if t.employee_id == employee_id]
-        
-        if not employee_transactions:
+        # Database only sends back this employee's transactions
+        counts = self.get_checkout_counts(employee_id=employee_id)
+        if counts['total'] == 0:
             print(f"No transactions found for employee {employee_id}")
             return
             
         # Show each transaction for this employee
-        for transaction in employee_transactions:
-            status = "RETURNED" if transaction.return_date else "STILL OUT"
-            print(f"Tool: {transaction.tool_id} | Checkout: {transaction.checkout_date} | Status: {status}")
-            if transaction.notes:
-                print(f"  Notes: {transaction.notes}")  # Indent notes
+        for transaction in self.iter_pages(self.get_transactions_page, 'transaction_id', employee_id=employee_id):
+            status = "RETURNED" if transaction['return_date'] else "STILL OUT"
+            print(f"Tool: {transaction['tool_id']} | Checkout: {format_time(transaction['checkout_date'])} | Status: {status}")
+            if transaction['notes']:
+                print(f"  Notes: {transaction['notes']}")  # Indent notes
                 
         print("-" * 50)
-        print(f"Total transactions: {len(employee_transactions)}")
+        print(f"Total transactions: {counts['total']}")
+
+    def get_tool_status_counts(self, category=None):
+        # {status: number of tools} - from the tool_counts summary table, which
+        # the triggers keep up to date (a few rows, however many tools there are)
+        sql = 'SELECT status, SUM(tools) FROM tool_counts'
+        params = []
+        if category:
+            sql += ' WHERE category = ?'
+            params.append(category)
+        sql += ' GROUP BY status'
+        with self.pool.connection() as conn:
+            return {status: count for status, count in conn.execute(sql, params) if count}
+
+    def get_open_checkout_count(self, employee_id):
+        # How many tools this employee has out right now (employee_checkouts summary table)
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT open_checkouts FROM employee_checkouts WHERE employee_id = ?',
+                               (employee_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_tools_page(self, after="", page_size=100, status=None, category=None):
+        # One page of tools ordered by tool_id (the tool report and /api/tools)
+        # "after" is the last tool_id of the previous page (keyset paging - the
+        # database jumps straight there instead of skipping rows like OFFSET does)
+        sql = '''
+            SELECT tool_id, tool_name, barcode, category, status, condition_status, checked_out_to, version
+            FROM tools WHERE tool_id > ?
+        '''
+        params = [after or ""]
+        if status:
+            sql += ' AND status = ?'       # idx_tools_status
+            params.append(status)
+        if category:
+            sql += ' AND category = ?'     # idx_tools_category
+            params.append(category)
+        sql += ' ORDER BY tool_id LIMIT ?'
+        params.append(page_size)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [{'tool_id': row[0], 'tool_name': row[1], 'barcode': row[2], 'category': row[3],
+                 'status': row[4], 'condition': row[5], 'checked_out_to': row[6] or "", 'version': row[7]}
+                for row in rows]
+
+    def transaction_filters(self, start_date=None, end_date=None, employee_id=None):
+        # WHERE conditions shared by the transaction queries
+        # Dates are 'YYYY-MM-DD' strings; end_date is included (whole day)
+        # They become Unix times here, so the database does a range scan on
+        # idx_transactions_checkout_date. Raises ValueError for a bad date
+        conditions = []
+        params = []
+        try:
+            if start_date:
+                params.append(day_start(start_date))
+                conditions.append('checkout_date >= ?')
+            if end_date:
+                params.append(day_end(end_date))
+                conditions.append('checkout_date < ?')
+        except ValueError:
+            raise ValueError("Dates must look like YYYY-MM-DD") from None
+        if employee_id:
+            conditions.append('employee_id = ?')
+            params.append(employee_id)
+        return conditions, params
+
+    def get_checkout_counts(self, start_date=None, end_date=None, employee_id=None):
+        # Totals for the checkout report in one query
+        # Dates are numbers, so how long tools were out is worked out by the database too
+        conditions, params = self.transaction_filters(start_date, end_date, employee_id)
+        sql = 'SELECT COUNT(*), COUNT(return_date), AVG(return_date - checkout_date) FROM transactions'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with self.pool.connection() as conn:
+            total, returned, average_seconds = conn.execute(sql, params).fetchone()
+        return {'total': total, 'returned': returned, 'out': total - returned,
+                'average_hours_out': average_seconds / 3600 if average_seconds is not None else None}
+
+    def get_transactions_page(self, after="", page_size=100, start_date=None, end_date=None, employee_id=None):
+        # One page of transactions, newest first
+        # "after" is the last transaction_id of the previous page (IDs are time ordered)
+        conditions, params = self.transaction_filters(start_date, end_date, employee_id)
+        if after:
+            conditions.append('transaction_id < ?')
+            params.append(after)
+        sql = '''
+            SELECT transaction_id, employee_id, tool_id, transaction_type,
+                   checkout_date, return_date, condition_on_return, notes
+            FROM transactions
+        '''
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY transaction_id DESC LIMIT ?'
+        params.append(page_size)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [{'transaction_id': row[0], 'employee_id': row[1], 'tool_id': row[2], 'type': row[3],
+                 'checkout_date': row[4] or 0, 'return_date': row[5] or 0,
+                 'condition': row[6] or "", 'notes': row[7] or ""}
+                for row in rows]
+
+    def iter_pages(self, get_page, key, page_size=500, **filters):
+        # Walk through every page of a get_*_page method, one page in memory at a time
+        # key is the column the pages are ordered by (tool_id or transaction_id)
+        after = ""
+        while True:
+            page = get_page(after=after, page_size=page_size, **filters)
+            yield from page
+            if len(page) < page_size:
+                break
+            after = page[-1][key]
         
-    def export_data(self, filename=""):
-        # Export report data to file
-        # TODO: Actually implement file writing later if we have time
+    def export_data(self, filename="", export_format="csv", start_date=None, end_date=None, employee_id=None):
+        # Export checkout history to a file (csv or jsonl)
+        # Rows go straight from the database cursor to the file a chunk at a time,
+        # so memory use is the same for 100 rows or 10 million
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        if not self.report_id:
+            self.report_id = report_ids.next_id()
         if not filename:
-            filename = f"report_{self.report_id}.txt"
-            
-        print(f"Report would be exported to: {filename}")
-        print("(File export not implemented in this basic version)")
\ No newline at end of file
+            filename = f"report_{self.report_id}.{export_format}"
+
+        row_count = 0
+        with open(filename, 'w', newline='', encoding='utf-8') as export_file:
+            for chunk, rows_in_chunk in self.iter_export_chunks(export_format, start_date, end_date, employee_id):
+                export_file.write(chunk)
+                row_count += rows_in_chunk
+        print(f"Exported {row_count} transactions to: {filename}")
+        return row_count
+
+    def iter_transaction_rows(self, start_date=None, end_date=None, employee_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+        # Yields lists of raw transaction rows, chunk_size at a time, oldest first
+        # Uses its own connection (not the pool) since a big export can take a while
+        conditions, params = self.transaction_filters(start_date, end_date, employee_id)
+        sql = f'SELECT {", ".join(EXPORT_COLUMNS)} FROM transactions'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY transaction_id'
+        conn = self.pool.open_connection()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()  # Also runs if the download is cancelled part way
+
+    def iter_export_chunks(self, export_format="csv", start_date=None, end_date=None, employee_id=None):
+        # Yields (text, number_of_rows) pieces of the export file
+        # Used by export_data and by the web server's download route
+        buffer = io.StringIO()
+        if export_format == "csv":
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)  # Header line
+            yield buffer.getvalue(), 0
+        for rows in self.iter_transaction_rows(start_date, end_date, employee_id):
+            rows = [export_row(row) for row in rows]
+            buffer.seek(0)
+            buffer.truncate()
+            if export_format == "csv":
+                writer.writerows(rows)
+            else:
+                # JSON Lines - one JSON object per line
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+                    buffer.write("\n")
+            yield buffer.getvalue(), len(rows)
+
+def export_row(row):
+    # Unix times -> readable text for the export file
+    row = list(row)
+    for index in EXPORT_TIME_COLUMNS:
+        row[index] = format_time(row[index])
+    return row
\ No newline at end of file
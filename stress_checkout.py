@@ -0,0 +1,178 @@
+# Concurrency check for checkout/return
+# Two CheckoutSystem objects stand in for two worker processes (each has its
+# own copy of the tools), and lots of threads scan the same tools at once.
+# Every tool must end up with exactly one winner, and the database, the summary
+# counters and each worker's copy must all agree afterwards.
+# Runs in a scratch copy of the database, so the real one isn't touched.
+# Run with: python stress_checkout.py [tools] [threads per worker]
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from checkout_result import CheckoutResult
+from logging_setup import setup_logging
+
+TOOLS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+EMPLOYEES = 20
+
+failures = []
+
+def check(ok, message):
+    print(f"{'PASS' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+def set_up():
+    # Fresh database with the sample data plus TOOLS more tools and EMPLOYEES more employees
+    import database_setup
+    database_setup.create_database()
+    conn = sqlite3.connect('equipment_checkout.db')
+    conn.executemany('''
+        INSERT INTO tools (tool_id, barcode, tool_name, category) VALUES (?, ?, ?, 'Hand Tools')
+    ''', [(f'STRESS{number:04d}', f'SB{number:06d}', f'Stress Tool {number}') for number in range(TOOLS)])
+    conn.executemany('''
+        INSERT INTO employees (employee_id, username, password, name, is_active) VALUES (?, ?, 'x', ?, 1)
+    ''', [(f'SEMP{number:03d}', f'stress{number}', f'Stress Employee {number}') for number in range(EMPLOYEES)])
+    conn.commit()
+    conn.close()
+
+def everyone_scans(workers, employees, barcodes):
+    # Every thread (on both workers) tries to check out every tool, in a different order
+    # Returns {barcode: [employee_id of each OK checkout]}
+    winners = {barcode: [] for barcode in barcodes}
+    lock = threading.Lock()
+    start = threading.Barrier(len(workers) * THREADS)
+
+    def scan(worker, employee, order):
+        start.wait()
+        for barcode in order:
+            result = worker.process_checkout(employee, barcode)
+            if result.status == CheckoutResult.OK:
+                with lock:
+                    winners[barcode].append(employee.employee_id)
+
+    threads = []
+    for number in range(len(workers) * THREADS):
+        worker = workers[number % len(workers)]
+        employee = employees[number % len(employees)]
+        order = barcodes[number:] + barcodes[:number]
+        threads.append(threading.Thread(target=scan, args=(worker, employee, order)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return winners
+
+def database_matches(workers):
+    # One open checkout per checked out tool, counters right, workers' copies right
+    from summary_counts import summary_differences
+    conn = sqlite3.connect('equipment_checkout.db')
+    tools = dict(conn.execute("SELECT tool_id, IFNULL(checked_out_to, '') FROM tools"))
+    open_checkouts = conn.execute('''
+        SELECT tool_id, employee_id FROM transactions WHERE return_date IS NULL
+    ''').fetchall()
+    check(len(open_checkouts) == len({tool_id for tool_id, employee_id in open_checkouts}),
+          "no tool has two open checkouts")
+    check(all(tools[tool_id] == employee_id for tool_id, employee_id in open_checkouts)
+          and sum(1 for holder in tools.values() if holder) == len(open_checkouts),
+          "every open checkout matches who the tool is out to")
+    check(not summary_differences(conn), "summary counters match a full count")
+    for number, worker in enumerate(workers):
+        worker.refresh()
+        check(all(worker.find_tool_by_id(tool_id).checked_out_to == holder for tool_id, holder in tools.items()),
+              f"worker {number} has the same tool holders as the database")
+    conn.close()
+
+def main():
+    os.chdir(tempfile.mkdtemp(prefix='stress_checkout_'))
+    setup_logging('ERROR')  # Lost races are expected here - don't log each one
+    set_up()
+    from checkout_system import CheckoutSystem
+    worker_a = CheckoutSystem(refresh_interval=3600)
+    worker_b = CheckoutSystem(refresh_interval=3600)
+    workers = [worker_a, worker_b]
+    employees = [worker_a.get_employee(f'SEMP{number:03d}') for number in range(EMPLOYEES)]
+    barcodes = [f'SB{number:06d}' for number in range(TOOLS)]
+
+    print(f"{len(workers)} workers x {THREADS} threads checking out {TOOLS} tools")
+    winners = everyone_scans(workers, employees, barcodes)
+    check(all(len(won) == 1 for won in winners.values()), "exactly one winner per tool")
+    database_matches(workers)
+
+    # Everything back, then the same race again (returns must free every tool)
+    for worker in workers:
+        worker.refresh()
+    by_employee = {}
+    for barcode, won in winners.items():
+        by_employee.setdefault(won[0], []).append(barcode)
+    for employee in employees:
+        if employee.employee_id in by_employee:
+            results = worker_b.process_return_many(employee, by_employee[employee.employee_id])
+            check(all(result.status == CheckoutResult.OK for result in results),
+                  f"{employee.employee_id} returned all {len(results)} tools")
+    winners = everyone_scans(workers, employees, barcodes)
+    check(all(len(won) == 1 for won in winners.values()), "exactly one winner per tool (second round)")
+    database_matches(workers)
+
+    # Stale checkout: A checks out, B returns it and the same employee checks it
+    # out again, A returns it - A must close the new checkout, not the old one
+    employee = worker_a.get_employee('EMP001')
+    first = worker_a.process_checkout(employee, '123456789')
+    worker_b.refresh()
+    worker_b.process_return(employee, '123456789')
+    second = worker_b.process_checkout(employee, '123456789')
+    worker_a.refresh()
+    returned = worker_a.process_return(employee, '123456789')
+    check(returned.status == CheckoutResult.OK and returned.transaction_id == second.transaction_id
+          and first.transaction_id != second.transaction_id,
+          "return after a checkout on another worker closes the newest checkout")
+    database_matches(workers)
+
+    # refresh() lands between the commit and finish_checkouts/finish_returns -
+    # the change must only be applied to our copy once
+    tool = worker_a.find_tool_by_barcode('456789123')
+    results, claims = worker_a.prepare_checkouts(employee, ['456789123'])
+    claimed = worker_a.writer.run_now(lambda conn: worker_a.save_checkouts(conn, employee, claims))
+    worker_a.refresh()
+    checkout = worker_a.finish_checkouts(employee, results, claims, claimed)[0]
+    copies = sum(1 for transaction in worker_a.transactions if transaction.transaction_id == checkout.transaction_id)
+    check(tool.version == claimed[0] and copies == 1
+          and sum(1 for due, transaction_id in worker_a.overdue.heap if transaction_id == checkout.transaction_id) == 1,
+          "checkout applied once when refresh() gets there first")
+    results, returns = worker_a.prepare_returns(employee, ['456789123'])
+    returned = worker_a.writer.run_now(lambda conn: worker_a.save_returns(conn, employee, returns, ""))
+    worker_a.refresh()
+    worker_a.finish_returns(employee, results, returns, returned)
+    check(tool.version == returned[0][1] and tool.status == "available" and tool.tool_id not in worker_a.open_checkouts,
+          "return applied once when refresh() gets there first")
+    database_matches(workers)
+
+    # Another worker sends a checked out tool to maintenance - our copy must
+    # drop the old holder too, not just change the status
+    worker_a.process_checkout(employee, '456789123')
+    conn = sqlite3.connect('equipment_checkout.db')
+    with conn:
+        conn.execute('''UPDATE tools SET status = 'maintenance', checked_out_to = NULL, version = version + 1
+                        WHERE tool_id = ?''', (tool.tool_id,))
+    worker_a.refresh()
+    check(tool.status == "maintenance" and tool.checked_out_to == ""
+          and tool not in worker_a.get_tools_for_employee(employee.employee_id),
+          "tool sent to maintenance elsewhere is no longer out to anyone")
+    with conn:
+        conn.execute('''UPDATE tools SET status = 'checked_out', checked_out_to = ?, version = version + 1
+                        WHERE tool_id = ?''', (employee.employee_id, tool.tool_id))
+    conn.close()
+    worker_a.refresh()
+    check(worker_a.process_return(employee, '456789123').status == CheckoutResult.OK,
+          "tool can be returned once it's back")
+    database_matches(workers)
+
+    for worker in workers:
+        worker.writer.close()
+    print("All passed" if not failures else f"{len(failures)} failed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
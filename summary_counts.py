@@ -0,0 +1,104 @@
+import atexit
+import logging
+import os
+import threading  # The reconciler checks from its own thread
+import time
+from database_pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+# tool_counts and employee_checkouts are kept up to date by triggers (migration 12)
+# on every checkout, return and catalog change, so the dashboard reads a few
+# rows instead of counting the tools. This checks them against the real tables
+# every so often (seconds, set ECS_RECONCILE_INTERVAL=0 to turn it off)
+RECONCILE_INTERVAL = float(os.environ.get('ECS_RECONCILE_INTERVAL', '300'))
+
+# What the summary tables should hold, counted from scratch
+TOOL_COUNTS_QUERY = '''
+    SELECT IFNULL(category, ''), IFNULL(status, ''), COUNT(*) FROM tools GROUP BY 1, 2
+'''
+OPEN_CHECKOUTS_QUERY = '''
+    SELECT employee_id, COUNT(*) FROM transactions WHERE return_date IS NULL GROUP BY employee_id
+'''
+
+def rebuild_summary_counts(conn):
+    # Count everything again and replace what's in the summary tables
+    # Run inside a write transaction so nothing changes between the count and the save
+    conn.execute('DELETE FROM tool_counts')
+    conn.execute(f'INSERT INTO tool_counts (category, status, tools) {TOOL_COUNTS_QUERY}')
+    conn.execute('DELETE FROM employee_checkouts')
+    conn.execute(f'INSERT INTO employee_checkouts (employee_id, open_checkouts) {OPEN_CHECKOUTS_QUERY}')
+
+def summary_differences(conn):
+    # Rows where the summary tables don't match a fresh count: [(key, stored, actual)]
+    # Zero rows are left behind when the last tool/checkout moves away - same as missing
+    differences = []
+    for stored_sql, actual_sql in [
+            ('SELECT category, status, tools FROM tool_counts', TOOL_COUNTS_QUERY),
+            ('SELECT employee_id, open_checkouts FROM employee_checkouts', OPEN_CHECKOUTS_QUERY)]:
+        stored = {row[:-1]: row[-1] for row in conn.execute(stored_sql) if row[-1]}
+        actual = {row[:-1]: row[-1] for row in conn.execute(actual_sql)}
+        for key in stored.keys() | actual.keys():
+            if stored.get(key, 0) != actual.get(key, 0):
+                differences.append((key, stored.get(key, 0), actual.get(key, 0)))
+    return differences
+
+class SummaryReconciler:
+    # Every `interval` seconds, checks the summary tables against the base tables
+    # and rebuilds them if they've drifted (a write that went around the
+    # triggers - a restored backup, someone editing the file by hand...)
+    # The check reads in one transaction, so it sees the summary and base
+    # tables at the same moment and doesn't hold up writers (WAL); only a
+    # rebuild goes through the writer
+    def __init__(self, db_name, writer, interval=RECONCILE_INTERVAL):
+        self.pool = get_pool(db_name)
+        self.writer = writer            # CheckoutSystem's DatabaseWriter, for the rebuild
+        self.interval = interval
+        self.stats = {'checks': 0, 'rebuilds': 0, 'last_check_time': 0.0}
+        self.running = interval > 0
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name="SummaryReconciler", daemon=True)
+        if self.running:
+            self.thread.start()
+            atexit.register(self.close)
+
+    def reconcile(self):
+        # Check once now - returns the differences found (empty list = all good)
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')  # One snapshot for both sides of the comparison
+            try:
+                differences = summary_differences(conn)
+            finally:
+                conn.rollback()
+        self.stats['checks'] += 1
+        self.stats['last_check_time'] = time.perf_counter() - started
+        if differences:
+            logger.warning("Summary counts were off in %d places (e.g. %s stored %d, actually %d) - rebuilding",
+                           len(differences), *differences[0])
+            self.writer.run_now(rebuild_summary_counts)
+            self.stats['rebuilds'] += 1
+        return differences
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(self.interval)
+                if not self.running:
+                    break
+            try:
+                self.reconcile()
+            except Exception as error:
+                logger.error("Could not check the summary counts: %s", error)
\ No newline at end of file
@@ -0,0 +1,27 @@
+import time
+from datetime import datetime, timedelta
+
+# Times are stored as Unix seconds (INTEGER columns, plain ints on the records)
+# They sort and compare as numbers, so date ranges are index range scans and
+# "how long was it out" is just return_date - checkout_date, even in SQL.
+# They only get turned into text when shown to a person (format_time)
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'  # What the report date filters take
+
+def now():
+    return int(time.time())
+
+def format_time(seconds):
+    # Unix seconds -> local 'YYYY-MM-DD HH:MM:SS' ("" for no time)
+    if not seconds:
+        return ""
+    return time.strftime(DISPLAY_FORMAT, time.localtime(seconds))
+
+def day_start(date_text):
+    # 'YYYY-MM-DD' -> Unix seconds at local midnight at the start of that day
+    # Raises ValueError if it isn't a date
+    return int(datetime.strptime(date_text, DATE_FORMAT).timestamp())
+
+def day_end(date_text):
+    # 'YYYY-MM-DD' -> Unix seconds at the midnight after that day (so the whole day is included)
+    return int((datetime.strptime(date_text, DATE_FORMAT) + timedelta(days=1)).timestamp())
\ No newline at end of file
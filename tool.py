@@ -1,4 +1,15 @@
+import logging
+
+# Messages go through logging (see logging_setup.py) instead of print so they
+# can be turned off and don't slow down checkouts
+logger = logging.getLogger(__name__)
+
 class Tool:
+    # __slots__ means no per-object __dict__ - saves memory when we load the
+    # whole catalog (every attribute a Tool has must be listed here)
+    __slots__ = ('tool_id', 'barcode', 'tool_name', 'category', 'status', 'condition',
+                 'checked_out_to', 'version', 'status_listener')
+
     def __init__(self, tool_id="", tool_name="", barcode=""):
         # Basic tool properties
         self.tool_id = tool_id
@@ -10,34 +21,48 @@ class Tool:
         # Condition can be: good, damaged, broken
         self.condition = "good"    # Default to good condition
         self.checked_out_to = ""   # Employee ID who has it
+        self.version = 0           # Goes up by one every time the database row changes
+        # Optional callback so CheckoutSystem can keep its indexes up to date
+        # Gets called as status_listener(tool, old_checked_out_to)
+        self.status_listener = None
     
     def scan_barcode(self, scanned_code):
         # Simulate barcode scanning
         # In real system this would connect to actual scanner
         if scanned_code == self.barcode:
-            print(f"Barcode scan successful for {self.tool_name}")
+            logger.debug("Barcode scan successful for %s", self.tool_name)
             return True
         else:
-            print("Barcode scan failed")
+            logger.debug("Barcode scan failed")
             return False
         
     def check_availability(self):
         # Make sure tool can be checked out
         # Remember: only available tools can be checked out
         if self.status == "available":
-            print(f"{self.tool_name} is available for checkout")
+            logger.debug("%s is available for checkout", self.tool_name)
             return True
         else:
-            print(f"{self.tool_name} is not available - status: {self.status}")
+            logger.debug("%s is not available - status: %s", self.tool_name, self.status)
             return False
         
     def update_status(self, new_status, employee_id=""):
         # Change tool status and track who has it
         # This is important for accountability
+        old_checked_out_to = self.checked_out_to
         self.status = new_status
         if new_status == "checked_out":
             self.checked_out_to = employee_id  # Remember who took it
-            print(f"{self.tool_name} checked out to employee {employee_id}")
+            logger.debug("%s checked out to employee %s", self.tool_name, employee_id)
         elif new_status == "available":
             self.checked_out_to = ""  # Clear the assignment
-            print(f"{self.tool_name} returned and available")
\ No newline at end of file
+            logger.debug("%s returned and available", self.tool_name)
+        # Let the system know so its lookup indexes don't go stale
+        if self.status_listener:
+            self.status_listener(self, old_checked_out_to)
+
+    def to_dict(self):
+        # Plain dict for the JSON API
+        return {'tool_id': self.tool_id, 'tool_name': self.tool_name, 'barcode': self.barcode,
+                'category': self.category, 'status': self.status, 'condition': self.condition,
+                'checked_out_to': self.checked_out_to, 'version': self.version}
\ No newline at end of file
@@ -1,42 +1,56 @@
-from datetime import datetime  # Need this for timestamps
+import logging
+from id_generator import transaction_ids  # Unique IDs even for checkouts in the same second
+from timestamps import format_time, now   # Times are Unix seconds, only formatted for display
+
+logger = logging.getLogger(__name__)
 
 class Transaction:
+    # No per-object __dict__ - we keep a lot of history in memory for reports
+    __slots__ = ('transaction_id', 'employee_id', 'tool_id', 'checkout_date', 'return_date',
+                 'type', 'notes', 'condition', 'due_date')
+
     def __init__(self):
         # Transaction tracking fields
         self.transaction_id = ""    # Unique ID for this transaction
         self.employee_id = ""       # Who did the transaction
         self.tool_id = ""          # What tool was involved
-        self.checkout_date = ""     # When it was checked out
-        self.return_date = ""       # When it was returned (empty if still out)
+        self.checkout_date = 0      # When it was checked out (Unix time)
+        self.return_date = 0        # When it was returned (0 if still out)
         self.type = ""             # "checkout" or "return"
         self.notes = ""            # Any comments about condition, etc.
+        self.condition = ""        # Tool condition when it came back
+        self.due_date = 0          # Unix time it should be back by (0 = no due date)
     
-    def create_checkout(self, employee_id, tool_id):
+    def create_checkout(self, employee_id, tool_id, loan_seconds=0):
         # Create a new checkout transaction
-        # Generate unique ID using current timestamp
-        self.transaction_id = f"TXN{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # Generate unique ID - time ordered, so newer transactions sort after older ones
+        self.transaction_id = transaction_ids.next_id()
         self.employee_id = employee_id
         self.tool_id = tool_id
         # Store exact time of checkout - this is important for tracking
-        self.checkout_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.checkout_date = now()
+        # Due back loan_seconds from now (CheckoutSystem works it out from the tool's category)
+        if loan_seconds:
+            self.due_date = self.checkout_date + loan_seconds
         self.type = "checkout"
         
-        # Print confirmation so we know it worked
-        print(f"Checkout transaction created: {self.transaction_id}")
-        print(f"Employee {employee_id} checked out tool {tool_id}")
+        # Log confirmation so we know it worked (DEBUG level, off by default)
+        logger.debug("Checkout transaction created: %s - employee %s checked out tool %s",
+                     self.transaction_id, employee_id, tool_id)
         return self.transaction_id
         
     def process_return(self, condition="good", notes=""):
         # Update transaction when tool is returned
-        # TODO: Maybe save this back to database later
-        self.return_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # CheckoutSystem saves this back to the database
+        self.return_date = now()
         self.type = "return"  # Change type to show it's been returned
         self.notes = notes    # Save any notes about condition
+        self.condition = condition
         
-        print(f"Return processed for transaction {self.transaction_id}")
-        print(f"Tool returned in {condition} condition")
+        logger.debug("Return processed for transaction %s - tool returned in %s condition",
+                     self.transaction_id, condition)
         if notes:
-            print(f"Notes: {notes}")  # Show notes if there are any
+            logger.debug("Notes: %s", notes)  # Show notes if there are any
         
     def get_history(self):
         # Return formatted string with transaction details
@@ -44,7 +58,9 @@ class Transaction:
         history = f"Transaction ID: {self.transaction_id}\n"
         history += f"Employee: {self.employee_id}\n"
         history += f"Tool: {self.tool_id}\n"
-        history += f"Checkout: {self.checkout_date}\n"
+        history += f"Checkout: {format_time(self.checkout_date)}\n"
+        if self.due_date:
+            history += f"Due: {format_time(self.due_date)}\n"
         if self.return_date:
-            history += f"Return: {self.return_date}\n"
+            history += f"Return: {format_time(self.return_date)}\n"
         return history
\ No newline at end of file
@@ -1,46 +1,100 @@
 # Import Flask components we need for the web server
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template, request, redirect, url_for, session, Response, stream_with_context, jsonify
 # Flask - main web framework for creating web applications
-# render_template - for loading HTML files (not using this yet but might later)
+# render_template - fills in an HTML page from the templates folder
 # request - to get form data from POST requests (username, password, etc.)
 # redirect - to send user to different pages after actions
 # url_for - to generate URLs for our routes safely
+# session - signed cookie that remembers who is logged in on each browser
+# Response/stream_with_context - send big downloads a piece at a time
+from markupsafe import Markup  # Marks HTML we rendered ourselves as safe (comes with Flask)
+import json
+import logging
+import os       # To read the secret key from the environment
+import secrets  # To make a random secret key if one isn't set
 
 # Import our custom classes that handle the business logic
+from logging_setup import setup_logging     # Log through a background queue instead of print
 from checkout_system import CheckoutSystem  # Main system that handles login, checkout, return
-from report import Report                   # Handles generating different types of reports
+from checkout_result import CheckoutResult  # What happened for each checkout/return
+from event_broker import Subscription       # Live tool updates for the event stream
+from fragment_cache import FragmentCache    # Reuses rendered HTML until the catalog changes
+from report import Report, EXPORT_FORMATS   # Handles generating different types of reports
+from analytics import UtilizationReport     # Hours out, peak use and return condition per tool/category
+from passwords import LoginBusyError        # Raised when too many logins are waiting
+from timestamps import format_time          # Dates are Unix seconds until they're shown
+
+# Set up logging before anything else starts writing messages
+# ECS_LOG_LEVEL=WARNING turns off the per-checkout messages
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # Create the Flask web application instance
 app = Flask(__name__)  # This creates our web server
+# Secret key signs the session cookie so users can't edit it
+# Every worker process must use the same key, so set ECS_SECRET_KEY when
+# running more than one (gunicorn -w N); otherwise each start picks a random one
+app.secret_key = os.environ.get('ECS_SECRET_KEY')
+if not app.secret_key:
+    logger.warning("ECS_SECRET_KEY not set - using a random key (sessions reset on restart)")
+    app.secret_key = secrets.token_hex(32)
+
+# Pages live in templates/ and are compiled once, right here at startup
+# Debug mode would otherwise check every template file for changes on every
+# page - restart the server after editing a template
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+# {{ transaction.checkout_date|time }} - Unix seconds to 'YYYY-MM-DD HH:MM:SS'
+app.jinja_env.filters['time'] = format_time
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
 
 # Create system components that will stay alive while server runs
 # These are like global objects that all pages can use
-system = CheckoutSystem()  # Handles all the business logic - login, checkout, return
+# Login state is NOT kept in here - it lives in each user's session
+# CheckoutSystem handles all the business logic - login, checkout, return
+# ECS_REFRESH_INTERVAL = how many seconds this worker's copy of the tools can be
+# behind changes made by other workers (default 2)
+system = CheckoutSystem(refresh_interval=float(os.environ.get('ECS_REFRESH_INTERVAL', '2')))
 report = Report()          # Handles generating reports for management
+utilization = UtilizationReport()  # Tool utilization (hours out, peak use) for management
+fragments = FragmentCache()  # Rendered dropdowns/tables, rebuilt when the catalog version changes
+REPORT_PAGE_SIZE = 100     # Rows per page on the report pages
+UTILIZATION_TOOL_ROWS = 100  # Busiest tools listed on the utilization report
+MAX_BATCH_SIZE = 200       # Most barcodes accepted in one batch scan
+RETURN_CONDITIONS = ("good", "damaged", "broken")
+API_MAX_PAGE_SIZE = 500    # Most rows one JSON API page can ask for
+KEEPALIVE_SECONDS = 15     # Send something this often so proxies keep event streams open
+
+def get_logged_in_employee():
+    # Look up the employee for this browser's session (None if not logged in)
+    employee_id = session.get('employee_id')
+    if not employee_id:
+        return None
+    employee = system.get_employee(employee_id)
+    if not employee:
+        session.clear()  # Account was deactivated - log them out
+    return employee
+
+def cached_fragment(key, template_name, build_context):
+    # Render template_name once per catalog version and reuse the HTML
+    # build_context() only runs when the cached copy is out of date
+    change_seq, changed_at = system.get_catalog_state()
+    html = fragments.get(key, change_seq, lambda: render_template(template_name, **build_context()))
+    return Markup(html)
+
+def message_page(heading, message, links, status=200):
+    # Simple page with one message and some links (success/failure pages)
+    return render_template('message.html', heading=heading, message=message, links=links), status
+
+@app.before_request
+def refresh_tools():
+    # Pick up tool changes from other worker processes (only once in a while)
+    system.refresh_if_stale()
 
 # Home page - shows login form
 @app.route('/')  # This means when someone goes to localhost:5000/ they get this page
 def home():
-    # Return HTML as a string - not the prettiest but it works for now
-    # TODO: Maybe move to separate HTML files later if we have time
-    return '''
-    <html>
-    <head><title>Equipment Checkout System</title></head>
-    <body>
-        <h2>Equipment Checkout System</h2>
-        <h3>Employee Login</h3>
-        <form method="POST" action="/login">
-            <p>Username: <input type="text" name="username" required></p>
-            <p>Password: <input type="password" name="password" required></p>
-            <p><input type="submit" value="Login"></p>
-        </form>
-        <h4>Test Accounts:</h4>
-        <p><strong>employee1</strong> / password123 (John Smith - Level 2)</p>
-        <p><strong>employee2</strong> / password456 (Jane Doe - Level 3)</p>
-        <p><strong>manager1</strong> / manager123 (Bob Johnson - Manager)</p>
-    </body>
-    </html>
-    '''
+    return render_template('login.html')
 
 # Handle login form submission
 @app.route('/login', methods=['POST'])  # Only accepts POST requests (form submissions)
@@ -50,185 +104,92 @@ def login():
     password = request.form['password']  # Extract password from form data
     
     # Try to authenticate with our checkout system
-    if system.authenticate_user(username, password):
+    try:
+        employee = system.authenticate_user(username, password)
+    except LoginBusyError:
+        # Lots of people logging in at once - ask them to try again shortly
+        return message_page("System Busy", "Too many logins right now - please try again in a moment",
+                            [('/', 'Try Again')], 503)
+    if employee:
+        # Remember who this is in their own session cookie
+        session.clear()
+        session['employee_id'] = employee.employee_id
         # Success! Redirect to main dashboard
         return redirect(url_for('dashboard'))  # url_for is safer than hardcoding "/dashboard"
     else:
         # Login failed - show error message and link back to login
-        return '''
-        <html>
-        <body>
-            <h2>Login Failed</h2>
-            <p>Invalid username or password</p>
-            <p><a href="/">Try Again</a></p>
-        </body>
-        </html>
-        '''
+        return message_page("Login Failed", "Invalid username or password", [('/', 'Try Again')])
 
 # Main dashboard after successful login
 @app.route('/dashboard')
 def dashboard():
     # Security check - make sure user is actually logged in
     # Remember: always validate this on every protected page!
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))  # Send back to login if not authenticated
     
-    # Show main menu with user's name - using f-string to insert variables
-    return f'''
-    <html>
-    <head><title>Dashboard</title></head>
-    <body>
-        <h2>Equipment Checkout System</h2>
-        <p>Welcome, {system.current_user.name} ({system.current_user.employee_id})</p>
-        
-        <h3>Actions:</h3>
-        <p><a href="/checkout">Checkout Tool</a></p>
-        <p><a href="/return">Return Tool</a></p>
-        <p><a href="/reports">Generate Reports</a></p>
-        <p><a href="/logout">Logout</a></p>
-    </body>
-    </html>
-    '''
+    # Show main menu with user's name, plus the tool counters
+    # (summary tables - a few rows read however big the catalog gets)
+    return render_template('dashboard.html', employee=employee, counts=report.get_tool_status_counts(),
+                           open_checkouts=report.get_open_checkout_count(employee.employee_id))
 
 # Checkout page - show available tools in a dropdown
 @app.route('/checkout')
 def checkout():
     # Always check authentication first - this is important for security
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
-    # Get list of tools that are available for checkout
-    # Using list comprehension to filter only available tools
-    available_tools = [tool for tool in system.tools if tool.status == "available"]
-    
-    # Build HTML option tags for the dropdown - probably a better way to do this
-    tool_options = ""
-    for tool in available_tools:
-        tool_options += f'<option value="{tool.barcode}">{tool.tool_name} (ID: {tool.tool_id})</option>'
-    
-    return f'''
-    <html>
-    <head><title>Checkout Tool</title></head>
-    <body>
-        <h2>Checkout Tool</h2>
-        <p>Employee: {system.current_user.name}</p>
-        
-        <form method="POST" action="/process_checkout">
-            <p>Select Tool to Checkout:</p>
-            <select name="barcode" required>
-                <option value="">-- Choose a Tool --</option>
-                {tool_options}
-            </select>
-            <p><input type="submit" value="Checkout Tool"></p>
-        </form>
-        
-        <p><a href="/dashboard">Back to Dashboard</a></p>
-    </body>
-    </html>
-    '''
+    # The dropdown is the same for everyone, so it's rendered once and reused
+    # until a tool changes (with thousands of tools this is most of the page)
+    tool_options = cached_fragment(
+        ('available_tool_options',), 'tool_options.html',
+        lambda: {'tools': [tool for tool in system.tools if tool.status == "available"]})
+    return render_template('checkout.html', employee=employee, tool_options=tool_options)
 
 # Process the actual checkout when form is submitted
 @app.route('/process_checkout', methods=['POST'])
 def process_checkout():
     # Security check again - every protected route needs this
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
     # Get the barcode from the form submission
     barcode = request.form['barcode']
     
     # Try to checkout the tool using our business logic
-    if system.process_checkout(barcode):
-        # Find the tool object (not really using this but might be useful later)
-        tool = system.find_tool_by_barcode(barcode)
-
+    result = system.process_checkout(employee, barcode)
+    if result:
         # Success! Show confirmation message
-        return f'''
-        <html>
-        <body>
-            <h2>Checkout Successful!</h2>
-            <p>Tool {barcode} has been checked out to {system.current_user.name}</p>
-            <p><a href="/checkout">Checkout Another Tool</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
+        return message_page("Checkout Successful!", f"Tool {barcode} has been checked out to {employee.name}",
+                            [('/checkout', 'Checkout Another Tool'), ('/dashboard', 'Back to Dashboard')])
     else:
-        # Failed - tool might be unavailable or not found
-        return '''
-        <html>
-        <body>
-            <h2>Checkout Failed</h2>
-            <p>Tool not available or not found</p>
-            <p><a href="/checkout">Try Again</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
+        # Failed - result.message says why (not found, unavailable, someone beat us to it)
+        return message_page("Checkout Failed", result.message,
+                            [('/checkout', 'Try Again'), ('/dashboard', 'Back to Dashboard')])
 
 # Return page - show tools that current user has checked out
 @app.route('/return')
 def return_tool():
     # Authentication check - getting tired of writing this but it's necessary
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
     # Find tools that are checked out to the current user
-    # Only show tools this employee actually has
-    my_tools = [tool for tool in system.tools if tool.checked_out_to == system.current_user.employee_id]
-    
-    # If user has no tools checked out, show message
-    if not my_tools:
-        return f'''
-        <html>
-        <body>
-            <h2>Return Tool</h2>
-            <p>Employee: {system.current_user.name}</p>
-            <p><strong>You have no tools checked out.</strong></p>
-            <p><a href="/checkout">Checkout a Tool</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
-    
-    # Build dropdown options for tools this user can return
-    tool_options = ""
-    for tool in my_tools:
-        tool_options += f'<option value="{tool.barcode}">{tool.tool_name} (ID: {tool.tool_id})</option>'
-    
-    return f'''
-    <html>
-    <body>
-        <h2>Return Tool</h2>
-        <p>Employee: {system.current_user.name}</p>
-        
-        <form method="POST" action="/process_return">
-            <p>Select Tool to Return:</p>
-            <select name="barcode" required>
-                <option value="">-- Choose a Tool --</option>
-                {tool_options}
-            </select>
-            
-            <p>Tool Condition:</p>
-            <select name="condition" required>
-                <option value="good">Good</option>
-                <option value="damaged">Damaged</option>
-                <option value="broken">Broken</option>
-            </select>
-            
-            <p><input type="submit" value="Return Tool"></p>
-        </form>
-        
-        <p><a href="/dashboard">Back to Dashboard</a></p>
-    </body>
-    </html>
-    '''
+    # Only show tools this employee actually has (short list - not cached)
+    my_tools = system.get_tools_for_employee(employee.employee_id)
+    return render_template('return.html', employee=employee, tools=my_tools, conditions=RETURN_CONDITIONS)
 
 # Process the actual return when form is submitted
 @app.route('/process_return', methods=['POST'])
 def process_return():
     # Yet another authentication check - maybe there's a better way to do this
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
     # Get form data - barcode and condition
@@ -236,120 +197,373 @@ def process_return():
     condition = request.form['condition']
     
     # Try to process the return
-    if system.process_return(barcode, condition):
+    result = system.process_return(employee, barcode, condition)
+    if result:
         # Success message
-        return f'''
-        <html>
-        <body>
-            <h2>Return Successful!</h2>
-            <p>Tool {barcode} has been returned in {condition} condition</p>
-            <p><a href="/return">Return Another Tool</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
+        return message_page("Return Successful!", f"Tool {barcode} has been returned in {condition} condition",
+                            [('/return', 'Return Another Tool'), ('/dashboard', 'Back to Dashboard')])
     else:
         # Error - tool not found or not checked out to this user
-        return '''
-        <html>
-        <body>
-            <h2>Return Failed</h2>
-            <p>Tool not found or not checked out to you</p>
-            <p><a href="/return">Try Again</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
+        return message_page("Return Failed", result.message,
+                            [('/return', 'Try Again'), ('/dashboard', 'Back to Dashboard')])
+
+# Batch scan page - scan a whole job's worth of tools into one box
+@app.route('/batch')
+def batch():
+    employee = get_logged_in_employee()
+    if not employee:
+        return redirect(url_for('home'))
+    return render_template('batch.html', employee=employee, max_batch_size=MAX_BATCH_SIZE,
+                           conditions=RETURN_CONDITIONS)
+
+# Process a batch scan - every tool goes to the database in one commit
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    employee = get_logged_in_employee()
+    if not employee:
+        return redirect(url_for('home'))
+
+    action = request.form.get('action', 'checkout')
+    condition = request.form.get('condition', 'good')
+    if action not in ('checkout', 'return') or condition not in RETURN_CONDITIONS:
+        return "Unknown batch action or condition", 400
+
+    # One barcode per line, optionally followed by a condition ("TOOL003, damaged")
+    barcodes = []
+    conditions = {}
+    for line in request.form.get('barcodes', '').splitlines():
+        parts = line.replace(',', ' ').split()
+        if not parts:
+            continue  # Blank line from the scanner
+        barcodes.append(parts[0])
+        if len(parts) > 1 and parts[1].lower() in RETURN_CONDITIONS:
+            conditions[parts[0]] = parts[1].lower()
+    if len(barcodes) > MAX_BATCH_SIZE:
+        return f"Too many barcodes in one batch (limit is {MAX_BATCH_SIZE})", 400
+
+    if action == 'checkout':
+        results = system.process_checkout_many(employee, barcodes)
+    else:
+        results = system.process_return_many(employee, barcodes, condition, conditions=conditions)
+    return render_template('batch_result.html', employee=employee, action=action, results=results)
 
 # Reports menu page
 @app.route('/reports')
 def reports():
     # Authentication check (getting repetitive but necessary)
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
     # Show available report types
-    return f'''
-    <html>
-    <body>
-        <h2>Generate Reports</h2>
-        <p>Employee: {system.current_user.name}</p>
-        
-        <h3>Available Reports:</h3>
-        <p><a href="/generate_report/tools">Tool Status Report</a></p>
-        <p><a href="/generate_report/checkout">Checkout Report</a></p>
-        
-        <p><a href="/dashboard">Back to Dashboard</a></p>
-    </body>
-    </html>
-    '''
+    return render_template('reports.html', employee=employee)
 
 # Generate specific reports based on type
 @app.route('/generate_report/<report_type>')  # <report_type> is a variable from the URL
 def generate_report(report_type):
     # Authentication check once more
-    if not system.current_user or not system.current_user.is_logged_in:
+    employee = get_logged_in_employee()
+    if not employee:
         return redirect(url_for('home'))
     
     # Generate different reports based on what was requested
+    # Counting and filtering happen in the database, and only one page of rows
+    # is loaded at a time - so these stay fast with millions of transactions
+    after = request.args.get('after', '')  # Last row of the previous page
     if report_type == 'tools':
-        # Tool status report - show all tools and their current status
-        report_html = '''
-        <html>
-        <body>
-            <h2>Tool Status Report</h2>
-            <table border="1">
-                <tr><th>Tool ID</th><th>Tool Name</th><th>Status</th><th>Condition</th></tr>
-        '''
-        # Loop through all tools and add table rows
-        for tool in system.tools:
-            report_html += f'<tr><td>{tool.tool_id}</td><td>{tool.tool_name}</td><td>{tool.status}</td><td>{tool.condition}</td></tr>'
-        
-        # Close the table and add navigation links
-        report_html += '''
-            </table>
-            <p><a href="/reports">Generate Another Report</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
-        return report_html
+        # Tool status report - totals by status plus one page of tools
+        # Only changes when a tool does, so each page/filter is cached until then
+        status = request.args.get('status', '')
+
+        def build_context():
+            tools = report.get_tools_page(after=after, page_size=REPORT_PAGE_SIZE, status=status or None)
+            # Link to the next page only if this one was full
+            next_after = tools[-1]['tool_id'] if len(tools) == REPORT_PAGE_SIZE else None
+            return {'counts': report.get_tool_status_counts(), 'tools': tools,
+                    'status': status, 'next_after': next_after}
+        status_table = cached_fragment(('tool_status_table', status, after), 'tool_status_table.html', build_context)
+        return render_template('tool_report.html', status_table=status_table)
     
     elif report_type == 'checkout':
-        # Checkout report - show all transactions
-        report_html = '''
-        <html>
-        <body>
-            <h2>Checkout Report</h2>
-            <table border="1">
-                <tr><th>Transaction ID</th><th>Employee</th><th>Tool</th><th>Date</th></tr>
-        '''
-        # Loop through all transactions and add table rows
-        for transaction in system.transactions:
-            report_html += f'<tr><td>{transaction.transaction_id}</td><td>{transaction.employee_id}</td><td>{transaction.tool_id}</td><td>{transaction.checkout_date}</td></tr>'
-        
-        # Close table and add navigation
-        report_html += '''
-            </table>
-            <p><a href="/reports">Generate Another Report</a></p>
-            <p><a href="/dashboard">Back to Dashboard</a></p>
-        </body>
-        </html>
-        '''
-        return report_html
+        # Checkout report - filter by employee and date range (YYYY-MM-DD)
+        employee_id = request.args.get('employee_id', '')
+        start_date = request.args.get('start_date', '')
+        end_date = request.args.get('end_date', '')
+        filters = {'employee_id': employee_id or None, 'start_date': start_date or None,
+                   'end_date': end_date or None}
+        try:
+            counts = report.get_checkout_counts(**filters)
+        except ValueError as error:
+            return message_page("Checkout Report", str(error),
+                                [('/generate_report/checkout', 'Try Again')], 400)
+        transactions = report.get_transactions_page(after=after, page_size=REPORT_PAGE_SIZE, **filters)
+        next_after = transactions[-1]['transaction_id'] if len(transactions) == REPORT_PAGE_SIZE else None
+        return render_template('checkout_report.html', counts=counts, transactions=transactions,
+                               employee_id=employee_id, start_date=start_date, end_date=end_date,
+                               next_after=next_after)
+
+    return "Unknown report type", 404
+
+# Tool utilization report - how much each tool and category gets used
+# Defaults to the last 30 days; start_date/end_date (YYYY-MM-DD) pick another window
+@app.route('/reports/utilization')
+def utilization_report():
+    employee = get_logged_in_employee()
+    if not employee:
+        return redirect(url_for('home'))
+
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+    try:
+        usage = utilization.get_utilization(start_date or None, end_date or None)
+    except ValueError as error:
+        return message_page("Utilization Report", str(error), [('/reports/utilization', 'Try Again')], 400)
+    return render_template('utilization.html', usage=usage, conditions=RETURN_CONDITIONS,
+                           tools=usage['tools'][:UTILIZATION_TOOL_ROWS],
+                           start_date=start_date, end_date=end_date)
+
+# Download the full checkout history (same filters as the checkout report)
+@app.route('/export/checkout.<export_format>')
+def export_checkout(export_format):
+    employee = get_logged_in_employee()
+    if not employee:
+        return redirect(url_for('home'))
+    if export_format not in EXPORT_FORMATS:
+        return "Unknown export format", 404
+
+    # Stream the file out as rows come from the database - nothing gets
+    # built up in memory, so this works for any size of history
+    filters = {'start_date': request.args.get('start_date') or None,
+               'end_date': request.args.get('end_date') or None,
+               'employee_id': request.args.get('employee_id') or None}
+    try:
+        report.transaction_filters(**filters)  # Bad dates - say so now, not halfway through the download
+    except ValueError as error:
+        return str(error), 400
+    chunks = report.iter_export_chunks(export_format, **filters)
+    return Response(stream_with_context(chunk for chunk, rows_in_chunk in chunks),
+                    mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename=checkout_history.{export_format}'})
+
+# Live tool updates (Server-Sent Events) - the checkout page listens to this
+# and adds/removes tools in its dropdown as they are checked out and returned,
+# instead of people reloading the whole page to see if a drill came back
+# Each event is one tool: {"tool_id", "barcode", "tool_name", "status", "checked_out_to", "condition"}
+# A "reset" event means we couldn't send everything - reload the page
+@app.route('/events/tools')
+def tool_events():
+    if not get_logged_in_employee():
+        return "Not logged in", 401
+    subscription = system.events.subscribe(request.headers.get('Last-Event-ID'))
+    if subscription is None:
+        return "Too many live connections - reload the page to see changes", 503
+
+    def stream():
+        # A waiting connection just sleeps on its queue; it only wakes up to
+        # check for changes from other worker processes every refresh_interval
+        # (changes made in this process arrive straight away)
+        wait = min(system.refresh_interval, KEEPALIVE_SECONDS) or KEEPALIVE_SECONDS
+        quiet_for = 0.0
+        try:
+            yield "retry: 3000\n\n"  # Browser reconnects after 3 seconds if we drop
+            while True:
+                item = subscription.get(timeout=wait)
+                if item is None:
+                    system.refresh_if_stale()  # Anything found gets published to us
+                    quiet_for += wait
+                    if quiet_for >= KEEPALIVE_SECONDS:
+                        quiet_for = 0.0
+                        yield ": keepalive\n\n"  # Comment line - browsers ignore it
+                    continue
+                if item == Subscription.RESET:
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                event_id, event = item
+                quiet_for = 0.0
+                yield f"id: {event_id}\nevent: tool\ndata: {json.dumps(event)}\n\n"
+        finally:
+            subscription.close()  # Browser went away (or we told it to reset)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Logout functionality
 @app.route('/logout')
 def logout():
-    # Clean up the current user session
-    if system.current_user:
-        system.current_user.logout()  # Call logout method on user
-        system.current_user = None    # Clear the current user
+    # Clean up this browser's session - other users stay logged in
+    session.clear()
     return redirect(url_for('home'))  # Send back to login page
 
+# ---------------- JSON API ----------------
+# The same things the pages above do, as JSON, so the handheld scanners and
+# dashboards don't have to scrape HTML. Log in with POST /api/login (or the
+# normal login page) - the same session cookie works for both.
+# POSTs must be sent as application/json, which a form on another site can't
+# do, so the session cookie can't be used against us from somewhere else
+
+# HTTP status for a single checkout/return that didn't work
+RESULT_HTTP_STATUS = {
+    CheckoutResult.OK: 200,
+    CheckoutResult.NOT_LOGGED_IN: 401,
+    CheckoutResult.NOT_FOUND: 404,
+    CheckoutResult.UNAVAILABLE: 409,
+    CheckoutResult.CONFLICT: 409,
+    CheckoutResult.NOT_CHECKED_OUT_TO_USER: 403,
+    CheckoutResult.DUPLICATE: 400,
+}
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+def api_page_size():
+    # ?limit= from the URL, kept between 1 and API_MAX_PAGE_SIZE (None if not a number)
+    try:
+        page_size = int(request.args.get('limit', REPORT_PAGE_SIZE))
+    except ValueError:
+        return None
+    return max(1, min(page_size, API_MAX_PAGE_SIZE))
+
+def api_barcodes(data):
+    # {"barcode": "..."} for one tool or {"barcodes": [...]} for a batch
+    # Returns (barcodes, is_batch, error message or None)
+    if 'barcodes' in data:
+        barcodes = data['barcodes']
+        if not isinstance(barcodes, list) or not all(isinstance(barcode, str) for barcode in barcodes):
+            return None, True, "barcodes must be a list of strings"
+        if len(barcodes) > MAX_BATCH_SIZE:
+            return None, True, f"Too many barcodes in one batch (limit is {MAX_BATCH_SIZE})"
+        return barcodes, True, None
+    if isinstance(data.get('barcode'), str):
+        return [data['barcode']], False, None
+    return None, False, "Send a barcode or a list of barcodes"
+
+def api_results(results, is_batch):
+    if is_batch:
+        return jsonify({'results': [result.to_dict() for result in results],
+                        'succeeded': sum(1 for result in results if result)})
+    return jsonify(results[0].to_dict()), RESULT_HTTP_STATUS.get(results[0].status, 400)
+
+def catalog_response(build_body):
+    # JSON response tagged with the catalog version (catalog_state.change_seq)
+    # Pollers send the ETag back in If-None-Match; while no tool has changed
+    # they get an empty 304 and we never build the body at all
+    change_seq, changed_at = system.get_catalog_state()
+    etag = f"catalog-{change_seq}"
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains(etag)
+    else:
+        # Last-Modified only counts whole seconds - ETag is the one to use
+        unchanged = bool(request.if_modified_since) and changed_at <= request.if_modified_since.timestamp()
+
+    response = Response(status=304) if unchanged else jsonify(build_body(change_seq))
+    response.set_etag(etag)
+    response.last_modified = changed_at
+    response.cache_control.private = True   # Only for the logged in user
+    response.cache_control.no_cache = True  # Always check back, but 304 is fine
+    return response
+
+@app.route('/api/login', methods=['POST'])
+def api_login():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error("Send JSON with username and password", 400)
+    try:
+        employee = system.authenticate_user(str(data.get('username', '')), str(data.get('password', '')))
+    except LoginBusyError:
+        return api_error("Too many logins right now - try again in a moment", 503)
+    if not employee:
+        return api_error("Invalid username or password", 401)
+    session.clear()
+    session['employee_id'] = employee.employee_id
+    return jsonify({'employee_id': employee.employee_id, 'name': employee.name})
+
+@app.route('/api/tools')
+def api_tools():
+    # Tools in tool_id order - pass next_after back as ?after= for the next page
+    if not get_logged_in_employee():
+        return api_error("Not logged in", 401)
+    page_size = api_page_size()
+    if page_size is None:
+        return api_error("limit must be a number", 400)
+    after = request.args.get('after', '')
+    status = request.args.get('status') or None
+    category = request.args.get('category') or None
+
+    def build_body(change_seq):
+        # Same keyset query as the tool report, so the paging can't drift apart
+        tools = report.get_tools_page(after, page_size, status, category)
+        next_after = tools[-1]['tool_id'] if len(tools) == page_size else None
+        return {'tools': tools, 'next_after': next_after, 'catalog_version': change_seq}
+    return catalog_response(build_body)
+
+@app.route('/api/tools/<barcode>')
+def api_tool(barcode):
+    if not get_logged_in_employee():
+        return api_error("Not logged in", 401)
+    tool = system.find_tool_by_barcode(barcode)
+    if not tool:
+        return api_error("Tool not found", 404)
+    return catalog_response(lambda change_seq: tool.to_dict())
+
+@app.route('/api/transactions')
+def api_transactions():
+    # Transactions newest first, same filters as the checkout report
+    if not get_logged_in_employee():
+        return api_error("Not logged in", 401)
+    page_size = api_page_size()
+    if page_size is None:
+        return api_error("limit must be a number", 400)
+    try:
+        transactions = report.get_transactions_page(request.args.get('after', ''), page_size,
+                                                    start_date=request.args.get('start_date') or None,
+                                                    end_date=request.args.get('end_date') or None,
+                                                    employee_id=request.args.get('employee_id') or None)
+    except ValueError as error:
+        return api_error(str(error), 400)
+    # Dates go out as 'YYYY-MM-DD HH:MM:SS' text like they always have ("" if not returned)
+    for transaction in transactions:
+        transaction['checkout_date'] = format_time(transaction['checkout_date'])
+        transaction['return_date'] = format_time(transaction['return_date'])
+    next_after = transactions[-1]['transaction_id'] if len(transactions) == page_size else None
+    return jsonify({'transactions': transactions, 'next_after': next_after})
+
+@app.route('/api/checkout', methods=['POST'])
+def api_checkout():
+    employee = get_logged_in_employee()
+    if not employee:
+        return api_error("Not logged in", 401)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error("Send JSON with barcode or barcodes", 400)
+    barcodes, is_batch, error = api_barcodes(data)
+    if error:
+        return api_error(error, 400)
+    return api_results(system.process_checkout_many(employee, barcodes), is_batch)
+
+@app.route('/api/return', methods=['POST'])
+def api_return():
+    # Optional "condition" for every tool, and "conditions": {"barcode": "damaged"} for some
+    employee = get_logged_in_employee()
+    if not employee:
+        return api_error("Not logged in", 401)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error("Send JSON with barcode or barcodes", 400)
+    barcodes, is_batch, error = api_barcodes(data)
+    if error:
+        return api_error(error, 400)
+    condition = data.get('condition', 'good')
+    conditions = data.get('conditions') or {}
+    if (condition not in RETURN_CONDITIONS or not isinstance(conditions, dict)
+            or not all(value in RETURN_CONDITIONS for value in conditions.values())):
+        return api_error(f"condition must be one of {', '.join(RETURN_CONDITIONS)}", 400)
+    notes = str(data.get('notes', ''))
+    return api_results(system.process_return_many(employee, barcodes, condition, notes, conditions), is_batch)
+
 # Start the web server when this file is run directly
 if __name__ == '__main__':
     print("Starting Equipment Checkout System...")
     print("Open your browser to: http://localhost:5000")
     # debug=True means server restarts when we change code - helpful during development
-    app.run(debug=True)
\ No newline at end of file
+    # threaded=True lets several users be served at the same time
+    app.run(debug=True, threaded=True)
\ No newline at end of file